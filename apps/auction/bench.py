@@ -0,0 +1,394 @@
+import datetime
+import random
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.utils import timezone
+
+from auction.completion import complete_auctions
+from auction.constants import LIVE, BID_CASE_NAMES
+from auction.models import Auction, UFAAuction, Bid
+from auction.scheduler import AuctionScheduler
+from auction.sweeper import EXPIRE_BATCH_SIZE
+from auction.trace import recorder as trace_recorder, schedule_trace
+from fantasyauction.metrics import percentile
+from league.models import League, Season, Roster
+from player.models import Player
+
+#completion paths
+SWEEP = 'sweep' #auction.completion.complete_auctions() in batches, as auction.sweeper.sweep() does
+SCHEDULER = 'scheduler' #auction.scheduler.AuctionScheduler, expire() per auction
+
+#the snipe burst runs this fraction of snipe_seconds past the hot auctions' expiration, so the latest snipes land after it
+SNIPE_OVERRUN = 0.1
+#seconds between checks for due hot auctions while the snipe burst is made
+RACE_POLL_SECONDS = 0.01
+
+class DraftNightBenchmark(object):
+    """ Simulates draft night against the database: a synthetic league with many simultaneous auctions, a storm of
+        bids through Bid.save() (the same path as the site), ending in a burst of last-second snipes on a few auctions,
+        then the completion of every auction.  The snipe burst is made in the final seconds before the hot auctions
+        expire, while they are completed as soon as they are due, so the latest snipes race their completion.  Bids
+        that are rejected (e.g. a full roster, or an auction completed under them) are counted, and the run goes on.  The league and everything in it is deleted afterwards, unless keep is set.
+        The league is created in the configured database, next to any real leagues, and its bids are not recorded to
+        AUCTION_BID_TRACE_FILE
+        Fields:
+            owners, players, auctions, bids - size of the synthetic league and of the bid storm
+            ufa_fraction - fraction of the auctions that are UFAAuctions
+            snipe_fraction - fraction of the bids made in the final burst, all on the snipe_auctions hottest auctions
+            snipe_seconds - the hot auctions are set to expire this many seconds after the burst starts, and its bids
+                are spread over them
+            threads - bidding threads, each with its own database connection
+            completion - SWEEP or SCHEDULER
+    """
+    def __init__(self, owners=12, players=300, auctions=100, bids=2000, ufa_fraction=0.2, snipe_fraction=0.2,
+            snipe_auctions=5, snipe_seconds=2.0, threads=1, completion=SWEEP, seed=None, keep=False):
+        self.owners = owners
+        self.players = players
+        self.auctions = auctions
+        self.bids = bids
+        self.ufa_fraction = ufa_fraction
+        self.snipe_fraction = snipe_fraction
+        self.snipe_auctions = snipe_auctions
+        self.snipe_seconds = snipe_seconds
+        self.threads = threads
+        self.completion = completion
+        self.keep = keep
+        self.random = random.Random(seed)
+        self.name = 'bench-%s' % uuid.uuid4().hex[:8]
+        self.league = None
+
+    def setup(self):
+        """ Creates the league, its owners and rosters, players and LIVE auctions """
+        now = timezone.now()
+        self.league = League.objects.create(name=self.name, size=self.owners, salary_cap=100000, roster_limit=self.players)
+        self.season = Season.objects.create(name=self.name, league=self.league)
+        self.users = [User.objects.create_user('%s-%d' % (self.name, i)) for i in range(self.owners)]
+        Roster.objects.bulk_create([Roster(league=self.league, season=self.season, user=user, salary_cap=100000,
+            total_salary=0, total_players=0) for user in self.users])
+        Player.objects.bulk_create([Player(name='%s-%d' % (self.name, i), team='BEN', position='QB') for i in range(self.players)])
+        self.player_ids = list(Player.objects.filter(name__startswith=self.name + '-').values_list('id', flat=True))
+        expiration_time = now + datetime.timedelta(hours=1)
+        ufa_count = int(self.auctions * self.ufa_fraction)
+        for i in range(ufa_count):
+            UFAAuction.objects.create(league=self.league, season=self.season, player_id=self.player_ids[i % len(self.player_ids)],
+                state=LIVE, start_time=now, expiration_time=expiration_time, original_owner=self.random.choice(self.users),
+                discount_percentage=0.1)
+        Auction.objects.bulk_create([Auction(league=self.league, season=self.season,
+            player_id=self.player_ids[i % len(self.player_ids)], state=LIVE, start_time=now, expiration_time=expiration_time)
+            for i in range(ufa_count, self.auctions)])
+        self.auction_ids = list(Auction.objects.filter(league=self.league).values_list('id', flat=True))
+
+    def plan_bids(self):
+        """ Returns the bids to make, as (auction id, user, max value).  Values climb per auction, with some bids under
+            the high bid's proxy.  The last snipe_fraction of the bids all go to a few auctions, the hot_auctions
+        """
+        levels = dict((auction_id, 0) for auction_id in self.auction_ids)
+        snipe_count = int(self.bids * self.snipe_fraction)
+        self.hot_auctions = self.random.sample(self.auction_ids, min(self.snipe_auctions, len(self.auction_ids)))
+        plan = []
+        for i in range(self.bids):
+            auction_id = self.random.choice(self.hot_auctions if i >= self.bids - snipe_count else self.auction_ids)
+            max_value = max(levels[auction_id] + self.random.randint(-3, 5), 1)
+            levels[auction_id] = max(levels[auction_id], max_value)
+            plan.append((auction_id, self.random.choice(self.users), max_value))
+        return plan
+
+    def run_bids(self, plan, pace=None, racer=None):
+        """ Makes the planned bids through Bid.save(), split across the bidding threads.  With pace, the bids are spread
+            evenly over that many seconds instead of made as fast as possible, and racer is called in the main thread
+            until they are made (between its own bids, with one thread).  Returns (seconds, latencies, query counts), one
+            latency and query count per bid.  Query counts are (proxy case name, count), the case being 'rejected' for
+            bids that were not made - including bids rejected with a ValidationError, which are counted, not raised
+        """
+        latencies = []
+        queries = []
+        start = time.time()
+        def wait(offset):
+            while True:
+                remaining = start + offset - time.time()
+                if remaining <= 0:
+                    return
+                if racer != None and threading.current_thread().name == 'MainThread':
+                    racer()
+                    remaining = start + offset - time.time()
+                    if remaining <= 0:
+                        return
+                time.sleep(min(remaining, RACE_POLL_SECONDS))
+        def bid_worker(bids):
+            use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            try:
+                for index, (auction_id, user, max_value) in bids:
+                    if pace != None:
+                        wait(pace * index / len(plan))
+                    start_queries = len(connection.queries)
+                    bid_start = time.time()
+                    bid = Bid(auction_id=auction_id, bidder=user, time=timezone.now(), max_value=max_value)
+                    try:
+                        bid.save()
+                        case = BID_CASE_NAMES[bid.resolution.case] if bid.resolution != None else 'rejected'
+                    except ValidationError:
+                        case = 'rejected'
+                    latencies.append(time.time() - bid_start)
+                    queries.append((case, len(connection.queries) - start_queries))
+                    del connection.queries[:]
+            finally:
+                connection.use_debug_cursor = use_debug_cursor
+                if threading.current_thread().name != 'MainThread':
+                    connection.close()
+        indexed = list(enumerate(plan))
+        if self.threads <= 1:
+            bid_worker(indexed)
+        else:
+            workers = [threading.Thread(target=bid_worker, args=(indexed[i::self.threads],)) for i in range(self.threads)]
+            for worker in workers:
+                worker.start()
+            while racer != None and any(worker.is_alive() for worker in workers):
+                racer()
+                time.sleep(RACE_POLL_SECONDS)
+            for worker in workers:
+                worker.join()
+        return time.time() - start, sorted(latencies), queries
+
+    def run_snipes(self, snipes):
+        """ Makes the snipe bids in the final snipe_seconds before the hot auctions expire, running SNIPE_OVERRUN past
+            it, while the hot auctions are completed as soon as they are due - the latest snipes race the completion, and
+            are rejected once it wins.  Returns (latencies, query counts, hot auctions completed during the burst), as
+            run_bids
+        """
+        now = timezone.now()
+        expiration_time = now + datetime.timedelta(seconds=self.snipe_seconds)
+        Auction.objects.filter(id__in=self.hot_auctions).update(expiration_time=expiration_time, modified=now)
+        complete_due = self.completer(self.hot_auctions)
+        completed = [0]
+        def racer():
+            completed[0] += complete_due()
+        seconds, latencies, queries = self.run_bids(snipes, pace=self.snipe_seconds * (1 + SNIPE_OVERRUN), racer=racer)
+        #with few snipes, the last may be made before the hot auctions expire
+        remaining = (expiration_time - timezone.now()).total_seconds()
+        if remaining > 0:
+            time.sleep(remaining)
+        racer()
+        return latencies, queries, completed[0]
+
+    def completer(self, auction_ids):
+        """ Returns a function that completes those of auction_ids that are due, through the completion path, and returns
+            the number completed
+        """
+        if self.completion == SCHEDULER:
+            scheduler = AuctionScheduler(clock=timezone.now)
+            for auction_id, state, start_time, expiration_time in Auction.objects.filter(id__in=auction_ids).values_list(
+                    'id', 'state', 'start_time', 'expiration_time'):
+                scheduler.schedule(auction_id, state, start_time, expiration_time)
+            return scheduler.run_pending
+        def complete_due():
+            due_ids = list(Auction.objects.filter(id__in=auction_ids, state=LIVE, expiration_time__lte=timezone.now())
+                .values_list('id', flat=True))
+            completed = 0
+            for batch_start in range(0, len(due_ids), EXPIRE_BATCH_SIZE):
+                completed += complete_auctions(due_ids[batch_start:batch_start + EXPIRE_BATCH_SIZE])
+            return completed
+        return complete_due
+
+    def run_completion(self):
+        """ Makes every auction of the benchmark that is still LIVE due, and completes them all.  Only the benchmark's
+            own auctions are completed, never other due auctions in the database.  Returns (seconds, number completed)
+        """
+        now = timezone.now()
+        Auction.objects.filter(league=self.league, state=LIVE).update(expiration_time=now, modified=now)
+        start = time.time()
+        completed = self.completer(self.auction_ids)()
+        return time.time() - start, completed
+
+    def teardown(self):
+        """ Deletes the league, with its auctions, bids and rosters, and its owners and players """
+        if self.league == None:
+            return
+        Auction.objects.filter(league=self.league).update(high_bid=None)
+        Bid.objects.filter(auction__league=self.league).delete()
+        self.league.delete()
+        User.objects.filter(username__startswith=self.name + '-').delete()
+        Player.objects.filter(name__startswith=self.name + '-').delete()
+        self.league = None
+
+    def run(self):
+        """ Runs the benchmark, and returns its results as a JSON serializable dict """
+        try:
+            with trace_recorder.paused():
+                self.setup()
+                plan = self.plan_bids()
+                snipe_count = int(self.bids * self.snipe_fraction)
+                bid_seconds, latencies, queries = self.run_bids(plan[:len(plan) - snipe_count])
+                snipe_latencies, snipe_queries, snipe_completed = self.run_snipes(plan[len(plan) - snipe_count:])
+                completion_seconds, completed = self.run_completion()
+            all_latencies = sorted(latencies + snipe_latencies)
+            queries += snipe_queries
+        finally:
+            if not self.keep:
+                self.teardown()
+        return {
+            'config': {
+                'owners': self.owners, 'players': self.players, 'auctions': self.auctions, 'bids': self.bids,
+                'ufa_fraction': self.ufa_fraction, 'snipe_fraction': self.snipe_fraction,
+                'snipe_auctions': self.snipe_auctions, 'snipe_seconds': self.snipe_seconds, 'threads': self.threads,
+                'completion': self.completion,
+                'database': connection.vendor,
+            },
+            #the snipes are paced, so throughput is of the bids before them
+            'bids_per_second': len(latencies) / bid_seconds if bid_seconds else None,
+            'latency_ms': _latency_ms(all_latencies),
+            'bids_rejected': len([case for case, count in queries if case == 'rejected']),
+            'queries_per_bid': float(sum(count for case, count in queries)) / len(queries) if queries else None,
+            'queries_per_case': _queries_per_case(queries),
+            'snipes': {
+                'bids': len(snipe_latencies),
+                'latency_ms': _latency_ms(snipe_latencies),
+                'rejected': len([case for case, count in snipe_queries if case == 'rejected']),
+                'auctions_completed': snipe_completed,
+            },
+            'completion_seconds': completion_seconds,
+            'auctions_completed': snipe_completed + completed,
+        }
+
+class TraceReplay(object):
+    """ Replays a bid trace through Bid.save() against a scratch league - one LIVE auction per traced auction, and one
+        owner per traced bidder - and checks each auction ends with the recorded high bid.  Bids are split across the
+        threads by auction, so each auction's bids are made in order, and auctions contend as they did when recorded.
+        The scratch league is created in the configured database, next to any real leagues (point --settings at a copy
+        of the database to keep the replay off it), and is deleted afterwards, unless keep is set.  Replayed bids are not
+        recorded to AUCTION_BID_TRACE_FILE, so a trace is never appended to by its own replay
+        Fields:
+            entries - the TraceEntry list to replay
+            speed - 1 replays at the recorded pace, 10 at ten times it, 0 as fast as possible
+            threads - bidding threads, each with its own database connection
+    """
+    def __init__(self, entries, speed=1.0, threads=1, keep=False):
+        self.entries = entries
+        self.speed = speed
+        self.threads = threads
+        self.keep = keep
+        self.name = 'trace-%s' % uuid.uuid4().hex[:8]
+        self.league = None
+
+    def setup(self):
+        """ Creates the scratch league, and the maps from traced auction and bidder ids to the scratch ones """
+        now = timezone.now()
+        auction_ids = sorted(set(entry.auction_id for entry in self.entries))
+        bidder_ids = sorted(set(entry.bidder_id for entry in self.entries))
+        self.league = League.objects.create(name=self.name, size=len(bidder_ids), salary_cap=100000,
+            roster_limit=len(auction_ids))
+        self.season = Season.objects.create(name=self.name, league=self.league)
+        self.users = dict((bidder_id, User.objects.create_user('%s-%d' % (self.name, bidder_id))) for bidder_id in bidder_ids)
+        Roster.objects.bulk_create([Roster(league=self.league, season=self.season, user=user, salary_cap=100000,
+            total_salary=0, total_players=0) for user in self.users.values()])
+        Player.objects.bulk_create([Player(name='%s-%d' % (self.name, auction_id), team='TRC', position='QB')
+            for auction_id in auction_ids])
+        players = dict(Player.objects.filter(name__startswith=self.name + '-').values_list('name', 'id'))
+        expiration_time = now + datetime.timedelta(days=1)
+        self.auctions = {}
+        for auction_id in auction_ids:
+            self.auctions[auction_id] = Auction.objects.create(league=self.league, season=self.season,
+                player_id=players['%s-%d' % (self.name, auction_id)], state=LIVE, start_time=now,
+                expiration_time=expiration_time).id
+
+    def run_bids(self):
+        """ Makes the traced bids at the replay speed.  Returns (seconds, latencies, seconds the replay fell behind) """
+        schedule = schedule_trace(self.entries)
+        latencies = []
+        lags = []
+        def bid_worker(bids, start):
+            try:
+                for offset, entry in bids:
+                    if self.speed:
+                        lag = time.time() - start - offset / self.speed
+                        if lag < 0:
+                            time.sleep(-lag)
+                        lags.append(max(lag, 0))
+                    bid_start = time.time()
+                    Bid(auction_id=self.auctions[entry.auction_id], bidder=self.users[entry.bidder_id], time=timezone.now(),
+                        max_value=entry.max_value).save()
+                    latencies.append(time.time() - bid_start)
+            finally:
+                if threading.current_thread().name != 'MainThread':
+                    connection.close()
+        start = time.time()
+        if self.threads <= 1:
+            bid_worker(schedule, start)
+        else:
+            shards = [[] for i in range(self.threads)]
+            for offset, entry in schedule:
+                shards[entry.auction_id % self.threads].append((offset, entry))
+            workers = [threading.Thread(target=bid_worker, args=(shard, start)) for shard in shards]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return time.time() - start, sorted(latencies), sorted(lags)
+
+    def check_outcomes(self):
+        """ Returns the traced auction ids whose high bid differs from the recorded outcome """
+        expected = {}
+        for entry in self.entries:
+            if entry.seq >= expected.get(entry.auction_id, (0, None))[0]:
+                expected[entry.auction_id] = (entry.seq, (entry.high_bid_value, self.users[entry.high_bidder_id].id))
+        replayed = dict((auction_id, (high_bid_value, high_bidder_id)) for auction_id, high_bid_value, high_bidder_id in
+            Auction.objects.filter(league=self.league).values_list('id', 'high_bid_value', 'high_bidder'))
+        return sorted(auction_id for auction_id, scratch_id in self.auctions.items()
+            if replayed[scratch_id] != expected[auction_id][1])
+
+    def teardown(self):
+        """ Deletes the scratch league, with its auctions, bids and rosters, and its owners and players """
+        if self.league == None:
+            return
+        Auction.objects.filter(league=self.league).update(high_bid=None)
+        Bid.objects.filter(auction__league=self.league).delete()
+        self.league.delete()
+        User.objects.filter(username__startswith=self.name + '-').delete()
+        Player.objects.filter(name__startswith=self.name + '-').delete()
+        self.league = None
+
+    def run(self):
+        """ Replays the trace, and returns its results as a JSON serializable dict """
+        try:
+            with trace_recorder.paused():
+                self.setup()
+                seconds, latencies, lags = self.run_bids()
+                mismatched = self.check_outcomes()
+        finally:
+            if not self.keep:
+                self.teardown()
+        return {
+            'config': {'bids': len(self.entries), 'auctions': len(self.auctions), 'speed': self.speed,
+                'threads': self.threads, 'database': connection.vendor},
+            'recorded_seconds': schedule_trace(self.entries)[-1][0] if self.entries else 0,
+            'seconds': seconds,
+            'bids_per_second': len(latencies) / seconds if seconds else None,
+            'latency_ms': _latency_ms(latencies),
+            'max_lag_ms': _ms(lags[-1] if lags else None),
+            'mismatched_auctions': mismatched,
+        }
+
+def _queries_per_case(queries):
+    """ Returns the bids, mean and max query count of each proxy case, from (case name, count) pairs """
+    by_case = {}
+    for case, count in queries:
+        by_case.setdefault(case, []).append(count)
+    return dict((case, {'bids': len(counts), 'mean': float(sum(counts)) / len(counts), 'max': max(counts)})
+        for case, counts in by_case.items())
+
+def _latency_ms(latencies):
+    """ Returns the percentiles and max of sorted latencies, in milliseconds """
+    return {
+        'p50': _ms(percentile(latencies, 50)),
+        'p95': _ms(percentile(latencies, 95)),
+        'p99': _ms(percentile(latencies, 99)),
+        'max': _ms(latencies[-1] if latencies else None),
+    }
+
+def _ms(seconds):
+    return seconds * 1000 if seconds != None else None
@@ -13,3 +13,19 @@ UPCOMING = 1 #auction is scheduled and has yet to start
 LIVE = 2 #auction is live and may be bid on
 PENDING = 3 #auction is finished, but waiting on owner actions (e.g. RFA match/decline)
 COMPLETED = 4 #auction is completed - rosterplayer is created
+
+#bid resolution cases (see Auction.make_bid)
+BID_INVALID = 0 #bid was under the minimum by the time it was made - bid does not change the auction
+BID_FIRST = 1 #first bid on the auction
+BID_RAISE_PROXY = 2 #high bidder raises the proxy (max value) of his high bid
+BID_OUTBID = 3 #different bidder outbids the proxy of the high bid
+BID_NOT_OUTBID = 4 #different bidder bids under the proxy of the high bid, raising its current value
+
+#names of the bid resolution cases, for metrics
+BID_CASE_NAMES = {
+    BID_INVALID: 'invalid',
+    BID_FIRST: 'first',
+    BID_RAISE_PROXY: 'raise_proxy',
+    BID_OUTBID: 'outbid',
+    BID_NOT_OUTBID: 'not_outbid',
+}
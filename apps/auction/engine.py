@@ -0,0 +1,410 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from auction.constants import LIVE, BID_OUTBID, BID_CASE_NAMES
+from auction.eventlog import EventLog
+from auction.events import publish_auction_state
+from auction.models import Auction, AuctionEvent, Bid, Notification, engine_auctions
+from auction.proxy import resolve_bid
+from auction.replay import recover_auction, recover_auctions
+from league.cache import bump_league_version
+from fantasyauction.metrics import BIDS
+from league.models import move_exposure
+
+logger = logging.getLogger(__name__)
+
+class LiveAuction(object):
+    """ In-memory state of a live auction, owned by a BidEngine
+        Fields:
+            auction_id - id of the auction
+            league_id - id of the auction's league, whose cached pages are invalidated by flushes
+            season_id - id of the auction's season, whose rosters' exposure is updated by flushes
+            expiration_time - when the auction ends, bids after this are refused
+            high_bid - Bid object of the current high bid.  may not be inserted yet (id is None until flushed)
+            high_bid_value - denormalized high_bid_value of the auction
+            high_bidder_id - denormalized high_bidder of the auction
+            seq - seq of the auction, incremented for every bid made (see Auction.seq)
+            flushed_high_bid_value, flushed_high_bidder_id - high_bid_value and high_bidder as last written, which the
+                rosters' exposure (see Roster.winning_value) reflects
+            new_bids - bids made since the last flush, not yet inserted
+            dirty_bids - inserted bids whose current_value or current_high_bid changed since the last flush, keyed by id
+            notifications - OUTBID Notifications queued since the last flush, not yet inserted
+            dirty - True if the auction's denormalized fields (including high_bid) changed since the last flush
+            released - True once the auction was removed from its engine, after which no bid is made on it
+            lock - serializes bids on this auction.  bids on different auctions never wait on each other
+    """
+    def __init__(self, auction_id, expiration_time, high_bid=None, high_bid_value=None, high_bidder_id=None, seq=0, league_id=None,
+            season_id=None):
+        self.auction_id = auction_id
+        self.league_id = league_id
+        self.season_id = season_id
+        self.expiration_time = expiration_time
+        self.high_bid = high_bid
+        self.high_bid_value = high_bid_value
+        self.high_bidder_id = high_bidder_id
+        self.seq = seq
+        self.flushed_high_bid_value = high_bid_value
+        self.flushed_high_bidder_id = high_bidder_id
+        self.new_bids = []
+        self.dirty_bids = {}
+        self.notifications = []
+        self.dirty = False
+        self.released = False
+        self.lock = threading.Lock()
+
+    def make_bid(self, bidder_id, max_value, time, idempotency_key=None):
+        """ Resolves a bid against the in-memory state, and queues the writes for the next flush.  Returns the
+            (unsaved) Bid and the BidResolution
+        """
+        high_bid = self.high_bid
+        if high_bid != None:
+            resolution = resolve_bid(high_bid.bidder_id, high_bid.max_value, high_bid.current_value, bidder_id, max_value)
+        else:
+            resolution = resolve_bid(None, None, None, bidder_id, max_value)
+        self.seq += 1
+        bid = Bid(auction_id=self.auction_id, bidder_id=bidder_id, time=time, max_value=max_value,
+            current_value=resolution.bid_current_value, current_high_bid=resolution.bid_is_high, seq=self.seq,
+            idempotency_key=idempotency_key)
+        if resolution.high_bid_current_value != None:
+            high_bid.current_value = resolution.high_bid_current_value
+            self._mark_dirty(high_bid)
+        if resolution.bid_is_high:
+            if high_bid != None:
+                high_bid.current_high_bid = False
+                self._mark_dirty(high_bid)
+            self.high_bid = bid
+            self.dirty = True
+        self.new_bids.append(bid)
+        if resolution.case == BID_OUTBID:
+            self.notifications.append(Notification(user_id=self.high_bidder_id, auction_id=self.auction_id,
+                kind=Notification.OUTBID, time=time, value=resolution.high_bid_value))
+        if resolution.high_bid_value != self.high_bid_value or resolution.high_bidder_id != self.high_bidder_id:
+            self.high_bid_value = resolution.high_bid_value
+            self.high_bidder_id = resolution.high_bidder_id
+            self.dirty = True
+        return bid, resolution
+
+    def get_pending_bid(self, bidder_id, idempotency_key):
+        """ Returns the bid by bidder_id with idempotency_key that is waiting for the next flush, or None """
+        for bid in self.new_bids:
+            if bid.bidder_id == bidder_id and bid.idempotency_key == idempotency_key:
+                return bid
+        return None
+
+    def has_writes(self):
+        return True if self.new_bids or self.dirty_bids or self.dirty else False
+
+    def _mark_dirty(self, bid):
+        #bids that are not inserted yet are still in new_bids, and are written with their final values
+        if bid.id != None:
+            self.dirty_bids[bid.id] = bid
+
+class BidEngine(object):
+    """ Keeps the state of each LIVE auction in memory and resolves bids against it without touching the database.
+        Results are persisted to Bid/Auction in batches by flush(), either called directly or from the write-behind
+        thread started by start().
+
+        The engine is optional - Auction.make_bid remains the source of truth for bids made through Bid.save().  An
+        auction must be loaded into the engine (warm() or load()) before bids are submitted to it.  While an auction is
+        held, Auction.make_bid refuses bids on it (see auction.models.engine_auctions), since they would take seqs the
+        engine has already given out, and Auction.expire/auction.completion.complete_auctions release it first, so that
+        its pending writes are flushed before it is completed.  Each flushed auction's new state is published to its
+        event channels.
+
+        Each bid is appended to the AuctionEvent log (with group commit, see EventLog) before make_bid returns, so bids
+        that were acknowledged but not flushed when the process died can be recovered with auction.replay.recover_auction
+    """
+    def __init__(self, flush_interval=None, event_log=None):
+        if flush_interval == None:
+            flush_interval = getattr(settings, 'AUCTION_BID_ENGINE_FLUSH_INTERVAL', 0.25)
+        self.flush_interval = flush_interval
+        self.event_log = event_log if event_log != None else EventLog()
+        self.auctions = {}
+        self.lock = threading.Lock() #guards self.auctions
+        self.flush_lock = threading.Lock() #only one flush at a time
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def warm(self):
+        """ Loads every LIVE auction and its current high bid from the database, after recovering any bids that were
+            logged but not flushed by a previous engine.  Returns the number of auctions loaded
+        """
+        recover_auctions()
+        auctions = Auction.objects.filter(state=LIVE).values_list('id', 'expiration_time', 'high_bid_value', 'high_bidder', 'seq',
+            'league', 'season')
+        high_bids = dict((bid.auction_id, bid) for bid in Bid.objects.filter(auction__state=LIVE, current_high_bid=True))
+        live_auctions = {}
+        for auction_id, expiration_time, high_bid_value, high_bidder_id, seq, league_id, season_id in auctions:
+            live_auctions[auction_id] = LiveAuction(auction_id, expiration_time, high_bid=high_bids.get(auction_id),
+                high_bid_value=high_bid_value, high_bidder_id=high_bidder_id, seq=seq, league_id=league_id, season_id=season_id)
+        with self.lock:
+            for auction_id, live_auction in live_auctions.items():
+                self.auctions.setdefault(auction_id, live_auction)
+                engine_auctions[auction_id] = self
+        return len(live_auctions)
+
+    def load(self, auction):
+        """ Loads a single auction (e.g. one that just went LIVE) into the engine """
+        if not auction.is_live():
+            return None
+        live_auction = LiveAuction(auction.id, auction.expiration_time, high_bid=auction.get_high_bid(),
+            high_bid_value=auction.high_bid_value, high_bidder_id=auction.high_bidder_id, seq=auction.seq,
+            league_id=auction.league_id, season_id=auction.season_id)
+        with self.lock:
+            engine_auctions[auction.id] = self
+            return self.auctions.setdefault(auction.id, live_auction)
+
+    def release(self, auction_id):
+        """ Removes an auction from the engine, and flushes its pending writes.  The auction is closed under its lock
+            before it is flushed, so a bid either made it in before the flush or is refused
+        """
+        with self.lock:
+            live_auction = self.auctions.pop(auction_id, None)
+            if live_auction != None:
+                engine_auctions.pop(auction_id, None)
+        if live_auction == None:
+            return
+        with live_auction.lock:
+            live_auction.released = True
+        self._flush([live_auction])
+
+    def make_bid(self, auction_id, bidder_id, max_value, time=None):
+        """ Makes a bid on a live auction held by the engine.  Returns the (unsaved) Bid and the BidResolution, or None
+            if the auction is not held by the engine or has expired.  Bids are not checked against the bidder's salary
+            cap (see Auction.validate_bid), since that would read the database - callers check before submitting
+        """
+        if time == None:
+            time = timezone.now()
+        live_auction = self.auctions.get(auction_id)
+        if live_auction == None or time > live_auction.expiration_time:
+            return None
+        with live_auction.lock:
+            if live_auction.released:
+                return None
+            return self._make_bid(live_auction, bidder_id, max_value, time)
+
+    def submit_bid(self, auction, bidder, max_value, idempotency_key=None):
+        """ Same as Auction.submit_bid, for an auction the engine holds, or loads if it is LIVE.  Under the auction's
+            lock, the bid is checked with auction.check_bid against the engine's state and with auction.validate_bid
+            against the bidder's roster, and auction's seq and high bid fields are set to the state after the bid.  The
+            rosters' exposure only reflects flushed bids, so a bidder's other unflushed bids are not counted against their
+            cap.  Returns (bid, created), or None if the engine does not hold the auction (e.g. it is not LIVE), for the
+            caller to make the bid through the database
+        """
+        live_auction = self.auctions.get(auction.id) or self.load(auction)
+        if live_auction == None:
+            return None
+        time = timezone.now()
+        with live_auction.lock:
+            if live_auction.released:
+                return None
+            if idempotency_key:
+                pending = live_auction.get_pending_bid(bidder.id, idempotency_key)
+                if pending != None:
+                    return pending, False
+            #validate_bid adds back the bidder's own high bid, which the exposure has as of the last flush
+            auction.expiration_time = live_auction.expiration_time
+            auction.high_bid_value = live_auction.flushed_high_bid_value
+            auction._set_related_id('high_bidder', live_auction.flushed_high_bidder_id)
+            auction.validate_bid(Bid(bidder=bidder, max_value=max_value))
+            auction.high_bid_value = live_auction.high_bid_value
+            auction._set_related_id('high_bidder', live_auction.high_bidder_id)
+            auction.check_bid(max_value, now=time)
+            bid, resolution = self._make_bid(live_auction, bidder.id, max_value, time, idempotency_key)
+            auction.seq = live_auction.seq
+            auction.high_bid_value = live_auction.high_bid_value
+            auction._set_related_id('high_bidder', live_auction.high_bidder_id)
+        BIDS.inc(case=BID_CASE_NAMES[resolution.case])
+        return bid, True
+
+    def _make_bid(self, live_auction, bidder_id, max_value, time, idempotency_key=None):
+        #appended under the auction's lock, so an auction's events are committed in seq order, and before the
+        #   in-memory state changes, so a bid whose event could not be appended is not made at all
+        self.event_log.append([AuctionEvent(auction_id=live_auction.auction_id, seq=live_auction.seq + 1,
+            kind=AuctionEvent.BID, time=time, bidder_id=bidder_id, max_value=max_value)])
+        return live_auction.make_bid(bidder_id, max_value, time, idempotency_key)
+
+    def get_state(self, auction_id):
+        """ Returns (high_bid_value, high_bidder_id) of an auction held by the engine, or None """
+        live_auction = self.auctions.get(auction_id)
+        if live_auction == None:
+            return None
+        return live_auction.high_bid_value, live_auction.high_bidder_id
+
+    def flush(self):
+        """ Writes the pending bids of all auctions in one transaction:
+            -One SELECT ... FOR UPDATE of the auctions that are still LIVE
+            -One UPDATE per previously inserted bid whose values changed
+            -One bulk INSERT for all new bids
+            -One SELECT for the ids of new bids that are the current high bid
+            -One UPDATE per auction with new bids, of its seq and its high bid, high bid value and high bidder
+            -One UPDATE of the exposure of each of the old and new high bidders' rosters, per auction whose high bid changed
+            -One bulk INSERT of the OUTBID Notifications of all auctions
+            If the transaction fails, each auction is written again in a transaction of its own, so that one auction
+            (e.g. a seq taken by a bid from another process) does not hold up the others.  An auction that still fails is
+            rebuilt from its events (see auction.replay.recover_auction) and dropped from the engine, as is an auction
+            that is no longer LIVE (e.g. completed by another process) - it is reloaded by the next load() if it is LIVE.
+            Once committed, publishes the new state of each written auction (see auction.events)
+            Returns the number of bids inserted
+        """
+        with self.lock:
+            live_auctions = sorted(self.auctions.values(), key=lambda live_auction: live_auction.auction_id)
+        return self._flush(live_auctions)
+
+    def _flush(self, live_auctions):
+        with self.flush_lock:
+            live_auctions = [live_auction for live_auction in live_auctions if live_auction.has_writes()]
+            if not live_auctions:
+                return 0
+            #hold the auctions' locks while writing, so no bid mutates a row that is being written.  locks are always
+            #   taken in auction id order, and make_bid only ever takes one, so this cannot deadlock
+            for live_auction in live_auctions:
+                live_auction.lock.acquire()
+            try:
+                failed = []
+                try:
+                    with transaction.commit_on_success():
+                        written, high_bid_ids = self._write(live_auctions)
+                except Exception:
+                    logger.exception('BidEngine flush of %d auctions failed, writing them one at a time', len(live_auctions))
+                    written, high_bid_ids = [], {}
+                    for live_auction in live_auctions:
+                        try:
+                            with transaction.commit_on_success():
+                                auction_written, auction_high_bid_ids = self._write([live_auction])
+                        except Exception:
+                            logger.exception('BidEngine flush of auction %s failed', live_auction.auction_id)
+                            failed.append(live_auction)
+                            continue
+                        written.extend(auction_written)
+                        high_bid_ids.update(auction_high_bid_ids)
+                inserted = sum(len(live_auction.new_bids) for live_auction in written)
+                #bulk_create does not set primary keys, so the new high bids get their ids once the writes are committed
+                for live_auction in written:
+                    if live_auction.auction_id in high_bid_ids:
+                        live_auction.high_bid.id = high_bid_ids[live_auction.auction_id]
+                for live_auction in written:
+                    publish_auction_state('bid', live_auction.auction_id, live_auction.league_id, LIVE, live_auction.seq,
+                        live_auction.high_bid_value, live_auction.high_bidder_id)
+                for league_id in set(live_auction.league_id for live_auction in written if live_auction.dirty):
+                    bump_league_version(league_id)
+                for live_auction in written:
+                    live_auction.new_bids = []
+                    live_auction.dirty_bids = {}
+                    live_auction.notifications = []
+                    live_auction.dirty = False
+                    live_auction.flushed_high_bid_value = live_auction.high_bid_value
+                    live_auction.flushed_high_bidder_id = live_auction.high_bidder_id
+                for live_auction in failed:
+                    try:
+                        recover_auction(live_auction.auction_id)
+                    except Exception:
+                        logger.exception('BidEngine could not recover auction %s', live_auction.auction_id)
+                dropped = [live_auction for live_auction in live_auctions if live_auction not in written]
+                for live_auction in dropped:
+                    if live_auction not in failed:
+                        logger.error('BidEngine dropped auction %s, which is no longer LIVE, with %d bids unwritten',
+                            live_auction.auction_id, len(live_auction.new_bids))
+                    live_auction.released = True
+                with self.lock:
+                    for live_auction in dropped:
+                        if self.auctions.get(live_auction.auction_id) is live_auction:
+                            del self.auctions[live_auction.auction_id]
+                            engine_auctions.pop(live_auction.auction_id, None)
+            finally:
+                for live_auction in live_auctions:
+                    live_auction.lock.release()
+        return inserted
+
+    def _write(self, live_auctions):
+        """ Writes the pending bids of live_auctions in the current transaction, leaving out the auctions that are no longer
+            LIVE.  Returns the auctions written, and the ids of their new high bids by auction id
+        """
+        live_ids = set(Auction.objects.select_for_update().filter(id__in=[live_auction.auction_id for live_auction in live_auctions],
+            state=LIVE).values_list('id', flat=True))
+        live_auctions = [live_auction for live_auction in live_auctions if live_auction.auction_id in live_ids]
+        new_bids = []
+        notifications = []
+        unsaved_high_bids = []
+        for live_auction in live_auctions:
+            #previous high bids lose current_high_bid before the new high bid is inserted
+            for bid in live_auction.dirty_bids.values():
+                Bid.objects.filter(id=bid.id).update(current_value=bid.current_value, current_high_bid=bid.current_high_bid)
+            new_bids.extend(live_auction.new_bids)
+            notifications.extend(live_auction.notifications)
+            if live_auction.high_bid != None and live_auction.high_bid.id == None:
+                unsaved_high_bids.append(live_auction.auction_id)
+        if new_bids:
+            Bid.objects.bulk_create(new_bids)
+        high_bid_ids = {}
+        if unsaved_high_bids:
+            high_bid_ids = dict(Bid.objects.filter(auction__in=unsaved_high_bids, current_high_bid=True).values_list('auction', 'id'))
+        for live_auction in live_auctions:
+            if live_auction.dirty or live_auction.new_bids:
+                #the engine owns the seq of the auctions it holds, so it is written as is
+                high_bid = live_auction.high_bid
+                high_bid_id = high_bid_ids.get(live_auction.auction_id, high_bid.id if high_bid != None else None)
+                Auction.objects.filter(id=live_auction.auction_id, state=LIVE).update(seq=live_auction.seq,
+                    high_bid_value=live_auction.high_bid_value, high_bidder=live_auction.high_bidder_id, high_bid=high_bid_id)
+                if (live_auction.high_bid_value != live_auction.flushed_high_bid_value or
+                        live_auction.high_bidder_id != live_auction.flushed_high_bidder_id):
+                    move_exposure(live_auction.league_id, live_auction.season_id, live_auction.flushed_high_bidder_id,
+                        live_auction.flushed_high_bid_value, live_auction.high_bidder_id, live_auction.high_bid_value)
+        Notification.objects.bulk_create(notifications)
+        return live_auctions, high_bid_ids
+
+    def start(self):
+        """ Starts the write-behind thread, which flushes every flush_interval seconds """
+        if self._thread != None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='BidEngine')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the write-behind thread, after a final flush """
+        if self._thread == None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception:
+                    #pending writes stay queued and are retried on the next flush
+                    logger.exception('BidEngine flush failed')
+            self.flush()
+        finally:
+            connection.close()
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def start_engine():
+    """ Starts this process's BidEngine if AUCTION_BID_ENGINE is on - warms it and starts its write-behind thread.  Called
+        when the web process starts (fantasyauction.wsgi), and does nothing if the engine is already started.  Returns
+        the engine, or None if it is off
+    """
+    global _engine
+    if not getattr(settings, 'AUCTION_BID_ENGINE', False):
+        return None
+    with _engine_lock:
+        if _engine == None:
+            engine = BidEngine()
+            engine.warm()
+            engine.start()
+            _engine = engine
+    return _engine
+
+def get_engine():
+    """ Returns this process's BidEngine (see start_engine), or None if it was not started """
+    return _engine
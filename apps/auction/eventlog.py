@@ -0,0 +1,56 @@
+import threading
+
+from django.db import transaction
+
+from auction.models import AuctionEvent
+
+class EventLog(object):
+    """ Appends AuctionEvents with group commit: append() returns once its events are committed, and the events of every
+        thread that appends while a write is in progress are written together by the next write, with one INSERT and one
+        commit.  Used by auction.engine.BidEngine, whose bids have no transaction of their own, so that a bid is in the
+        log before it is acknowledged
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.next_batch = 1 #batch that pending events will be written in
+        self.committed = 0 #latest batch written
+        self.writing = False
+        self.failed = {} #batch -> exception, for batches whose write failed
+
+    def append(self, events):
+        """ Appends events, and waits until they are committed.  Raises the write's exception if it failed """
+        with self.cond:
+            self.pending.extend(events)
+            batch = self.next_batch
+            while self.committed < batch:
+                if self.writing:
+                    self.cond.wait()
+                    continue
+                #no write in progress - this thread writes everything pending, including other threads' events
+                self.writing = True
+                events_to_write, self.pending = self.pending, []
+                writing_batch = self.next_batch
+                self.next_batch += 1
+                self.cond.release()
+                error = None
+                try:
+                    self._write(events_to_write)
+                except Exception as e:
+                    error = e
+                finally:
+                    self.cond.acquire()
+                    self.writing = False
+                    self.committed = writing_batch
+                    if error != None:
+                        self.failed[writing_batch] = error
+                    #keep the errors of recent batches only, for the threads still waiting on them
+                    for failed_batch in [failed_batch for failed_batch in self.failed if failed_batch < writing_batch - 100]:
+                        del self.failed[failed_batch]
+                    self.cond.notify_all()
+            if batch in self.failed:
+                raise self.failed[batch]
+
+    def _write(self, events):
+        with transaction.commit_on_success():
+            AuctionEvent.objects.bulk_create(events)
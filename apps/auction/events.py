@@ -0,0 +1,207 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+class EventHub(object):
+    """ In-process publish/subscribe of small auction events, for the long-poll and Server-Sent Events endpoints.
+        Each channel ('auction:<id>', 'league:<id>') keeps its latest events, numbered by a hub-wide increasing id, so a
+        client resumes from the last id it has seen.  Waiting clients block on their channel's condition only, so an
+        idle connection costs a blocked thread (or greenlet, under gevent) and nothing else.
+
+        A hub only holds the events of its own process.  With AUCTION_EVENTS_NOTIFY_CHANNEL set, events are published
+        through Postgres NOTIFY instead, and every process's NotifyListener delivers them to its hub, so the push
+        endpoints see the state changes of every web process and of the scheduler, sweeper and notification workers.
+    """
+    def __init__(self, history=None):
+        if history == None:
+            history = getattr(settings, 'AUCTION_EVENTS_HISTORY', 100)
+        self.history = history
+        self.lock = threading.Lock()
+        self.channels = {} #channel -> deque of (id, event)
+        self.dropped = {} #channel -> id of the latest event dropped from the channel's history
+        self.conditions = {} #channel -> Condition on self.lock
+        self.last_id = 0
+        self.reset_id = 0 #clients that have not seen this id may have missed events on any channel (see reset())
+
+    def publish(self, channels, event):
+        """ Publishes an event (a JSON serializable dict) to channels.  Returns the event id """
+        with self.lock:
+            self.last_id += 1
+            for channel in channels:
+                held = self.channels.setdefault(channel, deque(maxlen=self.history))
+                if len(held) == held.maxlen:
+                    self.dropped[channel] = held[0][0]
+                held.append((self.last_id, event))
+                if channel in self.conditions:
+                    self.conditions[channel].notify_all()
+            return self.last_id
+
+    def reset(self):
+        """ Tells every client that it may have missed events, e.g. while the NotifyListener was reconnecting """
+        with self.lock:
+            self.last_id += 1
+            self.reset_id = self.last_id
+            for condition in self.conditions.values():
+                condition.notify_all()
+
+    def get_events(self, channel, since):
+        """ Returns (events after id since, last id, reset).  reset is True if events after since are no longer (or
+            were never) held, e.g. after a restart, and the client must reload
+        """
+        with self.lock:
+            return self._get_events(channel, since)
+
+    def wait(self, channel, since, timeout):
+        """ Same as get_events(), but waits up to timeout seconds for an event if there is none after since """
+        deadline = time.time() + timeout
+        with self.lock:
+            events, last_id, reset = self._get_events(channel, since)
+            while not events and not reset:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                if channel not in self.conditions:
+                    self.conditions[channel] = threading.Condition(self.lock)
+                self.conditions[channel].wait(remaining)
+                events, last_id, reset = self._get_events(channel, since)
+            return events, last_id, reset
+
+    def _get_events(self, channel, since):
+        events = [(event_id, event) for event_id, event in self.channels.get(channel, ()) if event_id > since]
+        reset = since > self.last_id or self.dropped.get(channel, 0) > since or since < self.reset_id
+        return events, self.last_id, reset
+
+hub = EventHub()
+
+def publish_auction_event(auction, kind):
+    """ Publishes the current public state of an auction to its auction and league channels """
+    return publish_auction_state(kind, auction.id, auction.league_id, auction.state, auction.seq, auction.high_bid_value,
+        auction.high_bidder_id)
+
+def publish_auction_state(kind, auction_id, league_id, state, seq, high_bid_value, high_bidder_id):
+    """ Same as publish_auction_event(), for callers that hold an auction's fields rather than the Auction (e.g. the
+        in-memory auction.engine.BidEngine)
+    """
+    event = {
+        'type': kind,
+        'auction': auction_id,
+        'league': league_id,
+        'state': state,
+        'seq': seq,
+        'high_bid_value': high_bid_value,
+        'high_bidder': high_bidder_id,
+    }
+    channels = ['auction:%d' % auction_id, 'league:%d' % league_id]
+    notify_channel = getattr(settings, 'AUCTION_EVENTS_NOTIFY_CHANNEL', None)
+    if notify_channel:
+        #sent when the current transaction commits, and delivered to this process's hub by its NotifyListener too
+        connection.cursor().execute('SELECT pg_notify(%s, %s)', [notify_channel, json.dumps({'channels': channels, 'event': event})])
+        transaction.commit_unless_managed()
+        return None
+    return hub.publish(channels, event)
+
+class NotifyListener(object):
+    """ Delivers the events published by every process through Postgres NOTIFY (see publish_auction_state) to a hub.
+        A thread with its own connection LISTENs on the channel and waits on the connection's socket with select(), so
+        under gevent it is an idle greenlet.  If the connection is lost, it reconnects and resets the hub, since events
+        may have been missed.  Needs psycopg2 and a postgresql_psycopg2 database
+        Fields:
+            hub - EventHub the events are published to
+            channel - Postgres channel to LISTEN on (AUCTION_EVENTS_NOTIFY_CHANNEL)
+            database - alias of the database in DATABASES to listen on
+    """
+    def __init__(self, hub, channel, database='default'):
+        self.hub = hub
+        self.channel = channel
+        self.database = database
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """ Starts the listening thread, if it is not running yet """
+        with self.lock:
+            if self._thread != None:
+                return
+            self._thread = threading.Thread(target=self._run, name='NotifyListener')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def deliver(self, payload):
+        """ Publishes a NOTIFY payload to the hub """
+        message = json.loads(payload)
+        return self.hub.publish(message['channels'], message['event'])
+
+    def _run(self):
+        connected = False
+        while True:
+            try:
+                self._listen(reset=connected)
+            except Exception:
+                logger.exception('auction events listener failed, reconnecting')
+            connected = True
+            time.sleep(1)
+
+    def _listen(self, reset):
+        #only needed by this listener, so that other databases do not need psycopg2
+        import psycopg2
+        import psycopg2.extensions
+        database = settings.DATABASES[self.database]
+        params = {'database': database['NAME'], 'user': database.get('USER'), 'password': database.get('PASSWORD'),
+            'host': database.get('HOST'), 'port': database.get('PORT')}
+        listen_connection = psycopg2.connect(**dict((key, value) for key, value in params.items() if value))
+        try:
+            listen_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            listen_connection.cursor().execute('LISTEN "%s"' % self.channel.replace('"', '""'))
+            if reset:
+                self.hub.reset()
+            while True:
+                select.select([listen_connection], [], [], 60)
+                listen_connection.poll()
+                while listen_connection.notifies:
+                    self.deliver(listen_connection.notifies.pop(0).payload)
+        finally:
+            listen_connection.close()
+
+_listener = None
+_listener_lock = threading.Lock()
+
+def start_listener():
+    """ Starts this process's NotifyListener, if AUCTION_EVENTS_NOTIFY_CHANNEL is set.  Called when the web process
+        starts (fantasyauction.wsgi) and by the push endpoints.  Returns the listener, or None
+    """
+    global _listener
+    channel = getattr(settings, 'AUCTION_EVENTS_NOTIFY_CHANNEL', None)
+    if not channel:
+        return None
+    with _listener_lock:
+        if _listener == None:
+            _listener = NotifyListener(hub, channel)
+            _listener.start()
+    return _listener
+
+def can_hold_connections():
+    """ Returns True if a push request can wait for events without tying up a server thread - the process was
+        monkey-patched by gevent (e.g. gunicorn -k gevent), so that a waiting request is an idle greenlet.  Otherwise
+        long-polls return at once and streams close after sending what they have, and clients poll instead.
+        AUCTION_EVENTS_HOLD_CONNECTIONS overrides the check, if it is not None
+    """
+    hold = getattr(settings, 'AUCTION_EVENTS_HOLD_CONNECTIONS', None)
+    if hold != None:
+        return hold
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return 'threading' in getattr(monkey, 'saved', {})
+
+def format_sse(event_id, event):
+    """ Formats an event as a Server-Sent Events message """
+    return 'id: %d\ndata: %s\n\n' % (event_id, json.dumps(event))
@@ -0,0 +1,53 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from auction.bench import SWEEP, SCHEDULER, DraftNightBenchmark
+
+class Command(BaseCommand):
+    help = ('Simulates draft night - a synthetic league, a bid storm ending in last-second snipes that race the completion '
+        'of their auctions, and the completion of every other auction - and reports bid throughput, latency, rejected bids, '
+        'queries per bid (overall and per proxy case) and completion time.  Only the synthetic '
+        'league\'s auctions are completed, and the league is deleted afterwards')
+    option_list = BaseCommand.option_list + (
+        make_option('--owners', type='int', dest='owners', default=12, help='Owners in the synthetic league'),
+        make_option('--players', type='int', dest='players', default=300, help='Players to create'),
+        make_option('--auctions', type='int', dest='auctions', default=100, help='Simultaneous LIVE auctions'),
+        make_option('--bids', type='int', dest='bids', default=2000, help='Bids to make'),
+        make_option('--ufa', type='float', dest='ufa_fraction', default=0.2, help='Fraction of auctions that are UFA auctions'),
+        make_option('--snipe', type='float', dest='snipe_fraction', default=0.2,
+            help='Fraction of the bids made in the final burst on a few auctions'),
+        make_option('--snipe-auctions', type='int', dest='snipe_auctions', default=5, help='Auctions the final burst goes to'),
+        make_option('--snipe-seconds', type='float', dest='snipe_seconds', default=2.0,
+            help='Seconds before its auctions expire that the final burst starts'),
+        make_option('--threads', type='int', dest='threads', default=1, help='Bidding threads, each with its own connection'),
+        make_option('--completion', type='choice', choices=[SWEEP, SCHEDULER], dest='completion', default=SWEEP,
+            help='Complete auctions in batches as the sweeper does (sweep), or with the scheduler (scheduler)'),
+        make_option('--seed', type='int', dest='seed', default=None, help='Random seed, to repeat a run'),
+        make_option('--output', dest='output', default=None, help='Write the results as JSON to this file'),
+        make_option('--keep', action='store_true', dest='keep', default=False, help='Keep the synthetic league afterwards'),
+    )
+
+    def handle(self, *args, **options):
+        benchmark = DraftNightBenchmark(owners=options['owners'], players=options['players'], auctions=options['auctions'],
+            bids=options['bids'], ufa_fraction=options['ufa_fraction'], snipe_fraction=options['snipe_fraction'],
+            snipe_auctions=options['snipe_auctions'], snipe_seconds=options['snipe_seconds'], threads=options['threads'], completion=options['completion'],
+            seed=options['seed'], keep=options['keep'])
+        results = benchmark.run()
+        latency = results['latency_ms']
+        self.stdout.write('%d bids, %.1f bids/sec\n' % (results['config']['bids'], results['bids_per_second'] or 0))
+        self.stdout.write('latency p50 %.2fms, p95 %.2fms, p99 %.2fms, max %.2fms\n' % (latency['p50'] or 0,
+            latency['p95'] or 0, latency['p99'] or 0, latency['max'] or 0))
+        self.stdout.write('%d bids rejected\n' % results['bids_rejected'])
+        snipes = results['snipes']
+        self.stdout.write('%d snipes, p99 %.2fms, %d rejected, %d auctions completed during the burst\n' % (snipes['bids'],
+            snipes['latency_ms']['p99'] or 0, snipes['rejected'], snipes['auctions_completed']))
+        self.stdout.write('%.2f queries per bid\n' % (results['queries_per_bid'] or 0))
+        for case, queries in sorted(results['queries_per_case'].items()):
+            self.stdout.write('  %s: %d bids, %.2f queries per bid, max %d\n' % (case, queries['bids'], queries['mean'],
+                queries['max']))
+        self.stdout.write('%d auctions completed in %.3fs\n' % (results['auctions_completed'], results['completion_seconds']))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
@@ -0,0 +1,46 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auction.bench import TraceReplay
+from auction.trace import read_trace
+
+class Command(BaseCommand):
+    args = '<trace file>'
+    help = ('Replays a bid trace recorded with AUCTION_BID_TRACE_FILE through Bid.save() against a scratch league, and '
+        'reports bid throughput and latency, and any auction whose final high bid differs from the recorded one.  The '
+        'scratch league is created in the configured database and deleted afterwards - use --settings with a copy of the '
+        'database to keep the replay off the live one.  Replayed bids are not recorded to AUCTION_BID_TRACE_FILE')
+    option_list = BaseCommand.option_list + (
+        make_option('--speed', type='float', dest='speed', default=1.0,
+            help='Replay speed - 1 at the recorded pace, 10 at ten times it, 0 as fast as possible'),
+        make_option('--threads', type='int', dest='threads', default=1,
+            help='Bidding threads, each with its own connection.  Each auction\'s bids are made by one thread'),
+        make_option('--output', dest='output', default=None, help='Write the results as JSON to this file'),
+        make_option('--keep', action='store_true', dest='keep', default=False, help='Keep the scratch league afterwards'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: replaytrace %s' % self.args)
+        entries = read_trace(args[0])
+        if not entries:
+            raise CommandError('%s has no bids' % args[0])
+        results = TraceReplay(entries, speed=options['speed'], threads=options['threads'], keep=options['keep']).run()
+        latency = results['latency_ms']
+        self.stdout.write('%d bids on %d auctions in %.3fs (recorded over %.3fs), %.1f bids/sec\n' % (
+            results['config']['bids'], results['config']['auctions'], results['seconds'], results['recorded_seconds'],
+            results['bids_per_second'] or 0))
+        self.stdout.write('latency p50 %.2fms, p95 %.2fms, p99 %.2fms, max %.2fms\n' % (latency['p50'] or 0,
+            latency['p95'] or 0, latency['p99'] or 0, latency['max'] or 0))
+        if results['max_lag_ms'] != None:
+            self.stdout.write('fell behind the recorded pace by up to %.2fms\n' % results['max_lag_ms'])
+        if results['mismatched_auctions']:
+            self.stdout.write('%d auctions ended with a different high bid than recorded: %s\n' % (
+                len(results['mismatched_auctions']), ', '.join(str(auction_id) for auction_id in results['mismatched_auctions'])))
+        else:
+            self.stdout.write('every auction ended with its recorded high bid\n')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
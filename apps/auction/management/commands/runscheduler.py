@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from auction.scheduler import AuctionScheduler
+
+class Command(BaseCommand):
+    help = 'Runs the auction scheduler, which calls set_live() and expire() on auctions when they are due'
+    option_list = BaseCommand.option_list + (
+        make_option('--tolerance', type='float', dest='tolerance', default=None,
+            help='Seconds between checks for new and rescheduled auctions (default AUCTION_SCHEDULER_TOLERANCE)'),
+    )
+
+    def handle(self, *args, **options):
+        scheduler = AuctionScheduler(tolerance=options['tolerance'])
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        stats = scheduler.get_lag_stats()
+        if stats['count']:
+            self.stdout.write('%d transitions fired, %.3fs mean lag, %.3fs max lag\n' % (stats['count'], stats['mean'], stats['max']))
@@ -0,0 +1,33 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import reset_queries, transaction
+
+from auction.notifications import queue_ending_notifications, send_digests
+
+class Command(BaseCommand):
+    help = ('Queues notifications for auctions about to end, and emails each owner a digest of their queued outbid, won '
+        'and ending notifications')
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', type='int', dest='interval', default=None,
+            help='Seconds an owner\'s notifications are held and coalesced (default AUCTION_NOTIFICATION_DIGEST_INTERVAL)'),
+        make_option('--poll', type='float', dest='poll', default=None,
+            help='Keep running, checking every this many seconds, instead of running once'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                queued = queue_ending_notifications()
+                sent = send_digests(interval=options['interval'])
+                if options['poll'] == None or queued or sent:
+                    self.stdout.write('%d ending notifications queued, %d digests sent\n' % (queued, sent))
+                if options['poll'] == None:
+                    break
+                #drop the queries kept with DEBUG, and end the transaction of the reads rather than sleep in it
+                reset_queries()
+                transaction.commit_unless_managed()
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
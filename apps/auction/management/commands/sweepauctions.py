@@ -0,0 +1,16 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from auction.sweeper import EXPIRE_BATCH_SIZE, sweep
+
+class Command(BaseCommand):
+    help = 'Moves all due auctions from UPCOMING to LIVE, and expires all due LIVE auctions'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=EXPIRE_BATCH_SIZE,
+            help='Number of expired auctions handed to completion at a time'),
+    )
+
+    def handle(self, *args, **options):
+        started, expired = sweep(batch_size=options['batch_size'])
+        self.stdout.write('%d auctions started, %d auctions expired\n' % (started, expired))
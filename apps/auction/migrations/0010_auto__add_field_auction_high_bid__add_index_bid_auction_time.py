@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Auction.high_bid'
+        db.add_column('auction_auction', 'high_bid',
+                      self.gf('django.db.models.fields.related.ForeignKey')(blank=True, related_name='+', null=True, on_delete=models.SET_NULL, to=orm['auction.Bid']),
+                      keep_default=False)
+
+        # Adding index on 'Bid', fields ['auction', 'time']
+        db.create_index('auction_bid', ['auction_id', 'time'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Bid', fields ['auction', 'time']
+        db.delete_index('auction_bid', ['auction_id', 'time'])
+
+        # Deleting field 'Auction.high_bid'
+        db.delete_column('auction_auction', 'high_bid_id')
+
+
+    models = {
+        'auction.auction': {
+            'Meta': {'object_name': 'Auction'},
+            'expiration_time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'high_bid': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['auction.Bid']"}),
+            'high_bid_value': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'high_bidder': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'league': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.League']"}),
+            'player': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['player.Player']"}),
+            'season': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.Season']"}),
+            'start_time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'state': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'auction.bid': {
+            'Meta': {'object_name': 'Bid'},
+            'auction': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auction.Auction']"}),
+            'bidder': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'current_high_bid': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'current_value': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'max_value': ('django.db.models.fields.IntegerField', [], {}),
+            'time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'winning_bid': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'auction.ufaauction': {
+            'Meta': {'object_name': 'UFAAuction', '_ormbases': ['auction.Auction']},
+            'auction_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['auction.Auction']", 'unique': 'True', 'primary_key': 'True'}),
+            'discount_max': ('django.db.models.fields.IntegerField', [], {'default': '5'}),
+            'discount_percentage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'original_owner': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'league.league': {
+            'Meta': {'object_name': 'League'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'roster_limit': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'salary_cap': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'size': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.User']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'league.season': {
+            'Meta': {'object_name': 'Season'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'league': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.League']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'player.player': {
+            'Meta': {'object_name': 'Player'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'position': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'team': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['auction']
\ No newline at end of file
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+#number of auctions backfilled per chunk, so a long bid history is never loaded at once
+CHUNK_SIZE = 500
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Write your forwards methods here."
+        # Note: Remember to use orm['appname.ModelName'] rather than "from appname.models..."
+        auction_ids = list(orm.Auction.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(auction_ids), CHUNK_SIZE):
+            chunk = auction_ids[start:start + CHUNK_SIZE]
+            high_bidders = dict(orm.Auction.objects.filter(id__in=chunk).values_list('id', 'high_bidder'))
+            bids = orm.Bid.objects.filter(auction__in=chunk, current_high_bid=True).order_by('-time', '-id').values_list('id', 'auction', 'bidder')
+            #auctions that raced concurrent bids may have more than one current high bid - keep the latest bid by the
+            #   auction's high bidder (or the latest bid, if none is by him), and clear the others
+            bids = sorted(bids, key=lambda bid: bid[2] != high_bidders[bid[1]])
+            high_bids = {}
+            extra_high_bids = []
+            for bid_id, auction_id, bidder_id in bids:
+                if auction_id in high_bids:
+                    extra_high_bids.append(bid_id)
+                else:
+                    high_bids[auction_id] = bid_id
+            if extra_high_bids:
+                orm.Bid.objects.filter(id__in=extra_high_bids).update(current_high_bid=False)
+            for auction_id, bid_id in high_bids.items():
+                orm.Auction.objects.filter(id=auction_id).update(high_bid=bid_id)
+
+    def backwards(self, orm):
+        "Write your backwards methods here."
+        orm.Auction.objects.update(high_bid=None)
+
+    models = {
+        'auction.auction': {
+            'Meta': {'object_name': 'Auction'},
+            'expiration_time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'high_bid': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'+'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['auction.Bid']"}),
+            'high_bid_value': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'high_bidder': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'league': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.League']"}),
+            'player': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['player.Player']"}),
+            'season': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.Season']"}),
+            'start_time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'state': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'auction.bid': {
+            'Meta': {'object_name': 'Bid'},
+            'auction': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auction.Auction']"}),
+            'bidder': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'current_high_bid': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'current_value': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'max_value': ('django.db.models.fields.IntegerField', [], {}),
+            'time': ('django.db.models.fields.DateTimeField', [], {'blank': 'True'}),
+            'winning_bid': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        'auction.ufaauction': {
+            'Meta': {'object_name': 'UFAAuction', '_ormbases': ['auction.Auction']},
+            'auction_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['auction.Auction']", 'unique': 'True', 'primary_key': 'True'}),
+            'discount_max': ('django.db.models.fields.IntegerField', [], {'default': '5'}),
+            'discount_percentage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'original_owner': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'league.league': {
+            'Meta': {'object_name': 'League'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'roster_limit': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'salary_cap': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'size': ('django.db.models.fields.IntegerField', [], {'blank': 'True'}),
+            'users': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.User']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'league.season': {
+            'Meta': {'object_name': 'Season'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'league': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['league.League']"}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'player.player': {
+            'Meta': {'object_name': 'Player'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'position': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'team': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['auction']
+    symmetrical = True
@@ -1,10 +1,25 @@
+import math
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
 from auction.constants import MIN_BID_VALUE, MIN_BID_INCREMENT, UFA_DISCOUNT_MAX_DEFAULT, NONE, UPCOMING, LIVE, PENDING, COMPLETED
-from league.models import League, Season, Roster
+from auction.constants import BID_FIRST, BID_OUTBID, BID_NOT_OUTBID, BID_CASE_NAMES
+from auction.events import publish_auction_event
+from auction.proxy import resolve_bid
+from auction.trace import recorder as trace_recorder
+from fantasyauction.metrics import BIDS, BID_SECONDS, LOCK_WAIT_SECONDS, COMPLETIONS, COMPLETION_SECONDS, EXPIRATION_LAG_SECONDS
+from league.cache import bump_league_version
+from league.models import League, Season, Roster, adjust_roster_numbers, move_exposure
 from player.models import Player
 
+#auctions held by an auction.engine.BidEngine in this process, auction id -> engine.  The engine owns their seq and writes
+#   their bids itself, so bids made on them through Bid.save() (or make_bid/submit_bid) are refused until the engine
+#   releases them, and they are released before they are completed
+engine_auctions = {}
+
 class Auction(models.Model):
     """ Represents an auction for a player
         Fields:
@@ -16,6 +31,10 @@ class Auction(models.Model):
             state - state of the auction (NONE, UPCOMING, LIVE, PENDING, or COMPLETED)
             high_bid_value - the currently winning bid.  minimum bid is this value + MIN_BID_INCREMENT (usually 1)
             high_bidder - user that has the currently winning bid
+            high_bid - Bid that is the currently winning bid (the Bid with current_high_bid = True)
+            modified - when the auction was last saved.  bids update the auction without touching this
+            seq - sequence number of the latest change to the auction.  incremented (under the auction lock) for every
+                bid made and every state change, so a client that has seen seq N only needs the changes after N
     """
     league = models.ForeignKey(League)
     season = models.ForeignKey(Season)
@@ -35,6 +54,17 @@ class Auction(models.Model):
     #denormalized fields
     high_bid_value = models.IntegerField(blank=True, null=True)
     high_bidder = models.ForeignKey(User, blank=True, null=True)
+    high_bid = models.ForeignKey('Bid', blank=True, null=True, related_name='+', on_delete=models.SET_NULL)
+
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    seq = models.IntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        created = self.id == None
+        super(Auction, self).save(*args, **kwargs)
+        if created:
+            #log the state the auction is created in, so replay starts from it
+            AuctionEvent.log_state(self)
 
     def make_bid(self, bid):
         """ Makes a bid on this auction, if it is active
@@ -49,71 +79,244 @@ class Auction(models.Model):
             4. Existing bids, bidder is different than the high bidder, and the made bid is higher than current bid value but less than 
                proxy (max value) of highest bid
                -Sets the current bid to max value of made bid
+            The cases are resolved by auction.proxy.resolve_bid, which is shared with the in-memory auction.engine.BidEngine
+            The auction row is locked for the whole resolution, which commits as one transaction
+            Raises ValidationError if the bidder cannot afford the bid (see validate_bid), or the auction is held by a BidEngine
         """
-        if self.is_live() and bid != None and bid.auction == self:
-            #first bid
-            if self.high_bidder == None and bid.max_value >= MIN_BID_VALUE:
-                bid.set_current_high_bid()
-                bid.set_current_value(current_value=MIN_BID_VALUE)
-                self.high_bid_value = MIN_BID_VALUE
-                self.high_bidder = bid.bidder
-            #previous bids have been made
+        with BID_SECONDS.time():
+            with transaction.commit_on_success():
+                self.lock()
+                resolution = self._make_bid(bid)
+        self._bid_made(resolution)
+
+    def _make_bid(self, bid):
+        """ Makes a bid on this auction.  The auction must already be locked by lock() in the current transaction
+            Returns the BidResolution, or None if the bid was not made
+            Only the changed columns are written:
+            -One UPDATE of the previous high bid, if it loses current_high_bid or its current_value changes
+            -One INSERT of the made bid with its resolved values and next seq (or UPDATE of them, if the bid was already saved)
+            -One SELECT of the bidder's roster, to validate the bid
+            -One INSERT of its AuctionEvent
+            -One UPDATE of the auction's seq, and high_bid_value/high_bidder/high_bid if they change
+            -One UPDATE of the exposure of each of the old and new high bidders' rosters, if the high bid changes
+            -One INSERT of an OUTBID Notification to the previous high bidder, if they are outbid
+        """
+        if self.is_live() and bid != None and bid.auction_id == self.id:
+            if self.id in engine_auctions:
+                raise ValidationError('Bids on this auction are taken by the bid engine')
+            self.validate_bid(bid)
+            high_bid = self.get_high_bid()
+            if high_bid != None:
+                resolution = resolve_bid(high_bid.bidder_id, high_bid.max_value, high_bid.current_value, bid.bidder_id, bid.max_value)
             else:
-                high_bid = self.get_high_bid()
-                #this bid has same bidder as high bidder - high bidder is raising his proxy bid
-                if bid.bidder == self.high_bidder:
-                    if bid.max_value > high_bid.max_value:
-                        #TODO: do something with bid time - this bid is shown in bid history, which clues in other bidders than proxy was raised
-                        #remove current_high_bid, but don't change current_value
-                        high_bid.remove_current_high_bid()
-                        #update the made bid to be current high bid, but current value is same as previous high bid's current value
-                        bid.set_current_high_bid()
-                        bid.set_current_value(current_value=high_bid.current_value)
-                        #don't need to update auction, since high bid value and high bidder remain the same
-                    else:
-                        #this case should not be hit - would mean bid form allowed invalid bid (same bidder as high bid, and bid
-                        #   is less than or equal to max value of high bid)
-                        bid.set_current_value(bid.max_value)
-                #different bidder than high bidder
-                else:
-                    #high bid is outbid - new high bid
-                    if bid.max_value > high_bid.max_value:
-                        #update current high bid
-                        high_bid.set_current_value(current_value=high_bid.max_value)
-                        high_bid.remove_current_high_bid()
-                        #update the made bid to be current high bid
-                        bid.set_current_high_bid()
-                        bid.set_current_value(current_value=high_bid.max_value+MIN_BID_INCREMENT)
-                        #update auction to have correct denormalized fields
-                        self.high_bid_value = bid.current_value
-                        self.high_bidder = bid.bidder
-                    #high bid is not outbid - increase current value if needed
-                    else:
-                        if bid.max_value > high_bid.current_value:
-                            high_bid.set_current_value(bid.max_value)
-                            bid.set_current_value(bid.max_value)
-                            self.high_bid_value = bid.max_value
-                        else:
-                            #this case should not be hit - would mean bid form allowed invalid bid (less than or equal to current high bid)
-                            bid.set_current_value(bid.max_value)
-            self.save()
+                resolution = resolve_bid(None, None, None, bid.bidder_id, bid.max_value)
+            #update previous high bid - it is outbid, or its current value is pushed up.  this is written before the made
+            #   bid, so that there is never more than one current high bid
+            if high_bid != None and (resolution.bid_is_high or resolution.high_bid_current_value != None):
+                #TODO: do something with bid time for BID_RAISE_PROXY - this bid is shown in bid history, which clues in
+                #   other bidders that proxy was raised
+                if resolution.high_bid_current_value != None:
+                    high_bid.current_value = resolution.high_bid_current_value
+                if resolution.bid_is_high:
+                    high_bid.current_high_bid = False
+                Bid.objects.filter(id=high_bid.id).update(current_value=high_bid.current_value, current_high_bid=high_bid.current_high_bid)
+            #for BID_INVALID, the bid was under the minimum by the time it was made (submit_bid checks it against the
+            #   denormalized high bid first, but another bid may be made in between) - bid's current value is just its max value
+            bid.current_value = resolution.bid_current_value
+            bid.current_high_bid = resolution.bid_is_high
+            self.seq += 1
+            bid.seq = self.seq
+            bid.save_resolved()
+            AuctionEvent.objects.create(auction_id=self.id, seq=bid.seq, kind=AuctionEvent.BID, time=bid.time,
+                bidder_id=bid.bidder_id, max_value=bid.max_value)
+            #update auction to have correct denormalized fields
+            high_bid_id = bid.id if resolution.bid_is_high else self.high_bid_id
+            if (resolution.high_bid_value != self.high_bid_value or resolution.high_bidder_id != self.high_bidder_id or
+                    high_bid_id != self.high_bid_id):
+                Auction.objects.filter(id=self.id).update(seq=self.seq, high_bid_value=resolution.high_bid_value,
+                    high_bidder=resolution.high_bidder_id, high_bid=high_bid_id)
+                move_exposure(self.league_id, self.season_id, self.high_bidder_id, self.high_bid_value,
+                    resolution.high_bidder_id, resolution.high_bid_value)
+                if resolution.case == BID_OUTBID:
+                    Notification.objects.create(user_id=self.high_bidder_id, auction_id=self.id, kind=Notification.OUTBID,
+                        time=bid.time, value=resolution.high_bid_value)
+                self.high_bid_value = resolution.high_bid_value
+                self._set_related_id('high_bidder', resolution.high_bidder_id)
+                self._set_related_id('high_bid', high_bid_id)
+            else:
+                Auction.objects.filter(id=self.id).update(seq=self.seq)
+            return resolution
+        return None
+
+    def submit_bid(self, bidder, max_value, idempotency_key=None):
+        """ Makes a bid of max_value by bidder, at most once per idempotency_key, so that a retried or double-submitted bid
+            is not made twice.  Returns (bid, created) - created is False if the bidder already submitted a bid with the
+            key, which is returned as it is without locking or touching the auction.  The key is unique per bidder
+            (not per auction), and a bid submitted concurrently with the same key is rolled back by the unique index
+            Raises ValidationError, without creating a Bid, if the bid fails check_bid, or make_bid's validate_bid, or the
+            bidder already used the key for a bid on another auction
+            If this process runs a BidEngine (AUCTION_BID_ENGINE, see auction.engine.start_engine), the bid is made by it
+            instead, and written by its next flush
+        """
+        #imported here, since auction.engine imports this module
+        from auction.engine import get_engine
+        if idempotency_key:
+            existing = list(Bid.objects.filter(bidder=bidder, idempotency_key=idempotency_key)[:1])
+            if existing:
+                return self._check_duplicate(existing[0]), False
+        engine = get_engine()
+        if engine != None:
+            submitted = engine.submit_bid(self, bidder, max_value, idempotency_key)
+            if submitted != None:
+                return submitted
+        self.check_bid(max_value)
+        bid = Bid(auction=self, bidder=bidder, time=timezone.now(), max_value=max_value, idempotency_key=idempotency_key or None)
+        try:
+            bid.save()
+        except IntegrityError:
+            #a concurrent duplicate was inserted first - its transaction was rolled back, auction changes included, so the
+            #   fields make_bid changed on this object are read again
+            self.refresh()
+            if not idempotency_key:
+                raise
+            return self._check_duplicate(Bid.objects.get(bidder=bidder, idempotency_key=idempotency_key)), False
+        return bid, True
+
+    def _check_duplicate(self, bid):
+        """ Returns the bid submitted earlier with the same idempotency key, if it was on this auction """
+        if bid.auction_id != self.id:
+            raise ValidationError('This idempotency key was already used for a bid on another auction')
+        return bid
+
+    def get_min_bid(self):
+        """ Returns the least max value a bid can have - MIN_BID_VALUE for the first bid, otherwise the high bid value +
+            MIN_BID_INCREMENT
+        """
+        if self.high_bid_value == None:
+            return MIN_BID_VALUE
+        return self.high_bid_value + MIN_BID_INCREMENT
+
+    def check_bid(self, max_value, now=None):
+        """ Raises ValidationError if a bid of max_value cannot be made, judged from this auction's denormalized fields
+            alone: the auction is not live or has expired, or max_value is under get_min_bid().  Checked before a Bid row
+            is created, so invalid bids never reach the Bid table.  make_bid still resolves the bid under the auction
+            lock, since another bid may be made in between
+        """
+        if now == None:
+            now = timezone.now()
+        if not self.is_live() or self.expiration_time <= now:
+            raise ValidationError('This auction is not open for bids')
+        min_bid = self.get_min_bid()
+        if max_value < min_bid:
+            raise ValidationError('Bids must be at least %d' % min_bid)
+
+    def validate_bid(self, bid):
+        """ Raises ValidationError if the bidder cannot afford the bid - winning the auction at the bid's max value would
+            take their roster over its salary cap or the league's roster limit.  The auctions the bidder is already
+            winning are in the roster's exposure (see Roster.winning_value), so this is one read of the roster and league
+        """
+        try:
+            roster = Roster.objects.select_related('league').get(league=self.league_id, season=self.season_id, user=bid.bidder_id)
+        except Roster.DoesNotExist:
+            raise ValidationError('You do not have a roster in this league')
+        available_salary = roster.get_available_salary()
+        open_spots = roster.get_open_spots(roster.league.roster_limit)
+        if self.high_bidder_id == bid.bidder_id:
+            #the bidder's high bid on this auction is already in their exposure, and is replaced by this bid
+            available_salary += self.high_bid_value
+            open_spots += 1
+        if bid.max_value > available_salary:
+            raise ValidationError('A bid of %d is over your available salary of %d' % (bid.max_value, available_salary))
+        if open_spots < 1:
+            raise ValidationError('Your roster is full, counting the auctions you are winning')
+
+    def _bid_made(self, resolution):
+        """ Called once the transaction of a bid has committed, with the bid's BidResolution (None if it was not made)
+        """
+        BIDS.inc(case=BID_CASE_NAMES[resolution.case] if resolution != None else 'rejected')
+        if resolution != None and resolution.case in (BID_FIRST, BID_OUTBID, BID_NOT_OUTBID):
+            publish_auction_event(self, 'bid')
+            bump_league_version(self.league_id)
+
+    def _state_changed(self):
+        """ Called once a change of the auction's state has been saved """
+        publish_auction_event(self, 'state')
+        bump_league_version(self.league_id)
 
     def expire(self):
-        """ Expiration time for auction has been hit.  For standard auction, just calls complete()
+        """ Expiration time for auction has been hit.  Locks the auction, so that no bid is made while it is being
+            completed, and calls _expire().  An auction held by a BidEngine in this process is released first, so that
+            its pending bids are written before it is completed
+        """
+        engine = engine_auctions.get(self.id)
+        if engine != None:
+            engine.release(self.id)
+        with COMPLETION_SECONDS.time(path='expire'):
+            with transaction.commit_on_success():
+                self.lock()
+                self._expire()
+        self._state_changed()
+
+    def _expire(self):
+        """ For standard auction, just calls complete()
             UFAAuction and RFAAuction will override this method and do actions specific to them
         """
         self.complete()
 
     def complete(self):
+        COMPLETIONS.inc(kind='standard')
         self._set_completed_and_create_rosterplayer(salary=self.high_bid_value)
 
+    def get_salary(self):
+        """ Returns the salary the high bidder gets the player for, when the auction expires """
+        return self.high_bid_value
+
     def get_high_bid(self):
         """ Returns Bid object of high bid """
-        try:
-            high_bid = Bid.objects.get(auction=self, current_high_bid=True)
-        except Bid.DoesNotExist:
+        if self.high_bid_id == None:
             return None
-        return high_bid
+        return self.high_bid
+
+    def lock(self):
+        """ Locks the auction row (SELECT ... FOR UPDATE) until the end of the current transaction, and refreshes the
+            fields that bids and state changes read from it.  Serializes bids and state changes on this auction, while
+            bids on other auctions are not blocked
+        """
+        with LOCK_WAIT_SECONDS.time():
+            locked = Auction.objects.select_for_update().get(id=self.id)
+        self._refresh_from(locked)
+
+    def refresh(self):
+        """ Re-reads the fields lock() refreshes, without locking - e.g. after a bid's transaction was rolled back """
+        self._refresh_from(Auction.objects.get(id=self.id))
+
+    def _refresh_from(self, locked):
+        self.state = locked.state
+        self.seq = locked.seq
+        self.high_bid_value = locked.high_bid_value
+        self._set_related_id('high_bidder', locked.high_bidder_id)
+        #the high bid row may have changed even if the high bid did not (e.g. its current_value), so it is always re-read
+        self.high_bid_id = locked.high_bid_id
+        self.__dict__.pop(Auction.high_bid.cache_name, None)
+
+    def _set_related_id(self, name, value):
+        """ Sets the id of ForeignKey name, dropping the cached related object if the id changes """
+        field = self._meta.get_field(name)
+        if getattr(self, field.attname) != value:
+            setattr(self, field.attname, value)
+            self.__dict__.pop(field.get_cache_name(), None)
+
+    def get_subclass(self):
+        """ Returns this auction as its UFAAuction, if it is one, so that subclass behavior (e.g. expire()) applies """
+        if isinstance(self, UFAAuction):
+            return self
+        try:
+            return self.ufaauction
+        except UFAAuction.DoesNotExist:
+            return self
+
+    def is_upcoming(self):
+        return True if self.state == UPCOMING else False
 
     def is_live(self):
         return True if self.state == LIVE else False
@@ -124,34 +327,50 @@ class Auction(models.Model):
     def set_upcoming(self):
         if self.state != UPCOMING:
             self.state = UPCOMING
+            self.seq += 1
             self.save()
+            AuctionEvent.log_state(self)
+            self._state_changed()
 
     def set_live(self):
         if self.state != LIVE:
             self.state = LIVE
+            self.seq += 1
             self.save()
+            AuctionEvent.log_state(self)
+            self._state_changed()
 
     def set_pending(self):
         if self.state != PENDING:
             self.state = PENDING
+            self.seq += 1
             self.save()
+            AuctionEvent.log_state(self)
+            self._state_changed()
 
     def set_completed(self):
         if self.state != COMPLETED:
             self.state = COMPLETED
+            self.seq += 1
             self.save()
+            AuctionEvent.log_state(self)
 
     def _set_completed_and_create_rosterplayer(self, salary):
         """ Completes the auction if it is not already completed:
             -Change state to COMPLETED
-            -If there is a high bidder, adds the player to the high bidder's roster
+            -If there is a high bidder, adds the player to the high bidder's roster, removes the auction from the
+             roster's exposure, and queues a WON Notification to them
             -Sets Bid with current_high_bid = True to winning_bid = True
         """
         if not self.is_completed():
+            EXPIRATION_LAG_SECONDS.observe((timezone.now() - self.expiration_time).total_seconds())
             self.set_completed()
             if self.high_bidder != None:
-                roster = Roster.objects.get(user=self.high_bidder)
+                roster = Roster.objects.get(league=self.league_id, season=self.season_id, user=self.high_bidder_id)
                 roster.add_player(player=self.player, salary=salary)
+                adjust_roster_numbers(roster.id, 0, 0, -self.high_bid_value, -1)
+                Notification.objects.create(user_id=self.high_bidder_id, auction_id=self.id, kind=Notification.WON,
+                    time=timezone.now(), value=salary)
                 high_bid = self.get_high_bid()
                 high_bid.set_winning_bid()
             self.save()
@@ -170,8 +389,8 @@ class UFAAuction(Auction):
     discount_percentage = models.FloatField(default=0)
     discount_max = models.IntegerField(default=UFA_DISCOUNT_MAX_DEFAULT)
 
-    def expire(self):
-        if self.high_bidder == self.original_owner:
+    def _expire(self):
+        if self.high_bidder_id == self.original_owner_id:
             self.complete_ufa()
         else:
             self.complete()
@@ -179,10 +398,18 @@ class UFAAuction(Auction):
     def complete_ufa(self):
         """ Same as complete() but applies UFA discount
         """
-        import math
+        COMPLETIONS.inc(kind='ufa')
+        self._set_completed_and_create_rosterplayer(salary=self.get_ufa_salary())
+
+    def get_salary(self):
+        if self.high_bidder_id == self.original_owner_id:
+            return self.get_ufa_salary()
+        return self.high_bid_value
+
+    def get_ufa_salary(self):
+        """ Returns the high bid value with the UFA discount applied """
         salary_discount = min(int(math.ceil(self.discount_percentage * self.high_bid_value)), self.discount_max)
-        updated_salary = max(self.high_bid_value-salary_discount, MIN_BID_VALUE)
-        self._set_completed_and_create_rosterplayer(salary=updated_salary)
+        return max(self.high_bid_value-salary_discount, MIN_BID_VALUE)
 
 class Bid(models.Model):
     """ Represents a bid on an auction
@@ -198,6 +425,11 @@ class Bid(models.Model):
             current_high_bid - True if this bid is the currently winning bid.  for the bids in an auction, only one bid should
                 have this be True
             winning_bid - True if this bid won the auction, e.g. was high bid when auction completed
+            seq - the auction's seq when the bid was made (see Auction.seq), unique per auction.  None if the bid was not
+                made, e.g. the auction was not live
+            idempotency_key - key the client submitted the bid with (see Auction.submit_bid), unique per bidder.  None if
+                the bid was not submitted with one
+        Once a new bid is saved, resolution is the BidResolution it was made with (None if it was not made).  It is not stored
     """
     auction = models.ForeignKey(Auction)
     bidder = models.ForeignKey(User)
@@ -206,14 +438,42 @@ class Bid(models.Model):
     max_value = models.IntegerField()
     current_high_bid = models.BooleanField(default=False) #whether this is current high bid, for an active auction
     winning_bid = models.BooleanField(default=False) #whether this is winning bid for a completed auction
+    seq = models.IntegerField(blank=True, null=True)
+    idempotency_key = models.CharField(max_length=64, blank=True, null=True)
+
+    class Meta:
+        unique_together = (('auction', 'seq'), ('bidder', 'idempotency_key'))
 
     def save(self, *args, **kwargs):
         new_bid = True if self.id is None else False
-        super(Bid, self).save(*args, **kwargs)
-        #if this is a new bid, make the bid on the auction
-        if new_bid:
-            auction = self.auction
-            auction.make_bid(self)
+        if not new_bid:
+            super(Bid, self).save(*args, **kwargs)
+            return
+        #if this is a new bid, make the bid on the auction.  the bid is made and inserted in one transaction
+        with BID_SECONDS.time():
+            with transaction.commit_on_success():
+                auction = self.auction
+                #lock the auction before inserting - the insert's foreign key check takes a share lock on the auction
+                #   row, which concurrent bids would deadlock on when upgrading to the row lock
+                auction.lock()
+                #the bid is made before it is inserted, so the row is written once with its resolved values
+                resolution = auction._make_bid(self)
+                if self.id is None:
+                    #bid was not made, e.g. auction is not live
+                    super(Bid, self).save(*args, **kwargs)
+        self.resolution = resolution
+        auction._bid_made(resolution)
+        if resolution != None:
+            trace_recorder.record(self, auction)
+
+    def save_resolved(self):
+        """ Writes the current_value and current_high_bid set by Auction.make_bid - inserts a new bid, or updates
+            only those columns of an existing bid
+        """
+        if self.id is None:
+            super(Bid, self).save(force_insert=True)
+        else:
+            Bid.objects.filter(id=self.id).update(current_value=self.current_value, current_high_bid=self.current_high_bid, seq=self.seq)
 
     def set_current_value(self, current_value):
         if self.current_value != current_value:
@@ -237,3 +497,117 @@ class Bid(models.Model):
 
     def __unicode__(self):
         return self.bidder.username + ', ' + self.auction.player.name + ', ' + str(self.time)
+
+
+class AuctionEvent(models.Model):
+    """ Append-only log of what happened to an auction - every bid made and every state change, in the same transaction
+        as the change (or, for auction.engine.BidEngine, before the bid is acknowledged).  Unlike Bid rows, events are
+        never updated, so an auction's state at any seq can be rebuilt from them (see auction.replay)
+        Fields:
+            auction - auction the event happened to
+            seq - the auction's seq after the event (see Auction.seq)
+            kind - BID or STATE
+            time - when the bid was made, or when the state changed
+            bidder - BID: user that made the bid
+            max_value - BID: the bid's max value.  its resolved values follow from replaying the bids before it
+            state - STATE: the auction's new state
+    """
+    BID = 1
+    STATE = 2
+    KIND_CHOICES = (
+        (BID, 'Bid'),
+        (STATE, 'State'),
+    )
+
+    auction = models.ForeignKey(Auction)
+    seq = models.IntegerField()
+    kind = models.SmallIntegerField(choices=KIND_CHOICES)
+    time = models.DateTimeField()
+    bidder = models.ForeignKey(User, blank=True, null=True)
+    max_value = models.IntegerField(blank=True, null=True)
+    state = models.IntegerField(blank=True, null=True)
+
+    def save(self, *args, **kwargs):
+        if self.id != None:
+            raise ValueError('AuctionEvent is append-only')
+        super(AuctionEvent, self).save(*args, **kwargs)
+
+    @classmethod
+    def for_state(cls, auction, time=None):
+        """ Returns the (unsaved) STATE event of an auction's current state and seq """
+        return cls(auction_id=auction.id, seq=auction.seq, kind=cls.STATE, time=time or timezone.now(), state=auction.state)
+
+    @classmethod
+    def log_state(cls, auction):
+        """ Appends the STATE event of an auction's current state and seq """
+        event = cls.for_state(auction)
+        event.save()
+        return event
+
+    def __unicode__(self):
+        return '%s %s %s' % (self.auction_id, self.seq, self.get_kind_display())
+
+class AuctionSnapshot(models.Model):
+    """ State of an auction at a seq, rebuilt from its AuctionEvents (see auction.replay), so that replay starts from the
+        latest snapshot instead of the first event
+        Fields:
+            auction - auction this is a snapshot of
+            seq - seq of the latest event included
+            time - when the snapshot was taken
+            state - the auction's state, None if no state change was logged
+            high_bid_value, high_bidder - denormalized high bid of the auction
+            high_bid_seq - seq of the high bid (the Bid with current_high_bid = True)
+            high_bid_max_value, high_bid_current_value - max_value and current_value of the high bid
+    """
+    auction = models.ForeignKey(Auction)
+    seq = models.IntegerField()
+    time = models.DateTimeField()
+    state = models.IntegerField(blank=True, null=True)
+    high_bid_value = models.IntegerField(blank=True, null=True)
+    high_bidder = models.ForeignKey(User, blank=True, null=True)
+    high_bid_seq = models.IntegerField(blank=True, null=True)
+    high_bid_max_value = models.IntegerField(blank=True, null=True)
+    high_bid_current_value = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = (('auction', 'seq'),)
+
+class Notification(models.Model):
+    """ Queued notification to an owner about an auction.  Bids and completions only insert a row, in their transaction;
+        the sendnotifications worker (auction.notifications) coalesces each owner's notifications into one email
+        Fields:
+            user - owner to notify
+            auction - auction the notification is about
+            kind - OUTBID (the owner's high bid was outbid), WON (the owner won the auction) or ENDING (an auction the
+                owner bid on is about to expire)
+            time - when the notification was queued
+            value - the auction's high bid value when the notification was queued
+            sent - when the notification was sent, None while it is queued
+    """
+    OUTBID = 1
+    WON = 2
+    ENDING = 3
+    KIND_CHOICES = (
+        (OUTBID, 'Outbid'),
+        (WON, 'Won'),
+        (ENDING, 'Ending'),
+    )
+
+    user = models.ForeignKey(User)
+    auction = models.ForeignKey(Auction)
+    kind = models.SmallIntegerField(choices=KIND_CHOICES)
+    time = models.DateTimeField()
+    value = models.IntegerField(blank=True, null=True)
+    sent = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    def is_outbid(self):
+        return True if self.kind == Notification.OUTBID else False
+
+    def is_won(self):
+        return True if self.kind == Notification.WON else False
+
+    def is_ending(self):
+        return True if self.kind == Notification.ENDING else False
+
+    def __unicode__(self):
+        return '%s %s %s' % (self.user_id, self.auction_id, self.get_kind_display())
@@ -0,0 +1,85 @@
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Min
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from auction.constants import LIVE
+from auction.models import Auction, Bid, Notification
+
+@transaction.commit_on_success
+def queue_ending_notifications(now=None, warning=None):
+    """ Queues an ENDING Notification to every bidder of each LIVE auction that expires within warning seconds (default
+        AUCTION_NOTIFICATION_ENDING_WARNING), once per auction.  Returns the number of notifications queued
+    """
+    if now == None:
+        now = timezone.now()
+    if warning == None:
+        warning = getattr(settings, 'AUCTION_NOTIFICATION_ENDING_WARNING', 600)
+    #the auctions are locked (in id order) before they are checked for ENDING notifications, so a worker running at the
+    #   same time waits until this one's notifications are committed, and then finds them
+    auction_ids = list(Auction.objects.select_for_update().filter(state=LIVE,
+        expiration_time__lte=now + datetime.timedelta(seconds=warning)).order_by('id').values_list('id', flat=True))
+    if not auction_ids:
+        return 0
+    auctions = dict(Auction.objects.filter(id__in=auction_ids).exclude(notification__kind=Notification.ENDING)
+        .values_list('id', 'high_bid_value'))
+    if not auctions:
+        return 0
+    bidders = Bid.objects.filter(auction__in=auctions.keys()).values_list('auction', 'bidder').distinct()
+    notifications = [Notification(user_id=bidder_id, auction_id=auction_id, kind=Notification.ENDING, time=now,
+        value=auctions[auction_id]) for auction_id, bidder_id in bidders]
+    Notification.objects.bulk_create(notifications)
+    return len(notifications)
+
+def send_digests(now=None, interval=None):
+    """ Sends each owner one email with all of their queued notifications, once the oldest has waited interval seconds
+        (default AUCTION_NOTIFICATION_DIGEST_INTERVAL), so that a burst of bids becomes one email.  Within a digest, an
+        auction is listed once per kind, with its latest value, and OUTBID notifications are dropped for auctions the
+        owner is winning again.  Each owner's notifications are marked sent once their email is delivered, so a failed
+        delivery is retried on the next run without resending the digests delivered before it.  Returns the number of
+        emails sent
+    """
+    if now == None:
+        now = timezone.now()
+    if interval == None:
+        interval = getattr(settings, 'AUCTION_NOTIFICATION_DIGEST_INTERVAL', 60)
+    due_users = list(Notification.objects.filter(sent=None).values('user').annotate(first=Min('time')).filter(
+        first__lte=now - datetime.timedelta(seconds=interval)).order_by('user').values_list('user', flat=True))
+    if not due_users:
+        return 0
+    connection = get_connection()
+    connection.open()
+    try:
+        return len([user_id for user_id in due_users if _send_digest(user_id, now, connection)])
+    finally:
+        connection.close()
+
+@transaction.commit_on_success
+def _send_digest(user_id, now, connection):
+    """ Sends a user the digest of their queued notifications, over the email connection, and marks them sent.  The
+        notifications are locked first, so a worker running at the same time does not send them too.  Returns whether
+        an email was sent
+    """
+    #only the notifications are locked - not their auctions, which bids lock
+    ids = list(Notification.objects.select_for_update().filter(sent=None, user=user_id).values_list('id', flat=True))
+    if not ids:
+        return False
+    latest = {} #(auction id, kind) -> latest notification
+    for notification in Notification.objects.filter(id__in=ids).select_related('user', 'auction__player').order_by('time',
+            'id'):
+        latest[(notification.auction_id, notification.kind)] = notification
+    user = notification.user
+    items = sorted((notification for notification in latest.values() if not (notification.kind == Notification.OUTBID and
+        notification.auction.high_bidder_id == user.id)), key=lambda notification: (notification.kind, notification.time))
+    sent = False
+    if items and user.email:
+        body = render_to_string('notification_digest.txt', {'user': user, 'notifications': items})
+        subject = '%d auction update%s' % (len(items), '' if len(items) == 1 else 's')
+        connection.send_messages([EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [user.email])])
+        sent = True
+    Notification.objects.filter(id__in=ids).update(sent=now)
+    return sent
@@ -0,0 +1,38 @@
+from collections import namedtuple
+
+from auction.constants import MIN_BID_VALUE, MIN_BID_INCREMENT, BID_INVALID, BID_FIRST, BID_RAISE_PROXY, BID_OUTBID, BID_NOT_OUTBID
+
+#Result of resolving a bid against the current high bid of an auction
+#Fields:
+#   case - which proxy case the bid hit (BID_FIRST, BID_RAISE_PROXY, BID_OUTBID, BID_NOT_OUTBID or BID_INVALID)
+#   bid_current_value - current_value of the made bid
+#   bid_is_high - True if the made bid becomes the current high bid
+#   high_bid_current_value - new current_value of the previous high bid, None if it does not change
+#   high_bid_value - high_bid_value of the auction after the bid
+#   high_bidder_id - id of the auction's high bidder after the bid
+BidResolution = namedtuple('BidResolution', ['case', 'bid_current_value', 'bid_is_high', 'high_bid_current_value',
+    'high_bid_value', 'high_bidder_id'])
+
+def resolve_bid(high_bidder_id, high_max_value, high_current_value, bidder_id, max_value):
+    """ Resolves a bid of max_value by bidder_id against the current high bid of an auction, without touching the
+        database.  high_bidder_id is None if the auction has no bids yet.  See Auction.make_bid for the four cases.
+    """
+    #first bid
+    if high_bidder_id == None:
+        if max_value >= MIN_BID_VALUE:
+            return BidResolution(BID_FIRST, MIN_BID_VALUE, True, None, MIN_BID_VALUE, bidder_id)
+        return BidResolution(BID_INVALID, max_value, False, None, None, None)
+    #this bid has same bidder as high bidder - high bidder is raising his proxy bid
+    if bidder_id == high_bidder_id:
+        if max_value > high_max_value:
+            #current value is same as previous high bid's current value
+            return BidResolution(BID_RAISE_PROXY, high_current_value, True, None, high_current_value, high_bidder_id)
+        return BidResolution(BID_INVALID, max_value, False, None, high_current_value, high_bidder_id)
+    #high bid is outbid - new high bid
+    if max_value > high_max_value:
+        new_value = high_max_value + MIN_BID_INCREMENT
+        return BidResolution(BID_OUTBID, new_value, True, high_max_value, new_value, bidder_id)
+    #high bid is not outbid - increase current value if needed
+    if max_value > high_current_value:
+        return BidResolution(BID_NOT_OUTBID, max_value, False, max_value, max_value, high_bidder_id)
+    return BidResolution(BID_INVALID, max_value, False, None, high_current_value, high_bidder_id)
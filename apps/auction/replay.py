@@ -0,0 +1,154 @@
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from auction.constants import LIVE
+from auction.models import Auction, AuctionEvent, AuctionSnapshot, Bid
+from auction.proxy import resolve_bid
+from league.models import move_exposure
+
+#events between the snapshots taken by take_snapshots()
+SNAPSHOT_INTERVAL = 100
+
+class AuctionState(object):
+    """ State of an auction rebuilt by replaying its AuctionEvents in seq order.  Replay is deterministic - bids are
+        resolved by the same auction.proxy.resolve_bid as the bid path, from the bid's max value alone
+        Fields:
+            auction_id - id of the auction
+            seq - seq of the latest event applied
+            state - state of the auction, None if no state change has been applied
+            high_bid_value, high_bidder_id - denormalized high bid of the auction
+            high_bid_seq, high_bid_max_value, high_bid_current_value - seq, max_value and current_value of the high bid
+    """
+    def __init__(self, auction_id, seq=0, state=None, high_bid_value=None, high_bidder_id=None, high_bid_seq=None,
+            high_bid_max_value=None, high_bid_current_value=None):
+        self.auction_id = auction_id
+        self.seq = seq
+        self.state = state
+        self.high_bid_value = high_bid_value
+        self.high_bidder_id = high_bidder_id
+        self.high_bid_seq = high_bid_seq
+        self.high_bid_max_value = high_bid_max_value
+        self.high_bid_current_value = high_bid_current_value
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls(snapshot.auction_id, seq=snapshot.seq, state=snapshot.state, high_bid_value=snapshot.high_bid_value,
+            high_bidder_id=snapshot.high_bidder_id, high_bid_seq=snapshot.high_bid_seq,
+            high_bid_max_value=snapshot.high_bid_max_value, high_bid_current_value=snapshot.high_bid_current_value)
+
+    def to_snapshot(self):
+        """ Returns an (unsaved) AuctionSnapshot of this state """
+        return AuctionSnapshot(auction_id=self.auction_id, seq=self.seq, time=timezone.now(), state=self.state,
+            high_bid_value=self.high_bid_value, high_bidder_id=self.high_bidder_id, high_bid_seq=self.high_bid_seq,
+            high_bid_max_value=self.high_bid_max_value, high_bid_current_value=self.high_bid_current_value)
+
+    def apply(self, event):
+        """ Applies an event.  Returns the BidResolution of a BID event, None for a STATE event """
+        self.seq = max(self.seq, event.seq)
+        if event.kind == AuctionEvent.STATE:
+            self.state = event.state
+            return None
+        resolution = resolve_bid(self.high_bidder_id, self.high_bid_max_value, self.high_bid_current_value,
+            event.bidder_id, event.max_value)
+        if resolution.high_bid_current_value != None:
+            self.high_bid_current_value = resolution.high_bid_current_value
+        if resolution.bid_is_high:
+            self.high_bid_seq = event.seq
+            self.high_bid_max_value = event.max_value
+            self.high_bid_current_value = resolution.bid_current_value
+        self.high_bid_value = resolution.high_bid_value
+        self.high_bidder_id = resolution.high_bidder_id
+        return resolution
+
+def replay_auction(auction_id, until_seq=None, use_snapshots=True):
+    """ Returns the AuctionState of an auction after the events up to until_seq (all events if None), starting from the
+        latest snapshot at or before it
+    """
+    state = None
+    if use_snapshots:
+        snapshots = AuctionSnapshot.objects.filter(auction=auction_id)
+        if until_seq != None:
+            snapshots = snapshots.filter(seq__lte=until_seq)
+        snapshots = list(snapshots.order_by('-seq')[:1])
+        if snapshots:
+            state = AuctionState.from_snapshot(snapshots[0])
+    events = AuctionEvent.objects.filter(auction=auction_id)
+    if state == None:
+        #the creation STATE event has seq 0
+        state = AuctionState(auction_id)
+    else:
+        events = events.filter(seq__gt=state.seq)
+    if until_seq != None:
+        events = events.filter(seq__lte=until_seq)
+    for event in events.order_by('seq', 'id'):
+        state.apply(event)
+    return state
+
+def take_snapshot(auction_id):
+    """ Saves a snapshot of an auction's current state from its events.  Returns the snapshot, or None if the latest
+        snapshot is already current
+    """
+    state = replay_auction(auction_id)
+    if state.seq == 0 or AuctionSnapshot.objects.filter(auction=auction_id, seq=state.seq).exists():
+        return None
+    snapshot = state.to_snapshot()
+    snapshot.save()
+    return snapshot
+
+def take_snapshots(interval=SNAPSHOT_INTERVAL):
+    """ Snapshots every auction with at least interval events since its latest snapshot.  Returns the number taken """
+    latest = dict(AuctionSnapshot.objects.values_list('auction').annotate(seq=Max('seq')))
+    taken = 0
+    for auction_id, seq in Auction.objects.filter(seq__gte=interval).values_list('id', 'seq'):
+        if seq - latest.get(auction_id, 0) >= interval and take_snapshot(auction_id) != None:
+            taken += 1
+    return taken
+
+def recover_auction(auction_id):
+    """ Rebuilds the Bid rows and denormalized fields of an auction from its events, after bids were logged but never
+        written, e.g. the process running auction.engine.BidEngine died between a bid and the next flush.  Replays every
+        event, since the values of every bid are needed.  Returns the number of bids recovered
+    """
+    with transaction.commit_on_success():
+        auction = Auction.objects.select_for_update().get(id=auction_id)
+        events = list(AuctionEvent.objects.filter(auction=auction_id).order_by('seq', 'id'))
+        state = AuctionState(auction_id)
+        values = {} #bid seq -> current_value after every event
+        for event in events:
+            high_bid_seq = state.high_bid_seq
+            resolution = state.apply(event)
+            if resolution == None:
+                continue
+            values[event.seq] = resolution.bid_current_value
+            if resolution.high_bid_current_value != None:
+                values[high_bid_seq] = resolution.high_bid_current_value
+        bids = dict(Bid.objects.filter(auction=auction_id, seq__isnull=False).values_list('seq', 'current_value'))
+        missing = [event for event in events if event.kind == AuctionEvent.BID and event.seq not in bids]
+        if not missing:
+            return 0
+        #at most one current high bid at a time, so flags are cleared before the missing bids are inserted
+        Bid.objects.filter(auction=auction_id, current_high_bid=True).update(current_high_bid=False)
+        Bid.objects.bulk_create([Bid(auction_id=auction_id, bidder_id=event.bidder_id, time=event.time,
+            max_value=event.max_value, current_value=values[event.seq], seq=event.seq) for event in missing])
+        for seq, current_value in bids.items():
+            if seq in values and values[seq] != current_value:
+                Bid.objects.filter(auction=auction_id, seq=seq).update(current_value=values[seq])
+        high_bid_id = None
+        if state.high_bid_seq != None:
+            high_bid_id = Bid.objects.get(auction=auction_id, seq=state.high_bid_seq).id
+            Bid.objects.filter(id=high_bid_id).update(current_high_bid=True)
+        Auction.objects.filter(id=auction_id).update(seq=max(auction.seq, state.seq), high_bid_value=state.high_bid_value,
+            high_bidder=state.high_bidder_id, high_bid=high_bid_id)
+        move_exposure(auction.league_id, auction.season_id, auction.high_bidder_id, auction.high_bid_value,
+            state.high_bidder_id, state.high_bid_value)
+    return len(missing)
+
+def recover_auctions():
+    """ Recovers every LIVE auction whose log is ahead of its rows.  Returns the number of bids recovered """
+    logged = dict(AuctionEvent.objects.filter(auction__state=LIVE).values_list('auction').annotate(seq=Max('seq')))
+    recovered = 0
+    for auction_id, seq in Auction.objects.filter(id__in=logged.keys()).values_list('id', 'seq'):
+        if logged[auction_id] > seq:
+            recovered += recover_auction(auction_id)
+    return recovered
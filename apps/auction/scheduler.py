@@ -0,0 +1,181 @@
+import datetime
+import heapq
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import reset_queries, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from auction.constants import UPCOMING, LIVE
+from auction.models import Auction
+from league.cache import bump_pending_versions
+
+logger = logging.getLogger(__name__)
+
+#scheduled transitions
+START = 'start' #UPCOMING -> LIVE at start_time, via set_live()
+EXPIRE = 'expire' #LIVE -> COMPLETED (or PENDING) at expiration_time, via expire()
+
+#auctions saved within this long before the last seen modified time are read again on refresh, so that rows committed
+#   out of order (a transaction that started earlier but committed later) are not missed
+REFRESH_OVERLAP = datetime.timedelta(seconds=60)
+
+#seconds before a transition that raised is retried, doubled for every further failure up to RETRY_BACKOFF_MAX
+RETRY_BACKOFF = 5.0
+RETRY_BACKOFF_MAX = 300.0
+
+class AuctionScheduler(object):
+    """ Drives auctions through UPCOMING -> LIVE -> COMPLETED on time.  Pending transitions are kept in a heap ordered by
+        due time, and the scheduler sleeps until the next one is due.  New and rescheduled auctions are picked up by
+        refresh(), which only reads auctions saved since the last refresh (Auction.modified), not the whole table.
+
+        tolerance - seconds between refreshes, so a new or rescheduled auction fires at most this late
+        clock, sleep - injectable for tests
+    """
+    def __init__(self, tolerance=None, clock=timezone.now, sleep=time.sleep):
+        if tolerance == None:
+            tolerance = getattr(settings, 'AUCTION_SCHEDULER_TOLERANCE', 1.0)
+        self.tolerance = tolerance
+        self.clock = clock
+        self.sleep = sleep
+        self.queue = [] #heap of (due time, auction id, transition)
+        self.pending = {} #auction id -> (transition, due time).  heap entries that don't match are stale and skipped
+        self.watermark = None #latest Auction.modified seen
+        self.lags = deque(maxlen=1000) #(auction id, transition, seconds late) of the latest transitions fired
+        self.failures = {} #auction id -> (transition, attempts, retry time) of transitions that raised
+        self._stopped = False
+
+    def load(self):
+        """ Loads every UPCOMING and LIVE auction.  Called once on startup, after which refresh() keeps up """
+        self.watermark = Auction.objects.aggregate(modified=Max('modified'))['modified']
+        auctions = Auction.objects.filter(state__in=[UPCOMING, LIVE]).values_list('id', 'state', 'start_time', 'expiration_time')
+        for auction_id, state, start_time, expiration_time in auctions:
+            self.schedule(auction_id, state, start_time, expiration_time)
+        return len(self.pending)
+
+    def refresh(self):
+        """ Schedules auctions that were created or saved since the last refresh.  Returns the number of auctions read """
+        auctions = Auction.objects.all()
+        if self.watermark != None:
+            auctions = auctions.filter(modified__gte=self.watermark - REFRESH_OVERLAP)
+        count = 0
+        for auction_id, state, start_time, expiration_time, modified in auctions.values_list('id', 'state', 'start_time', 'expiration_time', 'modified'):
+            self.schedule(auction_id, state, start_time, expiration_time)
+            if self.watermark == None or modified > self.watermark:
+                self.watermark = modified
+            count += 1
+        return count
+
+    def schedule(self, auction_id, state, start_time, expiration_time):
+        """ Schedules the next transition of an auction from its state, replacing any previously scheduled one """
+        if state == UPCOMING:
+            transition = (START, start_time)
+        elif state == LIVE:
+            transition = (EXPIRE, expiration_time)
+        else:
+            self.pending.pop(auction_id, None)
+            self.failures.pop(auction_id, None)
+            return
+        failure = self.failures.get(auction_id)
+        if failure != None:
+            if failure[0] == transition[0]:
+                #a failed transition is not retried before its backoff, even if the auction is read again by refresh()
+                transition = (transition[0], max(transition[1], failure[2]))
+            else:
+                del self.failures[auction_id]
+        if self.pending.get(auction_id) != transition:
+            self.pending[auction_id] = transition
+            heapq.heappush(self.queue, (transition[1], auction_id, transition[0]))
+
+    def next_due(self):
+        """ Returns the due time of the next pending transition, or None """
+        while self.queue:
+            due, auction_id, transition = self.queue[0]
+            if self.pending.get(auction_id) == (transition, due):
+                return due
+            heapq.heappop(self.queue)
+        return None
+
+    def run_pending(self):
+        """ Fires every transition that is due.  Returns the number fired """
+        fired = 0
+        while True:
+            due = self.next_due()
+            if due == None or due > self.clock():
+                return fired
+            due, auction_id, transition = heapq.heappop(self.queue)
+            del self.pending[auction_id]
+            self.fire(auction_id, transition, due)
+            fired += 1
+
+    def fire(self, auction_id, transition, due):
+        """ Fires a transition, re-reading the auction so that a transition is only fired if it still applies.  A
+            transition that raises (e.g. the high bidder has no roster) is logged and retried with backoff (see
+            failures), so that one bad auction does not stop the scheduler
+        """
+        try:
+            auction = Auction.objects.get(id=auction_id).get_subclass()
+        except Auction.DoesNotExist:
+            return
+        now = self.clock()
+        #the transition changes the auction in memory even if it fails, so it is rescheduled from what was read
+        state, start_time, expiration_time = auction.state, auction.start_time, auction.expiration_time
+        try:
+            if transition == START and state == UPCOMING and start_time <= now:
+                auction.set_live()
+            elif transition == EXPIRE and state == LIVE and expiration_time <= now:
+                auction.expire()
+            else:
+                #auction was changed since it was scheduled - reschedule from its current state
+                self.schedule(auction.id, state, start_time, expiration_time)
+                return
+        except Exception:
+            attempts = self.failures.get(auction_id, (None, 0, None))[1] + 1
+            retry = self.clock() + datetime.timedelta(seconds=min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_BACKOFF_MAX))
+            self.failures[auction_id] = (transition, attempts, retry)
+            logger.exception('auction %s %s failed (attempt %d), retrying at %s', auction_id, transition, attempts, retry)
+            self.schedule(auction_id, state, start_time, expiration_time)
+            return
+        self.failures.pop(auction_id, None)
+        lag = (self.clock() - due).total_seconds()
+        self.lags.append((auction_id, transition, lag))
+        logger.info('auction %s %s fired %.3fs late', auction_id, transition, lag)
+        self.schedule(auction.id, auction.state, auction.start_time, auction.expiration_time)
+
+    def get_lag_stats(self):
+        """ Returns count, mean and max lateness in seconds of the latest transitions fired """
+        lags = [lag for auction_id, transition, lag in self.lags]
+        if not lags:
+            return {'count': 0, 'mean': None, 'max': None}
+        return {'count': len(lags), 'mean': sum(lags) / len(lags), 'max': max(lags)}
+
+    def run(self):
+        """ Runs until stop() is called """
+        self._stopped = False
+        self.load()
+        next_refresh = self.clock()
+        while not self._stopped:
+            now = self.clock()
+            if now >= next_refresh:
+                self.refresh()
+                next_refresh = now + datetime.timedelta(seconds=self.tolerance)
+            self.run_pending()
+            wake = next_refresh
+            due = self.next_due()
+            if due != None and due < wake:
+                wake = due
+            #the loop never returns, so the queries kept with DEBUG are dropped, and the transaction opened by the reads
+            #   of load()/refresh() is ended rather than left idle while sleeping.  league versions bumped in the
+            #   transactions of completed auctions are bumped again, as a request does when it finishes
+            reset_queries()
+            transaction.commit_unless_managed()
+            bump_pending_versions()
+            delay = (wake - self.clock()).total_seconds()
+            if delay > 0:
+                self.sleep(delay)
+
+    def stop(self):
+        self._stopped = True
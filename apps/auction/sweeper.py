@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from auction.completion import complete_auctions
+from auction.constants import UPCOMING, LIVE
+from auction.models import Auction, AuctionEvent
+
+#number of expired auctions handed to completion at a time
+EXPIRE_BATCH_SIZE = 100
+
+def start_due_auctions(now=None):
+    """ Moves every UPCOMING auction whose start_time has passed to LIVE - locks them, then changes them with a single
+        UPDATE, and logs their state changes with a single INSERT.  Returns the number of auctions started
+    """
+    if now == None:
+        now = timezone.now()
+    with transaction.commit_on_success():
+        #the due auctions are locked (in id order, so concurrent sweeps cannot deadlock) before they are changed, so an
+        #   auction a concurrent set_live() started first is no longer UPCOMING when read, and gets no state event here
+        auctions = list(Auction.objects.select_for_update().filter(state=UPCOMING, start_time__lte=now).order_by('id'))
+        if not auctions:
+            return 0
+        #update() does not apply auto_now, so modified is set explicitly for the scheduler's refresh
+        Auction.objects.filter(id__in=[auction.id for auction in auctions]).update(state=LIVE, modified=now, seq=F('seq') + 1)
+        for auction in auctions:
+            auction.state = LIVE
+            auction.seq += 1
+        AuctionEvent.objects.bulk_create([AuctionEvent.for_state(auction, time=now) for auction in auctions])
+    for auction in auctions:
+        auction._state_changed()
+    return len(auctions)
+
+def expire_due_auctions(now=None, batch_size=EXPIRE_BATCH_SIZE):
+    """ Expires every LIVE auction whose expiration_time has passed, batch_size auctions at a time.  Returns the number
+        of auctions expired
+    """
+    if now == None:
+        now = timezone.now()
+    auction_ids = list(Auction.objects.filter(state=LIVE, expiration_time__lte=now).order_by('expiration_time').values_list('id', flat=True))
+    expired = 0
+    for start in range(0, len(auction_ids), batch_size):
+        expired += complete_auctions(auction_ids[start:start + batch_size])
+    return expired
+
+def sweep(now=None, batch_size=EXPIRE_BATCH_SIZE):
+    """ Starts and expires every auction that is due.  Returns (number started, number expired) """
+    if now == None:
+        now = timezone.now()
+    return start_due_auctions(now), expire_due_auctions(now, batch_size)
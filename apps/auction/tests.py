@@ -5,7 +5,41 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import datetime
+import json
+import os
+import re
+import tempfile
+import time
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from auction.bench import SCHEDULER, SWEEP, DraftNightBenchmark, TraceReplay, percentile
+from auction.completion import complete_auctions
+from auction.constants import UPCOMING, LIVE, COMPLETED, BID_INVALID, BID_FIRST, BID_RAISE_PROXY, BID_OUTBID, BID_NOT_OUTBID
+from auction import engine as engine_module
+from auction.engine import BidEngine, get_engine, start_engine
+from auction.events import EventHub, NotifyListener, hub
+from auction.models import Auction, UFAAuction, Bid, AuctionEvent, AuctionSnapshot, Notification, engine_auctions
+from auction.notifications import queue_ending_notifications, send_digests
+from auction.proxy import resolve_bid
+from auction.replay import AuctionState, replay_auction, take_snapshots, recover_auction
+from auction.views import WINNING, OUTBID, load_bid_history, load_my_auctions, parse_bid_cursor
+from auction.scheduler import AuctionScheduler, START, EXPIRE
+from auction.sweeper import start_due_auctions, sweep
+from auction.trace import TraceEntry, recorder, read_trace, schedule_trace
+from fantasyauction.metrics import BIDS, BID_SECONDS, COMPLETIONS, EXPIRATION_LAG_SECONDS
+from league.models import League, Season, Roster, RosterPlayer
+from player.models import Player
 
 
 class SimpleTest(TestCase):
@@ -14,3 +48,983 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class AuctionTestCase(TestCase):
+    """ Creates a league with two owners and a live auction """
+    def setUp(self):
+        self.league = League.objects.create(name='test league', size=2, salary_cap=100, roster_limit=10)
+        self.season = Season.objects.create(name='2013', league=self.league)
+        self.user1 = User.objects.create_user('owner1')
+        self.user2 = User.objects.create_user('owner2')
+        for user in (self.user1, self.user2):
+            self.league.users.add(user)
+            Roster.objects.create(league=self.league, season=self.season, user=user, salary_cap=100, total_salary=0, total_players=0)
+        self.player = Player.objects.create(name='Player', team='TM', position='QB')
+        self.auction = self.create_auction()
+
+    def tearDown(self):
+        #engines are not released by every test, and ids are reused once the test's rows are rolled back
+        engine_auctions.clear()
+
+    def create_auction(self, state=LIVE, **kwargs):
+        now = timezone.now()
+        return Auction.objects.create(league=self.league, season=self.season, player=self.player, state=state,
+            start_time=kwargs.pop('start_time', now - datetime.timedelta(hours=1)),
+            expiration_time=kwargs.pop('expiration_time', now + datetime.timedelta(hours=1)), **kwargs)
+
+    def bid(self, user, max_value, auction=None):
+        bid = Bid(auction=auction or self.auction, bidder=user, time=timezone.now(), max_value=max_value)
+        bid.save()
+        return bid
+
+    def reload(self, obj):
+        return obj.__class__.objects.get(id=obj.id)
+
+
+class ResolveBidTest(TestCase):
+    def test_cases(self):
+        self.assertEqual(resolve_bid(None, None, None, 1, 10).case, BID_FIRST)
+        self.assertEqual(resolve_bid(None, None, None, 1, 0).case, BID_INVALID)
+        self.assertEqual(resolve_bid(1, 10, 1, 1, 20), (BID_RAISE_PROXY, 1, True, None, 1, 1))
+        self.assertEqual(resolve_bid(1, 10, 1, 1, 5).case, BID_INVALID)
+        self.assertEqual(resolve_bid(1, 10, 1, 2, 15), (BID_OUTBID, 11, True, 10, 11, 2))
+        self.assertEqual(resolve_bid(1, 10, 1, 2, 7), (BID_NOT_OUTBID, 7, False, 7, 7, 1))
+        self.assertEqual(resolve_bid(1, 10, 7, 2, 7).case, BID_INVALID)
+
+
+class MakeBidTest(AuctionTestCase):
+    def test_proxy_cases(self):
+        first = self.bid(self.user1, 10)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.high_bid_value, auction.high_bidder), (1, self.user1))
+        under = self.bid(self.user2, 5)
+        self.assertEqual(self.reload(under).current_value, 5)
+        self.assertEqual(self.reload(first).current_value, 5)
+        self.assertEqual(self.reload(self.auction).high_bid_value, 5)
+        raised = self.bid(self.user1, 20)
+        self.assertEqual(self.reload(raised).current_value, 5)
+        self.assertFalse(self.reload(first).current_high_bid)
+        outbid = self.bid(self.user2, 25)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.high_bid_value, auction.high_bidder), (21, self.user2))
+        self.assertEqual(self.reload(raised).current_value, 20)
+        self.assertEqual(list(Bid.objects.filter(current_high_bid=True)), [outbid])
+        self.assertEqual(auction.get_high_bid(), outbid)
+
+    def test_stale_auction_is_refreshed_under_lock(self):
+        stale = Auction.objects.get(id=self.auction.id)
+        self.bid(self.user1, 10)
+        outbid = self.bid(self.user2, 15, auction=stale)
+        self.assertEqual((stale.high_bid_value, stale.high_bidder), (11, self.user2))
+        self.assertEqual(list(Bid.objects.filter(current_high_bid=True)), [outbid])
+
+    def test_expire(self):
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 5)
+        Auction.objects.get(id=self.auction.id).expire()
+        self.assertTrue(self.reload(self.auction).is_completed())
+        roster = Roster.objects.get(user=self.user1)
+        self.assertEqual((roster.total_salary, roster.total_players), (5, 1))
+        self.assertEqual(Bid.objects.get(winning_bid=True).max_value, 10)
+        #bids on a completed auction do not change it
+        self.bid(self.user2, 20)
+        self.assertEqual(self.reload(self.auction).high_bidder, self.user1)
+
+
+class BidStatementsTest(AuctionTestCase):
+    """ Statements per proxy case.  The budget is 6 to 10 statements per bid.  Resolving the bid writes at most 3 of
+        them (the previous high bid, the bid, and the auction's denormalized fields).  The rest are the auction lock, the
+        high bid lookup, validate_bid's roster read, the AuctionEvent insert, the rosters' exposure and the OUTBID
+        notification, which later features added to the same transaction
+    """
+    RESOLUTION_WRITES = 3
+
+    def assertBidQueries(self, num, user, max_value):
+        bid = Bid(auction=self.auction, bidder=user, time=timezone.now(), max_value=max_value)
+        with self.assertNumQueries(num):
+            start = len(connection.queries)
+            bid.save()
+            writes = [query['sql'] for query in connection.queries[start:]
+                if re.match(r'(INSERT INTO|UPDATE) "auction_(bid|auction)"', query['sql'])]
+        self.assertTrue(len(writes) <= self.RESOLUTION_WRITES, writes)
+
+    def test_statements_per_case(self):
+        #lock, roster, insert, event, auction update, new high bidder's exposure
+        self.assertBidQueries(6, self.user1, 10)
+        #lock, roster, high bid, high bid update, insert, event, auction update, high bidder's exposure
+        self.assertBidQueries(8, self.user2, 5)
+        #lock, roster, high bid, high bid update, insert, event, auction update (high bid value is unchanged)
+        self.assertBidQueries(7, self.user1, 20)
+        #lock, roster, high bid, high bid update, insert, event, auction update, old and new high bidders' exposure,
+        #   outbid notification
+        self.assertBidQueries(10, self.user2, 25)
+        #lock, roster, high bid, insert, event, auction seq update
+        self.assertBidQueries(6, self.user2, 10)
+
+
+class BidEngineTest(AuctionTestCase):
+    def test_matches_make_bid(self):
+        self.bid(self.user1, 10)
+        engine = BidEngine()
+        self.assertEqual(engine.warm(), 1)
+        engine.make_bid(self.auction.id, self.user2.id, 5)
+        engine.make_bid(self.auction.id, self.user1.id, 20)
+        self.assertEqual(engine.get_state(self.auction.id), (5, self.user1.id))
+        self.assertEqual(engine.flush(), 2)
+        engine.make_bid(self.auction.id, self.user2.id, 25)
+        engine.make_bid(self.auction.id, self.user1.id, 22)
+        self.assertEqual(engine.flush(), 2)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.high_bid_value, auction.high_bidder), (22, self.user2))
+        high_bids = Bid.objects.filter(auction=self.auction, current_high_bid=True)
+        self.assertEqual([(bid.max_value, bid.current_value) for bid in high_bids], [(25, 22)])
+        self.assertEqual(sorted(Bid.objects.values_list('max_value', 'current_value')), [(5, 5), (10, 5), (20, 20), (22, 22), (25, 22)])
+
+    def test_refuses_unknown_auction(self):
+        engine = BidEngine()
+        self.assertEqual(engine.make_bid(self.auction.id, self.user1.id, 10), None)
+        engine.load(self.auction)
+        self.assertNotEqual(engine.make_bid(self.auction.id, self.user1.id, 10), None)
+        engine.release(self.auction.id)
+        self.assertEqual(engine.get_state(self.auction.id), None)
+        self.assertEqual(self.reload(self.auction).high_bid_value, 1)
+
+    def test_held_auctions_refuse_other_bids(self):
+        engine = BidEngine()
+        engine.load(self.auction)
+        engine.make_bid(self.auction.id, self.user1.id, 10)
+        self.assertRaises(ValidationError, self.bid, self.user2, 20)
+        self.assertRaises(ValidationError, self.auction.submit_bid, self.user2, 20, 'key')
+        self.assertEqual(Bid.objects.count(), 0)
+        since = hub.last_id
+        engine.flush()
+        events = hub.get_events('auction:%d' % self.auction.id, since)[0]
+        self.assertEqual([(event['type'], event['seq'], event['high_bidder']) for _, event in events], [('bid', 1, self.user1.id)])
+        engine.release(self.auction.id)
+        self.bid(self.user2, 20)
+        self.assertEqual(self.reload(self.auction).seq, 2)
+
+    def test_expire_releases_held_auction(self):
+        engine = BidEngine()
+        engine.load(self.auction)
+        engine.make_bid(self.auction.id, self.user1.id, 5)
+        engine.make_bid(self.auction.id, self.user2.id, 10)
+        self.reload(self.auction).expire()
+        self.assertEqual(engine.get_state(self.auction.id), None)
+        self.assertEqual(engine.flush(), 0)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.state, auction.high_bid_value, auction.high_bidder), (COMPLETED, 6, self.user2))
+        self.assertEqual(list(RosterPlayer.objects.values_list('roster__user', 'salary')), [(self.user2.id, 6)])
+        self.assertEqual(list(Roster.objects.order_by('user').values_list('winning_value', 'winning_auctions')), [(0, 0), (0, 0)])
+
+    def test_flush_leaves_out_completed_auction(self):
+        engine = BidEngine()
+        engine.load(self.auction)
+        engine.make_bid(self.auction.id, self.user1.id, 5)
+        #completed by another process, which does not know the engine holds it
+        del engine_auctions[self.auction.id]
+        complete_auctions([self.auction.id])
+        self.assertEqual(engine.flush(), 0)
+        self.assertEqual(engine.get_state(self.auction.id), None)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.state, auction.high_bid_value, auction.high_bidder_id), (COMPLETED, None, None))
+        self.assertEqual((Bid.objects.count(), RosterPlayer.objects.count()), (0, 0))
+        self.assertEqual(list(Roster.objects.values_list('winning_value', 'winning_auctions')), [(0, 0), (0, 0)])
+
+    def test_flush_isolates_failed_auction(self):
+        auction2 = self.create_auction()
+        engine = BidEngine()
+        engine.load(self.auction)
+        engine.load(auction2)
+        engine.make_bid(self.auction.id, self.user1.id, 5)
+        engine.make_bid(auction2.id, self.user1.id, 5)
+        #a bid from another process took the seq the engine gave out
+        Bid.objects.bulk_create([Bid(auction=self.auction, bidder=self.user2, time=timezone.now(), max_value=3, seq=1)])
+        self.assertEqual(engine.flush(), 1)
+        self.assertEqual(engine.get_state(self.auction.id), None)
+        self.assertEqual(engine.get_state(auction2.id), (1, self.user1.id))
+        self.assertEqual((self.reload(auction2).high_bid_value, Bid.objects.filter(auction=auction2).count()), (1, 1))
+        #the failed auction can be loaded again
+        self.assertNotEqual(engine.load(self.reload(self.auction)), None)
+
+    def test_bid_is_not_made_if_log_fails(self):
+        class FailingEventLog(object):
+            def append(self, events):
+                raise IOError('log unavailable')
+        engine = BidEngine(event_log=FailingEventLog())
+        engine.load(self.auction)
+        self.assertRaises(IOError, engine.make_bid, self.auction.id, self.user1.id, 10)
+        live_auction = engine.auctions[self.auction.id]
+        self.assertEqual((live_auction.seq, live_auction.high_bid, live_auction.has_writes()), (0, None, False))
+        self.assertEqual(engine.get_state(self.auction.id), (None, None))
+
+
+class AuctionSchedulerTest(AuctionTestCase):
+    def setUp(self):
+        super(AuctionSchedulerTest, self).setUp()
+        self.now = timezone.now()
+        self.scheduler = AuctionScheduler(clock=lambda: self.now)
+
+    def test_fires_in_due_order(self):
+        later = self.create_auction(state=UPCOMING, start_time=self.now + datetime.timedelta(minutes=5),
+            expiration_time=self.now + datetime.timedelta(minutes=10))
+        self.assertEqual(self.scheduler.load(), 2)
+        self.assertEqual(self.scheduler.next_due(), later.start_time)
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertTrue(self.reload(later).is_live())
+        self.now += datetime.timedelta(minutes=5)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertTrue(self.reload(later).is_completed())
+        self.assertEqual([(auction_id, transition) for auction_id, transition, lag in self.scheduler.lags],
+            [(later.id, START), (later.id, EXPIRE)])
+        self.now += datetime.timedelta(hours=1)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertTrue(self.reload(self.auction).is_completed())
+        self.assertEqual(self.scheduler.get_lag_stats()['count'], 3)
+
+    def test_refresh_picks_up_rescheduled_auction(self):
+        self.scheduler.load()
+        self.auction.expiration_time = self.now - datetime.timedelta(minutes=1)
+        self.auction.save()
+        new = self.create_auction(state=UPCOMING, start_time=self.now)
+        self.assertEqual(self.scheduler.refresh(), 2)
+        self.assertEqual(self.scheduler.run_pending(), 2)
+        self.assertTrue(self.reload(self.auction).is_completed())
+        self.assertTrue(self.reload(new).is_live())
+
+    def test_failed_transition_is_retried(self):
+        bad = self.create_auction(expiration_time=self.now)
+        #a high bidder without a roster makes expire() raise
+        Auction.objects.filter(id=bad.id).update(high_bidder=User.objects.create_user('owner3'), high_bid_value=5)
+        self.auction.expiration_time = self.now
+        self.auction.save()
+        self.scheduler.load()
+        self.assertEqual(self.scheduler.run_pending(), 2)
+        self.assertTrue(self.reload(self.auction).is_completed())
+        transition, attempts, retry = self.scheduler.failures[bad.id]
+        self.assertEqual((transition, attempts, retry), (EXPIRE, 1, self.now + datetime.timedelta(seconds=5)))
+        #not retried before the backoff, even when refreshed
+        Auction.objects.filter(id=bad.id).update(state=LIVE, modified=self.now)
+        self.scheduler.refresh()
+        self.assertEqual(self.scheduler.next_due(), retry)
+        self.now = retry
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual(self.scheduler.failures[bad.id][1:], (2, self.now + datetime.timedelta(seconds=10)))
+
+
+    def test_run_drops_queries(self):
+        def sleep(delay):
+            self.assertEqual(connection.queries, [])
+            self.scheduler.stop()
+        self.scheduler.sleep = sleep
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            self.scheduler.run()
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        self.assertTrue(self.scheduler.watermark != None)
+
+
+class SweeperTest(AuctionTestCase):
+    def test_sweep(self):
+        now = timezone.now()
+        upcoming = [self.create_auction(state=UPCOMING, start_time=now) for i in range(3)]
+        not_due = self.create_auction(state=UPCOMING, start_time=now + datetime.timedelta(minutes=1))
+        ufa = UFAAuction.objects.create(league=self.league, season=self.season, player=self.player, state=LIVE,
+            start_time=now, expiration_time=now, original_owner=self.user1, discount_percentage=0.5)
+        self.bid(self.user1, 10, auction=ufa)
+        self.bid(self.user2, 5, auction=ufa)
+        #all due auctions start with one UPDATE and one INSERT of their state events, after one SELECT ... FOR UPDATE of them
+        self.assertNumQueries(3, start_due_auctions, now)
+        self.assertEqual([self.reload(auction).state for auction in upcoming + [not_due]], [LIVE, LIVE, LIVE, UPCOMING])
+        #each started auction's state event has the auction's seq
+        for auction in upcoming:
+            self.assertEqual(AuctionEvent.objects.filter(auction=auction, kind=AuctionEvent.STATE, state=LIVE).get().seq,
+                self.reload(auction).seq)
+        self.assertEqual(start_due_auctions(now), 0)
+        self.assertEqual(sweep(now=now, batch_size=1), (0, 1))
+        self.assertTrue(self.reload(ufa).is_completed())
+        self.assertFalse(self.reload(self.auction).is_completed())
+        #original owner wins the UFA auction at a discount
+        self.assertEqual(Roster.objects.get(user=self.user1).total_salary, 2)
+
+
+class CompleteAuctionsTest(AuctionTestCase):
+    def test_complete_batch(self):
+        auctions = [self.auction] + [self.create_auction() for i in range(3)]
+        self.bid(self.user1, 10, auction=auctions[0])
+        self.bid(self.user1, 20, auction=auctions[1])
+        self.bid(self.user2, 5, auction=auctions[1])
+        self.bid(self.user2, 7, auction=auctions[2])
+        #lock, UFA auctions, rosters, roster players, winning bids, auction states, state events, one per affected roster,
+        #   and won notifications
+        self.assertNumQueries(10, complete_auctions, [auction.id for auction in auctions])
+        self.assertEqual(list(Auction.objects.values_list('state', flat=True).distinct()), [COMPLETED])
+        roster1 = Roster.objects.get(user=self.user1)
+        roster2 = Roster.objects.get(user=self.user2)
+        self.assertEqual((roster1.total_salary, roster1.total_players), (6, 2))
+        self.assertEqual((roster2.total_salary, roster2.total_players), (1, 1))
+        self.assertEqual(RosterPlayer.objects.count(), 3)
+        self.assertEqual(Bid.objects.filter(winning_bid=True).count(), 3)
+        #completed auctions are skipped
+        self.assertEqual(complete_auctions([auction.id for auction in auctions]), 0)
+
+    def test_auction_without_roster_is_left_out(self):
+        bad = self.create_auction()
+        Auction.objects.filter(id=bad.id).update(high_bidder=User.objects.create_user('owner3'), high_bid_value=5)
+        self.bid(self.user1, 10)
+        self.assertEqual(complete_auctions([bad.id, self.auction.id]), 1)
+        self.assertTrue(self.reload(self.auction).is_completed())
+        self.assertTrue(self.reload(bad).is_live())
+        self.assertEqual(complete_auctions([bad.id]), 0)
+
+    def test_rosters_updated_in_user_order(self):
+        #user2's roster has the lower id in this league, so roster id order is not user id order
+        league = League.objects.create(name='second league', size=2, salary_cap=100, roster_limit=10)
+        season = Season.objects.create(name='2013', league=league)
+        rosters = [Roster.objects.create(league=league, season=season, user=user, salary_cap=100, total_salary=0,
+            total_players=0) for user in (self.user2, self.user1)]
+        auctions = [Auction.objects.create(league=league, season=season, player=self.player, state=LIVE,
+            start_time=timezone.now(), expiration_time=timezone.now() + datetime.timedelta(hours=1)) for i in range(2)]
+        self.bid(self.user2, 5, auction=auctions[0])
+        self.bid(self.user1, 5, auction=auctions[1])
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            complete_auctions([auction.id for auction in auctions])
+            updates = [query['sql'] for query in connection.queries[start:] if query['sql'].startswith('UPDATE "league_roster"')]
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        self.assertEqual([int(re.search(r'"id" = (\d+)', sql).group(1)) for sql in updates], [rosters[1].id, rosters[0].id])
+
+
+class EventsTest(AuctionTestCase):
+    def test_hub(self):
+        events = EventHub(history=2)
+        for i in range(3):
+            events.publish(['auction:1'], {'value': i})
+        events.publish(['auction:2'], {'value': 3})
+        self.assertEqual(events.get_events('auction:1', 2), ([(3, {'value': 2})], 4, False))
+        #event 1 was dropped from the history of auction:1
+        self.assertTrue(events.get_events('auction:1', 0)[2])
+        self.assertEqual(events.wait('auction:2', 4, 0), ([], 4, False))
+
+    def test_bid_pushes_event(self):
+        since = hub.last_id
+        self.bid(self.user1, 10)
+        response = self.client.get('/auctions/%d/events/' % self.auction.id, {'since': since})
+        content = json.loads(response.content)
+        self.assertFalse(content['reset'])
+        self.assertEqual([(event['type'], event['high_bid_value'], event['high_bidder']) for event in content['events']],
+            [('bid', 1, self.user1.id)])
+        response = self.client.get('/leagues/%d/events/' % self.league.id, {'since': since})
+        self.assertEqual(len(json.loads(response.content)['events']), 1)
+
+    def test_connections_not_held_without_gevent(self):
+        since = hub.last_id
+        url = '/auctions/%d/events/' % self.auction.id
+        with override_settings(AUCTION_EVENTS_TIMEOUT=25):
+            start = time.time()
+            content = json.loads(self.client.get(url, {'since': since}).content)
+            self.assertEqual((content['events'], content['last_id']), ([], since))
+            self.bid(self.user1, 10)
+            response = self.client.get(url, HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(since))
+            stream = ''.join(response)
+            self.assertTrue(time.time() - start < 5)
+        self.assertTrue(stream.startswith('retry: 1000\n\nid: %d\n' % (since + 1)), stream)
+        self.assertNotIn('heartbeat', stream)
+
+    def test_notify_listener(self):
+        events = EventHub()
+        listener = NotifyListener(events, 'auction_events')
+        listener.deliver(json.dumps({'channels': ['auction:1', 'league:2'], 'event': {'seq': 3}}))
+        self.assertEqual(events.get_events('league:2', 0), ([(1, {'seq': 3})], 1, False))
+        #events may have been missed while the listener reconnected
+        events.reset()
+        self.assertTrue(events.get_events('auction:1', 1)[2])
+        self.assertEqual(events.get_events('auction:1', 2), ([], 2, False))
+
+
+class AuctionChangesTest(AuctionTestCase):
+    def get_changes(self, since):
+        return json.loads(self.client.get('/auctions/%d/changes/' % self.auction.id, {'since': since}).content)
+
+    def test_changes_since(self):
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 5)
+        changes = self.get_changes(0)
+        self.assertEqual(changes['seq'], 2)
+        self.assertEqual([(bid['seq'], bid['current_value']) for bid in changes['bids']], [(1, 5), (2, 5)])
+        self.bid(self.user2, 15)
+        changes = self.get_changes(2)
+        self.assertEqual([bid['seq'] for bid in changes['bids']], [3])
+        self.assertEqual((changes['high_bid_value'], changes['high_bidder']), (11, self.user2.id))
+        #state changes increment seq, with no bids
+        complete_auctions([self.auction.id])
+        changes = self.get_changes(3)
+        self.assertEqual((changes['seq'], changes['state'], changes['bids']), (4, COMPLETED, []))
+        self.assertEqual(self.get_changes(4)['bids'], [])
+
+    def test_engine_assigns_seq(self):
+        self.bid(self.user1, 10)
+        engine = BidEngine()
+        engine.warm()
+        engine.make_bid(self.auction.id, self.user2.id, 5)
+        engine.make_bid(self.auction.id, self.user2.id, 15)
+        engine.flush()
+        self.assertEqual(list(Bid.objects.order_by('seq').values_list('seq', flat=True)), [1, 2, 3])
+        self.assertEqual(self.reload(self.auction).seq, 3)
+        engine.release(self.auction.id)
+        self.bid(self.user1, 20)
+        self.assertEqual(self.get_changes(3)['bids'][0]['seq'], 4)
+
+
+class BidHistoryTest(AuctionTestCase):
+    def test_keyset_pages(self):
+        now = timezone.now()
+        #two bids share a time, so pages must break ties by id
+        times = [now, now + datetime.timedelta(seconds=1), now + datetime.timedelta(seconds=1), now + datetime.timedelta(seconds=2), now + datetime.timedelta(seconds=3)]
+        bids = [Bid.objects.create(auction=self.auction, bidder=self.user1, time=bid_time, max_value=10 + i) for i, bid_time in enumerate(times)]
+        pages = []
+        before = None
+        while True:
+            with self.assertNumQueries(1):
+                page, older = load_bid_history(self.auction, before=before, page_size=2)
+                pages.append([(bid.id, bid.bidder.username) for bid in page])
+            if older == None:
+                break
+            before = parse_bid_cursor(older)
+        self.assertEqual(pages, [[(bid.id, 'owner1') for bid in bids[4:2:-1]], [(bid.id, 'owner1') for bid in bids[2:0:-1]],
+            [(bids[0].id, 'owner1')]])
+
+    def test_auction_home(self):
+        for i in range(3):
+            self.bid(self.user1 if i % 2 else self.user2, 10 + i)
+        #ETag, auction, and one page of bids with their bidders
+        with self.assertNumQueries(3):
+            response = self.client.get('/auctions/%d/' % self.auction.id)
+        self.assertEqual([bid.max_value for bid in response.context['bids']], [12, 11, 10])
+        self.assertEqual(response.context['older'], None)
+        self.assertEqual(parse_bid_cursor('invalid'), None)
+
+
+class AuctionETagTest(AuctionTestCase):
+    def test_not_modified(self):
+        url = '/auctions/%d/' % self.auction.id
+        etag = self.client.get(url)['ETag']
+        #the auction's seq and modified, and no page queries
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.bid(self.user1, 10)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        changes_url = '/auctions/%d/changes/' % self.auction.id
+        etag = self.client.get(changes_url, {'since': 1})['ETag']
+        self.assertEqual(self.client.get(changes_url, {'since': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class MyAuctionsTest(AuctionTestCase):
+    def test_status(self):
+        auction2 = self.create_auction(expiration_time=timezone.now() + datetime.timedelta(minutes=10))
+        completed = self.create_auction()
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 5)
+        self.bid(self.user1, 3, auction=auction2)
+        self.bid(self.user2, 8, auction=auction2)
+        self.bid(self.user1, 4, auction=completed)
+        completed.expire()
+        auctions = load_my_auctions(self.user1)
+        self.assertEqual([(auction.id, auction.my_status, auction.my_max_value, auction.headroom, auction.min_bid)
+            for auction in auctions], [(auction2.id, OUTBID, 3, None, 5), (self.auction.id, WINNING, 10, 5, None)])
+        self.assertTrue(0 < auctions[0].seconds_left <= 600)
+        self.assertEqual(load_my_auctions(User.objects.create_user('owner3')), [])
+
+    def test_live_auction_without_high_bid(self):
+        #a bid on an auction that is not live yet is saved without being made, so the auction has no high bid once LIVE
+        upcoming = self.create_auction(state=UPCOMING)
+        self.bid(self.user1, 10, auction=upcoming)
+        Auction.objects.filter(id=upcoming.id).update(state=LIVE)
+        self.assertEqual([(auction.my_status, auction.headroom, auction.min_bid) for auction in load_my_auctions(self.user1)],
+            [(OUTBID, None, 1)])
+        self.user1.set_password('password')
+        self.user1.save()
+        self.client.login(username='owner1', password='password')
+        content = json.loads(self.client.get('/auctions/mine/status/').content)
+        self.assertEqual([(auction['high_bidder_name'], auction['min_bid']) for auction in content['auctions']], [(None, 1)])
+        self.assertContains(self.client.get('/auctions/mine/'), 'no bids yet')
+
+    def test_views(self):
+        self.user1.set_password('password')
+        self.user1.save()
+        self.assertEqual(self.client.get('/auctions/mine/status/').status_code, 302)
+        self.client.login(username='owner1', password='password')
+        self.bid(self.user1, 10)
+        #session, user, max values, auctions
+        with self.assertNumQueries(4):
+            self.client.get('/auctions/mine/status/')
+        for i in range(3):
+            auction = self.create_auction()
+            self.bid(self.user1, 5, auction=auction)
+            self.bid(self.user2, 8, auction=auction)
+        with self.assertNumQueries(4):
+            response = self.client.get('/auctions/mine/status/')
+        content = json.loads(response.content)
+        self.assertEqual([auction['status'] for auction in content['auctions']], ['winning', 'outbid', 'outbid', 'outbid'])
+        self.assertEqual(content['auctions'][1]['min_bid'], 7)
+        with self.assertNumQueries(4):
+            response = self.client.get('/auctions/mine/')
+        self.assertContains(response, 'You have been outbid on 3 auctions')
+
+
+class BenchmarkTest(TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual((percentile(values, 50), percentile(values, 99), percentile([], 50)), (50, 99, None))
+
+    def test_run(self):
+        results = DraftNightBenchmark(owners=3, players=10, auctions=4, bids=40, snipe_auctions=2, snipe_seconds=0.2,
+            seed=1, completion=SCHEDULER).run()
+        self.assertEqual(results['auctions_completed'], 4)
+        #the hot auctions expire during the snipe burst, and are completed as soon as they are due
+        self.assertEqual((results['snipes']['bids'], results['snipes']['auctions_completed']), (8, 2))
+        self.assertTrue(results['queries_per_bid'] >= 3)
+        self.assertEqual(sum(case['bids'] for case in results['queries_per_case'].values()), 40)
+        self.assertTrue(results['queries_per_case']['first']['mean'] >= 6)
+        #the synthetic league is deleted afterwards
+        self.assertEqual((League.objects.count(), Bid.objects.count(), User.objects.count()), (0, 0, 0))
+
+    def test_rejected_bids_are_counted(self):
+        #a single owner's roster fills up after two auctions, so their bids on the others are rejected
+        results = DraftNightBenchmark(owners=1, players=2, auctions=4, bids=20, snipe_seconds=0.1, seed=1).run()
+        self.assertTrue(results['bids_rejected'] > 0)
+        self.assertEqual(results['queries_per_case']['rejected']['bids'], results['bids_rejected'])
+        self.assertEqual(sum(case['bids'] for case in results['queries_per_case'].values()), 20)
+        self.assertEqual(results['auctions_completed'], 4)
+
+    def test_other_auctions_are_not_completed(self):
+        league = League.objects.create(name='real league', size=2, salary_cap=100, roster_limit=10)
+        season = Season.objects.create(name='2013', league=league)
+        player = Player.objects.create(name='Player', team='TM', position='QB')
+        due = Auction.objects.create(league=league, season=season, player=player, state=LIVE, start_time=timezone.now(),
+            expiration_time=timezone.now() - datetime.timedelta(minutes=1))
+        for completion in (SWEEP, SCHEDULER):
+            results = DraftNightBenchmark(owners=2, players=5, auctions=3, bids=10, snipe_seconds=0.1, seed=1,
+                completion=completion).run()
+            self.assertEqual(results['auctions_completed'], 3)
+        self.assertTrue(Auction.objects.get(id=due.id).is_live())
+
+    def test_command_writes_json(self):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            call_command('benchauction', owners=2, players=5, auctions=3, bids=20, snipe_seconds=0.1, seed=1, output=path,
+                stdout=StringIO())
+            with open(path) as output:
+                results = json.load(output)
+        finally:
+            os.remove(path)
+        self.assertEqual(results['config']['bids'], 20)
+        self.assertEqual(results['auctions_completed'], 3)
+        self.assertEqual(sorted(results['latency_ms']), ['max', 'p50', 'p95', 'p99'])
+
+
+class SubmitBidTest(AuctionTestCase):
+    def test_duplicates_return_original(self):
+        bid, created = self.auction.submit_bid(self.user1, 10, idempotency_key='a1')
+        self.assertTrue(created)
+        self.bid(self.user2, 15)
+        #one read of the (bidder, key) index, and the auction is not touched
+        with self.assertNumQueries(1):
+            duplicate, created = self.auction.submit_bid(self.user1, 10, idempotency_key='a1')
+        self.assertFalse(created)
+        self.assertEqual(duplicate.id, bid.id)
+        self.assertEqual((self.reload(self.auction).seq, Bid.objects.count()), (2, 2))
+        #keys are per bidder
+        self.assertTrue(self.auction.submit_bid(self.user2, 20, idempotency_key='a1')[1])
+        #bids without a key are never deduplicated
+        self.assertTrue(self.auction.submit_bid(self.user1, 30)[1])
+        self.assertTrue(self.auction.submit_bid(self.user1, 30)[1])
+
+    def test_invalid_bids_create_no_row(self):
+        self.auction.submit_bid(self.user1, 10)
+        self.assertEqual(self.auction.get_min_bid(), 2)
+        self.assertRaises(ValidationError, self.auction.submit_bid, self.user2, 1, 'c1')
+        self.assertRaises(ValidationError, self.create_auction(state=COMPLETED).submit_bid, self.user1, 10)
+        expired = self.create_auction(expiration_time=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertRaises(ValidationError, expired.submit_bid, self.user1, 10)
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_key_from_another_auction_is_rejected(self):
+        self.auction.submit_bid(self.user1, 10, idempotency_key='b1')
+        auction2 = self.create_auction()
+        self.assertRaises(ValidationError, auction2.submit_bid, self.user1, 10, 'b1')
+        self.assertEqual((self.reload(auction2).seq, Bid.objects.count()), (0, 1))
+
+    def test_concurrent_duplicate_refreshes_auction(self):
+        self.bid(self.user1, 10)
+        auction = self.reload(self.auction)
+        def racing_check_bid(max_value, now=None):
+            #the same key is inserted by another request after the lookup, before this bid is saved
+            Bid.objects.bulk_create([Bid(auction=self.auction, bidder=self.user2, time=timezone.now(), max_value=20,
+                idempotency_key='d1')])
+        auction.check_bid = racing_check_bid
+        bid, created = auction.submit_bid(self.user2, 20, idempotency_key='d1')
+        self.assertFalse(created)
+        self.assertEqual(bid.seq, None)
+        saved = self.reload(self.auction)
+        self.assertEqual((auction.seq, auction.high_bid_value, auction.high_bidder_id), (saved.seq, 1, self.user1.id))
+
+class AuctionBidViewTest(AuctionTestCase):
+    def setUp(self):
+        super(AuctionBidViewTest, self).setUp()
+        self.user1.set_password('password')
+        self.user1.save()
+        self.client.login(username='owner1', password='password')
+        self.url = '/auctions/%d/bid/' % self.auction.id
+
+    def post_json(self, content, **extra):
+        response = self.client.post(self.url, json.dumps(content), content_type='application/json', **extra)
+        return response.status_code, json.loads(response.content)
+
+    def test_bid(self):
+        response = self.client.post(self.url, {'max_value': 10})
+        content = json.loads(response.content)
+        self.assertEqual(content['bid']['current_high_bid'], True)
+        self.assertEqual((content['auction']['seq'], content['auction']['high_bid_value'], content['auction']['min_bid']), (1, 1, 2))
+        self.bid(self.user2, 15)
+        status, content = self.post_json({'max_value': 20}, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual((status, content['bid']['created'], content['auction']['high_bid_value']), (200, True, 16))
+        #a retry gets the original bid, and the auction as it is now
+        status, content = self.post_json({'max_value': 20, 'idempotency_key': 'k1'})
+        self.assertEqual((status, content['bid']['created'], content['bid']['seq']), (200, False, 3))
+        self.assertEqual(Bid.objects.count(), 3)
+
+    def test_rejected_without_bid_rows(self):
+        self.bid(self.user2, 15)
+        #session, user, auction
+        with self.assertNumQueries(3):
+            status, content = self.post_json({'max_value': 1})
+        self.assertEqual((status, content['errors'], content['auction']['min_bid']), (400, ['Bids must be at least 2'], 2))
+        self.assertEqual(self.post_json({'max_value': 'ten'})[0], 400)
+        for max_value in (True, 12.9, '12', None):
+            self.assertEqual(self.post_json({'max_value': max_value})[1]['errors'], ['max_value must be a whole number'])
+        for max_value in ('12.5', '-12', ' 12', ''):
+            response = self.client.post(self.url, {'max_value': max_value})
+            self.assertEqual(json.loads(response.content)['errors'], ['max_value must be a whole number'])
+        self.assertEqual(self.post_json([10])[0], 400)
+        self.assertEqual(self.post_json({'max_value': 5, 'idempotency_key': 'k' * 65})[0], 400)
+        #over the salary cap of 100, checked by make_bid
+        self.assertEqual(self.post_json({'max_value': 101})[1]['errors'], ['A bid of 101 is over your available salary of 100'])
+        Auction.objects.filter(id=self.auction.id).update(state=COMPLETED)
+        self.assertEqual(self.post_json({'max_value': 20})[1]['errors'], ['This auction is not open for bids'])
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class EngineBidViewTest(AuctionTestCase):
+    """ The bid endpoint with AUCTION_BID_ENGINE on """
+    def setUp(self):
+        super(EngineBidViewTest, self).setUp()
+        self.user1.set_password('password')
+        self.user1.save()
+        self.client.login(username='owner1', password='password')
+        self.url = '/auctions/%d/bid/' % self.auction.id
+        self.engine = BidEngine()
+        engine_module._engine = self.engine
+
+    def tearDown(self):
+        engine_module._engine = None
+        super(EngineBidViewTest, self).tearDown()
+
+    def post_json(self, content):
+        response = self.client.post(self.url, json.dumps(content), content_type='application/json')
+        return response.status_code, json.loads(response.content)
+
+    def test_bid(self):
+        status, content = self.post_json({'max_value': 10, 'idempotency_key': 'e1'})
+        self.assertEqual((status, content['auction']['seq'], content['auction']['high_bid_value']), (200, 1, 1))
+        #a retry before the flush gets the pending bid
+        self.assertEqual(self.post_json({'max_value': 10, 'idempotency_key': 'e1'})[1]['bid']['created'], False)
+        status, content = self.post_json({'max_value': 1})
+        self.assertEqual((status, content['errors'], content['auction']['min_bid']), (400, ['Bids must be at least 2'], 2))
+        self.assertEqual(self.post_json({'max_value': 101})[1]['errors'], ['A bid of 101 is over your available salary of 100'])
+        #bids are written by the engine's flush, and direct bids are refused meanwhile
+        self.assertEqual(Bid.objects.count(), 0)
+        self.assertRaises(ValidationError, self.bid, self.user2, 5)
+        self.assertEqual(self.engine.flush(), 1)
+        auction = self.reload(self.auction)
+        self.assertEqual((auction.seq, auction.high_bid_value, auction.high_bidder), (1, 1, self.user1))
+        self.assertEqual(Bid.objects.get().idempotency_key, 'e1')
+        #raising the proxy only needs the difference over the flushed high bid
+        self.assertEqual(self.post_json({'max_value': 100})[0], 200)
+
+    def test_start_engine(self):
+        engine_module._engine = None
+        self.assertEqual(start_engine(), None)
+        with override_settings(AUCTION_BID_ENGINE=True, AUCTION_BID_ENGINE_FLUSH_INTERVAL=3600):
+            engine = start_engine()
+            try:
+                self.assertEqual((get_engine(), start_engine()), (engine, engine))
+                self.assertEqual(engine.get_state(self.auction.id), (None, None))
+            finally:
+                engine.stop()
+
+
+class ExposureTest(AuctionTestCase):
+    def assertExposure(self, user, winning_value, winning_auctions):
+        roster = Roster.objects.get(league=self.league, user=user)
+        self.assertEqual((roster.winning_value, roster.winning_auctions), (winning_value, winning_auctions))
+
+    def test_bids_and_completion(self):
+        auction2 = self.create_auction()
+        self.bid(self.user1, 10)
+        self.bid(self.user1, 30, auction=auction2)
+        self.assertExposure(self.user1, 2, 2)
+        self.bid(self.user2, 5)
+        self.assertExposure(self.user1, 6, 2)
+        self.bid(self.user2, 20)
+        self.assertExposure(self.user1, 1, 1)
+        self.assertExposure(self.user2, 11, 1)
+        complete_auctions([auction2.id])
+        self.reload(self.auction).expire()
+        self.assertExposure(self.user1, 0, 0)
+        self.assertExposure(self.user2, 0, 0)
+        self.assertEqual(Roster.objects.get(league=self.league, user=self.user2).total_salary, 11)
+
+    def test_validation(self):
+        auction2 = self.create_auction()
+        self.bid(self.user1, 60)
+        #the salary cap is 100, and 1 of it is committed to the auction user1 is winning
+        self.assertRaises(ValidationError, self.bid, self.user1, 100, auction2)
+        self.bid(self.user1, 99, auction=auction2)
+        #raising the proxy of a high bid only needs the difference
+        self.bid(self.user1, 98)
+        self.assertRaises(ValidationError, self.bid, self.user1, 100)
+        self.assertEqual(Bid.objects.count(), 3)
+        League.objects.filter(id=self.league.id).update(roster_limit=2)
+        self.assertRaises(ValidationError, self.bid, self.user1, 1, self.create_auction())
+        self.assertRaises(ValidationError, self.bid, User.objects.create_user('owner3'), 5)
+
+    def test_engine_flush(self):
+        self.bid(self.user1, 10)
+        engine = BidEngine()
+        engine.warm()
+        engine.make_bid(self.auction.id, self.user2.id, 5)
+        engine.make_bid(self.auction.id, self.user2.id, 15)
+        self.assertExposure(self.user1, 1, 1)
+        engine.flush()
+        self.assertExposure(self.user1, 0, 0)
+        self.assertExposure(self.user2, 11, 1)
+
+    def test_checkrosters_rebuilds_exposure(self):
+        self.bid(self.user1, 10)
+        Roster.objects.update(winning_value=7, winning_auctions=3)
+        out = StringIO()
+        call_command('checkrosters', repair=True, stdout=out)
+        self.assertIn('2 rosters repaired', out.getvalue())
+        self.assertExposure(self.user1, 1, 1)
+        self.assertExposure(self.user2, 0, 0)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    """ Delivers like the test backend, except to fail@example.com """
+    def send_messages(self, messages):
+        if any('fail@example.com' in message.to for message in messages):
+            raise IOError('delivery failed')
+        return super(FailingEmailBackend, self).send_messages(messages)
+
+
+class NotificationTest(AuctionTestCase):
+    def setUp(self):
+        super(NotificationTest, self).setUp()
+        User.objects.filter(id__in=[self.user1.id, self.user2.id]).update(email='owner@example.com')
+
+    def test_queued_by_bids_and_completion(self):
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 5)
+        self.assertEqual(Notification.objects.count(), 0)
+        self.bid(self.user2, 20)
+        self.bid(self.user1, 30)
+        self.reload(self.auction).expire()
+        engine = BidEngine()
+        auction2 = self.create_auction()
+        engine.load(auction2)
+        engine.make_bid(auction2.id, self.user1.id, 5)
+        engine.make_bid(auction2.id, self.user2.id, 8)
+        engine.flush()
+        self.assertEqual(list(Notification.objects.order_by('id').values_list('user', 'auction', 'kind', 'value')),
+            [(self.user1.id, self.auction.id, Notification.OUTBID, 11), (self.user2.id, self.auction.id, Notification.OUTBID, 21),
+            (self.user1.id, self.auction.id, Notification.WON, 21), (self.user1.id, auction2.id, Notification.OUTBID, 6)])
+
+    def test_digest(self):
+        now = timezone.now()
+        auction2 = self.create_auction(expiration_time=now + datetime.timedelta(minutes=5))
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 20)
+        self.bid(self.user1, 30)
+        self.bid(self.user2, 40)
+        self.bid(self.user1, 3, auction=auction2)
+        self.bid(self.user2, 4, auction=auction2)
+        self.bid(self.user1, 50)
+        self.assertEqual(queue_ending_notifications(now=now), 2)
+        self.assertEqual(queue_ending_notifications(now=now), 0)
+        #held until the oldest notification has waited the interval
+        self.assertEqual(send_digests(now=now, interval=60), 0)
+        self.assertEqual(send_digests(now=now + datetime.timedelta(seconds=61), interval=60), 2)
+        self.assertEqual(Notification.objects.filter(sent=None).count(), 0)
+        messages = dict((message.body.split()[1].rstrip(','), message) for message in mail.outbox)
+        #user1 is winning self.auction again, so only auction2 is in their digest
+        self.assertEqual(messages['owner1'].subject, '2 auction updates')
+        self.assertIn('outbid on QB Player TM - the high bid is now $4', messages['owner1'].body)
+        self.assertIn('The auction for QB Player TM ends', messages['owner1'].body)
+        self.assertEqual(messages['owner2'].subject, '2 auction updates')
+        self.assertIn('the high bid is now $41', messages['owner2'].body)
+        self.assertNotIn('$31', messages['owner2'].body)
+
+    def test_failed_digest_not_resent(self):
+        now = timezone.now()
+        auction2 = self.create_auction()
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 20)
+        self.bid(self.user2, 3, auction=auction2)
+        self.bid(self.user1, 4, auction=auction2)
+        User.objects.filter(id=self.user2.id).update(email='fail@example.com')
+        later = now + datetime.timedelta(seconds=61)
+        with override_settings(EMAIL_BACKEND='auction.tests.FailingEmailBackend'):
+            self.assertRaises(IOError, send_digests, now=later, interval=60)
+        #user1's digest went out before user2's failed, and is not sent again
+        self.assertEqual([message.to for message in mail.outbox], [['owner@example.com']])
+        self.assertEqual(list(Notification.objects.filter(sent=None).values_list('user', flat=True)), [self.user2.id])
+        User.objects.filter(id=self.user2.id).update(email='owner@example.com')
+        self.assertEqual(send_digests(now=later, interval=60), 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_ending_queued_once(self):
+        now = timezone.now()
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 20)
+        Auction.objects.filter(id=self.auction.id).update(expiration_time=now + datetime.timedelta(minutes=5))
+        #the auctions are locked before they are checked, so a worker running at the same time waits, then finds these
+        with self.assertNumQueries(4):
+            self.assertEqual(queue_ending_notifications(now=now), 2)
+        self.assertEqual(queue_ending_notifications(now=now), 0)
+        self.assertEqual(Notification.objects.filter(kind=Notification.ENDING).count(), 2)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('sendnotifications', stdout=out)
+        self.assertEqual(out.getvalue(), '0 ending notifications queued, 0 digests sent\n')
+
+
+class BidTraceTest(AuctionTestCase):
+    def test_schedule_restores_seq_order(self):
+        entries = [TraceEntry(10.5, 1, 2, 3, 20, 11, 3), TraceEntry(10.0, 1, 1, 4, 10, 1, 4), TraceEntry(10.2, 2, 1, 4, 5, 1, 4),
+            TraceEntry(10.4, 1, 3, 4, 15, 16, 3)]
+        self.assertEqual([(round(offset, 3), entry.auction_id, entry.seq) for offset, entry in schedule_trace(entries)],
+            [(0.0, 1, 1), (0.2, 2, 1), (0.5, 1, 2), (0.5, 1, 3)])
+        self.assertEqual(vars(TraceEntry.parse(entries[0].format())), vars(entries[0]))
+
+    def test_record_and_replay(self):
+        handle, path = tempfile.mkstemp(suffix='.trace')
+        os.close(handle)
+        try:
+            with override_settings(AUCTION_BID_TRACE_FILE=path):
+                auction2 = self.create_auction()
+                self.bid(self.user1, 10)
+                self.bid(self.user2, 5)
+                self.bid(self.user2, 15, auction=auction2)
+                self.bid(self.user2, 20)
+                self.bid(self.user1, 8, auction=Auction.objects.create(league=self.league, season=self.season,
+                    player=self.player, state=COMPLETED, start_time=timezone.now(), expiration_time=timezone.now()))
+            recorder.close()
+            entries = read_trace(path)
+            self.assertEqual([(entry.auction_id, entry.seq, entry.max_value, entry.high_bid_value, entry.high_bidder_id)
+                for entry in entries], [(self.auction.id, 1, 10, 1, self.user1.id), (self.auction.id, 2, 5, 5, self.user1.id),
+                (auction2.id, 1, 15, 1, self.user2.id), (self.auction.id, 3, 20, 11, self.user2.id)])
+            output = StringIO()
+            with override_settings(AUCTION_BID_TRACE_FILE=path):
+                call_command('replaytrace', path, speed=0, stdout=output)
+                DraftNightBenchmark(owners=2, players=2, auctions=2, bids=10, seed=1).run()
+            recorder.close()
+            #neither the replayed nor the benchmark's bids are added to the trace
+            self.assertEqual(len(read_trace(path)), 4)
+        finally:
+            os.remove(path)
+        self.assertIn('every auction ended with its recorded high bid', output.getvalue())
+        #the scratch league is deleted afterwards
+        self.assertEqual(League.objects.count(), 1)
+
+    def test_replay_reports_mismatch(self):
+        entries = [TraceEntry(0, 1, 1, 1, 10, 1, 1), TraceEntry(0.001, 1, 2, 2, 5, 7, 1)]
+        results = TraceReplay(entries, speed=10).run()
+        self.assertEqual(results['mismatched_auctions'], [1])
+        self.assertEqual(results['config']['bids'], 2)
+
+
+class MetricsTest(AuctionTestCase):
+    def test_bid_and_completion_metrics(self):
+        first, outbid, bids = BIDS.get(case='first'), BIDS.get(case='outbid'), BID_SECONDS.get_count()
+        completions, lags = COMPLETIONS.get(kind='standard'), EXPIRATION_LAG_SECONDS.get_count()
+        self.bid(self.user1, 10)
+        self.bid(self.user2, 15)
+        self.assertEqual((BIDS.get(case='first'), BIDS.get(case='outbid'), BID_SECONDS.get_count()), (first + 1, outbid + 1, bids + 2))
+        Auction.objects.get(id=self.auction.id).expire()
+        self.assertEqual((COMPLETIONS.get(kind='standard'), EXPIRATION_LAG_SECONDS.get_count()), (completions + 1, lags + 1))
+        content = self.client.get('/metrics/').content
+        self.assertIn('# TYPE auction_bids_total counter', content)
+        self.assertIn('auction_bids_total{case="first"} ', content)
+        self.assertIn('auction_bid_seconds_bucket{le="+Inf"} ', content)
+        self.assertIn('auction_lock_wait_seconds_count ', content)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+
+class EventLogTest(AuctionTestCase):
+    def assertReplays(self, auction, **kwargs):
+        auction = self.reload(auction)
+        state = replay_auction(auction.id, **kwargs)
+        high_bid = auction.get_high_bid()
+        self.assertEqual((state.seq, state.state, state.high_bid_value, state.high_bidder_id, state.high_bid_seq),
+            (auction.seq, auction.state, auction.high_bid_value, auction.high_bidder_id, high_bid.seq if high_bid else None))
+        return state
+
+    def test_replay_matches_auction(self):
+        for user, max_value in [(self.user1, 10), (self.user2, 5), (self.user1, 20), (self.user2, 25), (self.user2, 30), (self.user1, 3)]:
+            self.bid(user, max_value)
+        self.assertEqual(AuctionEvent.objects.filter(auction=self.auction, kind=AuctionEvent.BID).count(), 6)
+        self.assertReplays(self.auction)
+        #state at an earlier seq
+        self.assertEqual(replay_auction(self.auction.id, until_seq=2).high_bid_value, 5)
+        self.assertEqual(take_snapshots(interval=3), 1)
+        self.bid(self.user1, 40)
+        Auction.objects.get(id=self.auction.id).expire()
+        state = self.assertReplays(self.auction)
+        self.assertEqual(state.state, COMPLETED)
+        self.assertEqual(AuctionSnapshot.objects.get().seq, 6)
+        self.assertEqual(vars(replay_auction(self.auction.id, use_snapshots=False)), vars(state))
+
+    def test_events_are_append_only(self):
+        self.bid(self.user1, 10)
+        event = AuctionEvent.objects.get(kind=AuctionEvent.BID)
+        self.assertRaises(ValueError, event.save)
+
+    def test_engine_bids_are_recovered(self):
+        self.bid(self.user1, 10)
+        engine = BidEngine()
+        engine.warm()
+        engine.make_bid(self.auction.id, self.user2.id, 5)
+        engine.make_bid(self.auction.id, self.user2.id, 15)
+        #the engine dies before flushing - its bids are only in the log
+        self.assertEqual(Bid.objects.count(), 1)
+        self.assertEqual(recover_auction(self.auction.id), 2)
+        self.assertReplays(self.auction)
+        self.assertEqual(sorted(Bid.objects.values_list('seq', 'current_value', 'current_high_bid')),
+            [(1, 10, False), (2, 5, False), (3, 11, True)])
+        self.assertEqual(recover_auction(self.auction.id), 0)
+        #a new engine recovers when warmed
+        BidEngine().warm()
+        self.assertEqual(Bid.objects.count(), 3)
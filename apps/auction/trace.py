@@ -0,0 +1,100 @@
+import calendar
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+class TraceEntry(object):
+    """ One bid in a bid trace - a line of tab separated fields
+        Fields:
+            time - when the bid was made, in seconds since the epoch
+            auction_id, seq - auction the bid was made on, and the auction's seq after it
+            bidder_id, max_value - who made the bid, and its max value
+            high_bid_value, high_bidder_id - the auction's high bid after the bid, i.e. the recorded outcome
+    """
+    def __init__(self, time, auction_id, seq, bidder_id, max_value, high_bid_value, high_bidder_id):
+        self.time = time
+        self.auction_id = auction_id
+        self.seq = seq
+        self.bidder_id = bidder_id
+        self.max_value = max_value
+        self.high_bid_value = high_bid_value
+        self.high_bidder_id = high_bidder_id
+
+    @classmethod
+    def parse(cls, line):
+        fields = line.split('\t')
+        return cls(float(fields[0]), *[int(field) for field in fields[1:]])
+
+    def format(self):
+        return '%.6f\t%d\t%d\t%d\t%d\t%d\t%d\n' % (self.time, self.auction_id, self.seq, self.bidder_id, self.max_value,
+            self.high_bid_value, self.high_bidder_id)
+
+class BidTraceRecorder(object):
+    """ Appends every bid made through Bid.save() to a trace file (AUCTION_BID_TRACE_FILE), for replay by auction.bench.TraceReplay.
+        Lines are appended once the bid has committed, with one write each, so several processes can share a file.  Bids
+        that were not made (e.g. the auction was not live) are not recorded, since they do not change an auction.  Nothing
+        is recorded while paused (see paused()), e.g. while a benchmark or replay makes its synthetic bids
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.pauses = 0
+
+    def get_path(self):
+        return self.path if self.path != None else getattr(settings, 'AUCTION_BID_TRACE_FILE', None)
+
+    @contextmanager
+    def paused(self):
+        """ Stops recording, in every thread of the process, until the block exits """
+        with self.lock:
+            self.pauses += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.pauses -= 1
+
+    def record(self, bid, auction):
+        path = self.get_path()
+        if not path or bid.seq == None or self.pauses:
+            return
+        entry = TraceEntry(calendar.timegm(bid.time.utctimetuple()) + bid.time.microsecond / 1e6, bid.auction_id, bid.seq,
+            bid.bidder_id, bid.max_value, auction.high_bid_value, auction.high_bidder_id)
+        with self.lock:
+            if self.file == None or self.file.name != path:
+                self.close()
+                self.file = open(path, 'a', 0)
+            self.file.write(entry.format())
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+recorder = BidTraceRecorder()
+
+def read_trace(path):
+    """ Returns the entries of a trace file, in the order they were recorded """
+    with open(path) as trace:
+        return [TraceEntry.parse(line) for line in trace if line.strip()]
+
+def schedule_trace(entries):
+    """ Returns the entries in replay order, with their offsets in seconds from the first bid.  Lines are appended as
+        bids commit, which can differ from bid time order, so each auction's bids are put back in seq order and none is
+        scheduled before the bid it followed
+    """
+    by_auction = {}
+    for entry in entries:
+        by_auction.setdefault(entry.auction_id, []).append(entry)
+    scheduled = []
+    for auction_entries in by_auction.values():
+        auction_entries.sort(key=lambda entry: entry.seq)
+        at = None
+        for entry in auction_entries:
+            at = entry.time if at == None else max(at, entry.time)
+            scheduled.append((at, entry))
+    scheduled.sort(key=lambda item: (item[0], item[1].auction_id, item[1].seq))
+    start = scheduled[0][0] if scheduled else 0
+    return [(at - start, entry) for at, entry in scheduled]
@@ -4,6 +4,11 @@ from auction import views
 
 urlpatterns = patterns(
     'auction.views',
+    url(r'^mine/$', 'my_auctions', name='my_auctions'),
+    url(r'^mine/status/$', 'my_auctions_status', name='my_auctions_status'),
+    url(r'^{0}/bid/$'.format(r'(?P<auction_id>\d+)'), 'auction_bid', name='auction_bid'),
+    url(r'^{0}/changes/$'.format(r'(?P<auction_id>\d+)'), 'auction_changes', name='auction_changes'),
+    url(r'^{0}/events/$'.format(r'(?P<auction_id>\d+)'), 'auction_events', name='auction_events'),
     url(r'^{0}/$'.format(r'(?P<auction_id>\d+)'), 'auction_home', name='auction_home'),
 )
 
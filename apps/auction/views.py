@@ -1,9 +1,294 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Q
+from django.http import HttpResponse, Http404
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition, require_POST
 
+from auction.constants import LIVE
+from auction.events import hub, can_hold_connections, format_sse, start_listener
 from auction.models import Auction, Bid
 
-def auction_home(request, **kwargs):
-    auction = Auction.objects.get(id=kwargs.pop('auction_id'))
+def load_bid_history(auction, before=None, page_size=None):
+    """ Returns a page of an auction's bids, newest first, with their bidders loaded in the same query, and the cursor of
+        the next (older) page, or None if this is the last page
+        Pages by keyset on (time, id) - before is the (time, id) of the last bid of the previous page - so every page
+        reads page_size + 1 rows from the (auction, time) index, however many bids the auction has
+    """
+    if page_size == None:
+        page_size = getattr(settings, 'AUCTION_BID_HISTORY_PAGE_SIZE', 25)
     bids = Bid.objects.filter(auction=auction)
-    context = {'auction': auction, 'bids': bids}
+    if before != None:
+        before_time, before_id = before
+        bids = bids.filter(Q(time__lt=before_time) | Q(time=before_time, id__lt=before_id))
+    bids = list(bids.select_related('bidder').order_by('-time', '-id')[:page_size + 1])
+    older = None
+    if len(bids) > page_size:
+        bids = bids[:page_size]
+        older = format_bid_cursor(bids[-1])
+    return bids, older
+
+def format_bid_cursor(bid):
+    return '%s_%d' % (bid.time.isoformat(), bid.id)
+
+def parse_bid_cursor(cursor):
+    """ Returns the (time, id) of a cursor from format_bid_cursor(), or None if it is missing or invalid """
+    try:
+        bid_time, bid_id = cursor.rsplit('_', 1)
+        bid_time = parse_datetime(bid_time)
+        bid_id = int(bid_id)
+    except (AttributeError, ValueError):
+        return None
+    if bid_time == None:
+        return None
+    return bid_time, bid_id
+
+def auction_etag(request, **kwargs):
+    """ ETag of an auction page - the auction's seq, which changes with every bid and state change, and modified, which
+        changes with every save.  One primary key lookup, so a client whose page is current gets 304 Not Modified without
+        the page's queries.  None (no ETag) if the auction does not exist
+    """
+    values = list(Auction.objects.filter(id=kwargs['auction_id']).values_list('seq', 'modified'))
+    if not values:
+        return None
+    seq, modified = values[0]
+    return '%s-%s-%s' % (kwargs['auction_id'], seq, modified.strftime('%Y%m%d%H%M%S%f'))
+
+@condition(etag_func=auction_etag)
+def auction_home(request, **kwargs):
+    auction = Auction.objects.select_related('player', 'high_bidder').get(id=kwargs.pop('auction_id'))
+    before = parse_bid_cursor(request.GET.get('before'))
+    bids, older = load_bid_history(auction, before=before)
+    context = {'auction': auction, 'bids': bids, 'older': older, 'is_first_page': before == None}
     return render(request, 'auction_home.html', context)
+
+@condition(etag_func=auction_etag)
+def auction_changes(request, **kwargs):
+    """ Returns the changes to an auction after ?since= (a seq), as JSON:
+        -seq - the auction's current seq.  the client sends it back as since on its next request
+        -state, high_bid_value, high_bidder - the auction's current state, which includes any state change after since
+        -bids - the bids made after since, in seq order, at most AUCTION_CHANGES_LIMIT of them.  if more is True,
+         there are more, and the client requests again with since set to the seq of the last bid
+        Bids are read from the (auction, seq) index, so the cost is in the number of new bids, not the whole history
+    """
+    try:
+        auction = Auction.objects.get(id=kwargs.pop('auction_id'))
+    except Auction.DoesNotExist:
+        raise Http404
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    limit = getattr(settings, 'AUCTION_CHANGES_LIMIT', 200)
+    bids = []
+    if since < auction.seq:
+        bid_values = Bid.objects.filter(auction=auction, seq__gt=since).order_by('seq').values_list('seq', 'bidder',
+            'bidder__username', 'time', 'current_value', 'current_high_bid')[:limit + 1]
+        bids = [{'seq': seq, 'bidder': bidder_id, 'bidder_name': username, 'time': bid_time.isoformat(),
+            'current_value': current_value, 'current_high_bid': current_high_bid}
+            for seq, bidder_id, username, bid_time, current_value, current_high_bid in bid_values]
+    content = {
+        'auction': auction.id,
+        'seq': auction.seq,
+        'state': auction.state,
+        'high_bid_value': auction.high_bid_value,
+        'high_bidder': auction.high_bidder_id,
+        'bids': bids[:limit],
+        'more': len(bids) > limit,
+    }
+    return HttpResponse(json.dumps(content), content_type='application/json')
+
+#status of an owner in an auction they have bid on
+WINNING = 'winning'
+OUTBID = 'outbid'
+
+def load_my_auctions(user, now=None):
+    """ Returns the LIVE auctions the user has bid on, soonest to expire first, in two queries however many auctions
+        or bids there are - the user's highest max value per auction from the (bidder, auction) index, then the auctions
+        with their players and high bidders.  Each auction has:
+            my_max_value - the user's highest max value on the auction
+            my_status - WINNING if the user is the high bidder (Auction.high_bidder), otherwise OUTBID
+            headroom - WINNING: how far the high bid can be pushed up before the user is outbid (max value less the
+                high bid value).  None if OUTBID
+            min_bid - OUTBID: the least the user has to bid to get back in (see Auction.get_min_bid), which is MIN_BID_VALUE
+                if the auction has no high bid, e.g. the user's bid was made before it went LIVE.  None if WINNING
+            seconds_left - seconds until the auction expires
+    """
+    if now == None:
+        now = timezone.now()
+    max_values = dict(Bid.objects.filter(bidder=user, auction__state=LIVE).values_list('auction').annotate(Max('max_value')))
+    if not max_values:
+        return []
+    auctions = list(Auction.objects.filter(id__in=max_values.keys(), state=LIVE).select_related('player', 'high_bidder')
+        .order_by('expiration_time', 'id'))
+    for auction in auctions:
+        auction.my_max_value = max_values[auction.id]
+        if auction.high_bidder_id == user.id:
+            auction.my_status = WINNING
+            auction.headroom = auction.my_max_value - auction.high_bid_value
+            auction.min_bid = None
+        else:
+            auction.my_status = OUTBID
+            auction.headroom = None
+            auction.min_bid = auction.get_min_bid()
+        auction.seconds_left = max(int((auction.expiration_time - now).total_seconds()), 0)
+    return auctions
+
+@login_required
+def my_auctions(request, **kwargs):
+    auctions = load_my_auctions(request.user)
+    context = {'auctions': auctions, 'outbid': len([auction for auction in auctions if auction.my_status == OUTBID])}
+    return render(request, 'my_auctions.html', context)
+
+@login_required
+def my_auctions_status(request, **kwargs):
+    """ Returns the LIVE auctions the user has bid on (see load_my_auctions) as JSON, for polling in place of loading
+        each league auctions board and auction page
+    """
+    auctions = [{
+        'auction': auction.id,
+        'league': auction.league_id,
+        'player': auction.player.get_player_string(),
+        'status': auction.my_status,
+        'high_bid_value': auction.high_bid_value,
+        'high_bidder': auction.high_bidder_id,
+        'high_bidder_name': auction.high_bidder.username if auction.high_bidder_id != None else None,
+        'my_max_value': auction.my_max_value,
+        'headroom': auction.headroom,
+        'min_bid': auction.min_bid,
+        'seconds_left': auction.seconds_left,
+        'seq': auction.seq,
+    } for auction in load_my_auctions(request.user)]
+    return HttpResponse(json.dumps({'auctions': auctions}), content_type='application/json')
+
+def _parse_whole_number(value, is_json):
+    """ Returns value as an int, or None if it is not a whole number - a JSON integer (not a boolean, float or string),
+        or for form data, a string of digits
+    """
+    if is_json:
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            return value
+        return None
+    if isinstance(value, basestring) and value and all(c in '0123456789' for c in value):
+        return int(value)
+    return None
+
+def _auction_state(auction):
+    return {
+        'auction': auction.id,
+        'seq': auction.seq,
+        'state': auction.state,
+        'high_bid_value': auction.high_bid_value,
+        'high_bidder': auction.high_bidder_id,
+        'min_bid': auction.get_min_bid(),
+        'expiration_time': auction.expiration_time.isoformat(),
+    }
+
+def _json_response(content, status=200):
+    return HttpResponse(json.dumps(content), content_type='application/json', status=status)
+
+@login_required
+@require_POST
+def auction_bid(request, **kwargs):
+    """ Submits a bid by the user, from a form POST or a JSON body with max_value, and optionally idempotency_key (or an
+        Idempotency-Key header) so that a retried request is not made twice (see Auction.submit_bid).  The bid is
+        checked against the auction's live state and minimum bid (MIN_BID_VALUE/MIN_BID_INCREMENT over the denormalized
+        high_bid_value) before any Bid row is created.  Returns JSON:
+        -bid - the bid's seq, max value, current value and whether it is the high bid, and created, False for a retry
+        -auction - the auction's state after the bid, so the client does not need to reload it
+        -errors - 400 if the bid was rejected, with the auction's current state
+    """
+    try:
+        auction = Auction.objects.get(id=kwargs.pop('auction_id'))
+    except Auction.DoesNotExist:
+        raise Http404
+    data = request.POST
+    is_json = request.META.get('CONTENT_TYPE', '').startswith('application/json')
+    if is_json:
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return _json_response({'errors': ['Body must be a JSON object'], 'auction': _auction_state(auction)}, status=400)
+    idempotency_key = data.get('idempotency_key') or request.META.get('HTTP_IDEMPOTENCY_KEY')
+    if idempotency_key != None:
+        idempotency_key = unicode(idempotency_key)
+    errors = []
+    max_value = _parse_whole_number(data.get('max_value'), is_json)
+    if max_value == None:
+        errors.append('max_value must be a whole number')
+    if idempotency_key != None and len(idempotency_key) > Bid._meta.get_field('idempotency_key').max_length:
+        errors.append('idempotency_key is too long')
+    if not errors:
+        try:
+            bid, created = auction.submit_bid(request.user, max_value, idempotency_key=idempotency_key)
+        except ValidationError as e:
+            errors.extend(e.messages)
+    if errors:
+        return _json_response({'errors': errors, 'auction': _auction_state(auction)}, status=400)
+    content = {
+        'bid': {'id': bid.id, 'seq': bid.seq, 'max_value': bid.max_value, 'current_value': bid.current_value,
+            'current_high_bid': bid.current_high_bid, 'created': created},
+        'auction': _auction_state(auction),
+    }
+    return _json_response(content)
+
+def auction_events(request, **kwargs):
+    return events_response(request, 'auction:%d' % int(kwargs.pop('auction_id')))
+
+def events_response(request, channel):
+    """ Pushes the events of a channel to the client, without touching the database:
+        -Server-Sent Events stream, if the client accepts text/event-stream.  Resumes after the Last-Event-ID header
+        -Otherwise long-poll: waits up to AUCTION_EVENTS_TIMEOUT seconds for events after ?since=, and returns them as
+         JSON {'events': [...], 'last_id': ..., 'reset': ...}.  Without since, returns the current last_id immediately
+        reset is True when events after since were missed, and the client should reload the page
+        Requests only wait for events on a gevent worker (see auction.events.can_hold_connections), where a waiting
+        request costs an idle greenlet.  Elsewhere the long-poll returns at once and the stream closes once it has sent
+        what it has, so that no server thread is held, and clients poll
+    """
+    start_listener()
+    hold = can_hold_connections()
+    since = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('since'))
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        since = None
+    if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+        response = HttpResponse(_event_stream(channel, since, hold), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    if since == None:
+        events, last_id, reset = hub.get_events(channel, hub.last_id)
+    else:
+        events, last_id, reset = hub.wait(channel, since, getattr(settings, 'AUCTION_EVENTS_TIMEOUT', 25) if hold else 0)
+    content = {'events': [dict(event, id=event_id) for event_id, event in events], 'last_id': last_id, 'reset': reset}
+    return HttpResponse(json.dumps(content), content_type='application/json')
+
+def _event_stream(channel, since, hold):
+    #streams are closed after AUCTION_EVENTS_STREAM_TIMEOUT seconds, or once the current events are sent if the connection
+    #   cannot be held, and the client reconnects with Last-Event-ID
+    deadline = time.time() + (getattr(settings, 'AUCTION_EVENTS_STREAM_TIMEOUT', 300) if hold else 0)
+    heartbeat = getattr(settings, 'AUCTION_EVENTS_TIMEOUT', 25)
+    if since == None:
+        since = hub.last_id
+    yield 'retry: 1000\n\n'
+    while True:
+        remaining = deadline - time.time()
+        events, last_id, reset = hub.wait(channel, since, min(heartbeat, max(remaining, 0)))
+        if reset:
+            since = last_id
+            yield 'event: reset\ndata: {}\n\n'
+        elif not events and remaining > 0:
+            yield ': heartbeat\n\n'
+        for event_id, event in events:
+            since = event_id
+            yield format_sse(event_id, event)
+        if time.time() >= deadline:
+            return
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.signals import request_finished
+from django.db import transaction
+from django.http import HttpResponse
+
+#version keys are given this timeout.  an expired or evicted version comes back higher (see _initial_version), so this
+#   only bounds how often a version is reset, not correctness
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+#hits and misses of cached pages in this process, since it started
+stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+#cache.incr is a read then a write in the local memory backend, so bumps in this process are serialized.  shared
+#   backends (e.g. memcached) increment atomically
+_bump_lock = threading.Lock()
+
+def get_page_cache():
+    """ Returns the cache that versions and pages are kept in, the LEAGUE_PAGE_CACHE alias of CACHES.  The local memory
+        backend is only correct with a single server process, since a version is bumped in the process that made the
+        change - with more than one process (or node), it must be a shared backend such as memcached
+    """
+    return get_cache(getattr(settings, 'LEAGUE_PAGE_CACHE', 'default'))
+
+def _version_key(name):
+    return 'version:%s' % name
+
+def _initial_version():
+    #versions start from the clock in microseconds, so a version that was evicted (or lost in a restart) comes back
+    #   higher than any version pages were cached under, and pages cached before it are never served
+    return int(time.time() * 1000000)
+
+def get_version(name):
+    """ Returns the current version of name ('league:<id>' or 'leagues') """
+    cache = get_page_cache()
+    key = _version_key(name)
+    version = cache.get(key)
+    if version == None:
+        cache.add(key, _initial_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+def bump_version(name):
+    """ Moves name to a new version, so pages cached under the previous one are no longer served.  Called after the
+        change has been committed
+    """
+    cache = get_page_cache()
+    key = _version_key(name)
+    with _bump_lock:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), VERSION_TIMEOUT)
+
+#version of the list of leagues (the home page)
+LEAGUES_VERSION_NAME = 'leagues'
+
+def get_league_version_name(league_id):
+    return 'league:%s' % league_id
+
+def bump_league_version(league_id):
+    """ Invalidates the cached pages of a league """
+    bump_version(get_league_version_name(league_id))
+
+#names changed in a managed transaction of this thread, bumped again once the transaction is over
+_pending = threading.local()
+
+def bump_version_on_commit(name):
+    """ Bumps name for a change that may not be committed yet.  It is bumped now, and, when the change was made in a
+        managed transaction (e.g. an admin view, under commit_on_success), again by bump_pending_versions once the
+        request is finished - a page rendered between the two from the data before the change is cached under the
+        first bump's version, which the second one outdates
+    """
+    bump_version(name)
+    if transaction.is_managed():
+        if not hasattr(_pending, 'names'):
+            _pending.names = set()
+        _pending.names.add(name)
+
+def bump_league_version_on_commit(league_id):
+    """ Invalidates the cached pages of a league, for a change that may not be committed yet """
+    bump_version_on_commit(get_league_version_name(league_id))
+
+def bump_pending_versions(**kwargs):
+    """ Bumps the names changed in managed transactions of this thread since it was last called.  Connected to
+        request_finished, and called by processes that commit outside of requests (e.g. the auction scheduler)
+    """
+    names = getattr(_pending, 'names', None)
+    if names:
+        _pending.names = set()
+        for name in names:
+            bump_version(name)
+
+request_finished.connect(bump_pending_versions)
+
+def _count(stat):
+    with _stats_lock:
+        stats[stat] += 1
+
+def get_cache_stats():
+    """ Returns hits, misses and hit ratio of cached pages in this process """
+    with _stats_lock:
+        hits, misses = stats['hits'], stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'ratio': float(hits) / total if total else None}
+
+def versioned_page(get_name, timeout=None):
+    """ Decorator that caches the content of a GET view (a page or JSON) under the current version of get_name(kwargs).
+        The version is read before the view runs, so a page rendered from data that was changed while it rendered is
+        cached under a version that is already outdated, and is never served
+    """
+    def decorator(view):
+        @wraps(view)
+        def cached_view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            cache = get_page_cache()
+            name = get_name(kwargs)
+            version = get_version(name)
+            key = 'page:%s:%s:%s' % (name, version, hashlib.md5(request.get_full_path()).hexdigest())
+            cached = cache.get(key)
+            if cached != None:
+                _count('hits')
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            _count('misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                page_timeout = timeout if timeout != None else getattr(settings, 'LEAGUE_PAGE_CACHE_TIMEOUT', 3600)
+                cache.set(key, (response.content, response['Content-Type']), page_timeout)
+            return response
+        return cached_view
+    return decorator
+
+def league_page(timeout=None):
+    """ Decorator that caches a league view under the league's version """
+    return versioned_page(lambda kwargs: get_league_version_name(kwargs['league_id']), timeout=timeout)
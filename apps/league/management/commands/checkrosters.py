@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from auction.constants import COMPLETED
+from auction.models import Auction
+from league.models import Roster, RosterPlayer
+
+class Command(BaseCommand):
+    help = ('Verifies roster total_salary and total_players against their players, and winning_value and winning_auctions '
+        'against the auctions their owners are winning, and optionally repairs any drift')
+    option_list = BaseCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair', default=False,
+            help='Fix rosters whose numbers have drifted'),
+    )
+
+    def handle(self, *args, **options):
+        totals = dict((row['roster'], (row['total_salary'], row['total_players']))
+            for row in RosterPlayer.objects.values('roster').annotate(total_salary=Sum('salary'), total_players=Count('id')))
+        #exposure is every auction that has a high bidder and is not completed yet
+        exposure = dict(((row['league'], row['season'], row['high_bidder']), (row['winning_value'], row['winning_auctions']))
+            for row in Auction.objects.exclude(state=COMPLETED).filter(high_bidder__isnull=False).values('league', 'season',
+                'high_bidder').annotate(winning_value=Sum('high_bid_value'), winning_auctions=Count('id')))
+        drifted = 0
+        for roster in Roster.objects.values_list('id', 'league', 'season', 'user', 'total_salary', 'total_players',
+                'winning_value', 'winning_auctions'):
+            roster_id, numbers = roster[0], roster[4:]
+            expected = totals.get(roster_id, (0, 0)) + exposure.get(roster[1:4], (0, 0))
+            if numbers != expected:
+                drifted += 1
+                self.stdout.write('roster %d: total_salary %s, total_players %s, winning_value %s, winning_auctions %s, '
+                    'expected %d, %d, %d, %d\n' % ((roster_id,) + numbers + expected))
+                if options['repair']:
+                    Roster.objects.filter(id=roster_id).update(total_salary=expected[0], total_players=expected[1],
+                        winning_value=expected[2], winning_auctions=expected[3])
+        self.stdout.write('%d rosters %s\n' % (drifted, 'repaired' if options['repair'] else 'drifted'))
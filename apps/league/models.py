@@ -1,8 +1,11 @@
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from fantasyauction.metrics import ROSTER_NUMBERS_SECONDS
+from league.cache import LEAGUES_VERSION_NAME, bump_version_on_commit, bump_league_version_on_commit
 from player.models import Player
 
 class League(models.Model):
@@ -43,6 +46,11 @@ class Roster(models.Model):
             salary_cap - salary cap of this roster, including cap penalties
             total_salary - sum of salaries of all players on the roster
             total_players - number of players on the roster
+            winning_value - sum of the high_bid_value of the auctions (not yet completed) the owner is winning
+            winning_auctions - number of auctions (not yet completed) the owner is winning
+            winning_value and winning_auctions are the owner's exposure - what the owner is committed to if every auction
+            they are winning completes.  They are kept up to date incrementally by bids and completions (see
+            adjust_exposure), so that a bid can be checked against the salary cap and roster limit by reading one row
     """
     league = models.ForeignKey(League)
     season = models.ForeignKey(Season)
@@ -50,24 +58,31 @@ class Roster(models.Model):
     salary_cap = models.IntegerField(blank=True)
     total_salary = models.IntegerField(blank=True)
     total_players = models.IntegerField(blank=True)
+    winning_value = models.IntegerField(default=0)
+    winning_auctions = models.IntegerField(default=0)
 
     def get_players(self):
-        roster_players = RosterPlayer.objects.filter(roster=self)
+        #uses the roster players loaded by prefetch_related('rosterplayer_set'), if any
+        roster_players = self.rosterplayer_set.all()
         return roster_players
 
     def update_roster_numbers(self):
-        """ Updates total_salary and total_players for the roster, generally called
-            after a player has been added to the roster
+        """ Recomputes total_salary and total_players for the roster from its players.  RosterPlayer saves keep the
+            numbers up to date incrementally (see adjust_roster_numbers), so this is only needed to repair drift
         """
-        roster_players = RosterPlayer.objects.filter(roster=self)
-        total_salary = 0
-        total_players = 0
-        for roster_player in roster_players:
-            total_salary += roster_player.salary
-            total_players += 1
-        self.total_salary = total_salary
-        self.total_players = total_players
-        self.save()
+        with ROSTER_NUMBERS_SECONDS.time():
+            totals = RosterPlayer.objects.filter(roster=self).aggregate(total_salary=Sum('salary'), total_players=Count('id'))
+            self.total_salary = totals['total_salary'] or 0
+            self.total_players = totals['total_players']
+            Roster.objects.filter(id=self.id).update(total_salary=self.total_salary, total_players=self.total_players)
+
+    def get_available_salary(self):
+        """ Returns the salary the owner can still commit - the cap less the roster's salary and the auctions the owner is winning """
+        return self.salary_cap - self.total_salary - self.winning_value
+
+    def get_open_spots(self, roster_limit):
+        """ Returns the players the owner can still add under roster_limit, counting the auctions the owner is winning """
+        return roster_limit - self.total_players - self.winning_auctions
 
     def add_player(self, player, salary):
         """ Adds a player to roster by creating a RosterPlayer with the specified salary """
@@ -89,11 +104,106 @@ class RosterPlayer(models.Model):
     player = models.ForeignKey(Player)
     salary = models.IntegerField(blank=True)
 
+    def __init__(self, *args, **kwargs):
+        super(RosterPlayer, self).__init__(*args, **kwargs)
+        #roster and salary as last saved, so that a save or delete can apply the difference to the roster numbers
+        self._saved_roster_id = self.roster_id if self.id != None else None
+        self._saved_salary = self.salary if self.id != None else None
+        #roster it was moved from by the last save, whose league's pages are invalidated too
+        self._moved_from_roster_id = None
+
     def __unicode__(self):
         return self.roster.user.username + ' - ' + self.player.get_player_string()
 
+def adjust_roster_numbers(roster_id, salary, players, winning_value=0, winning_auctions=0):
+    """ Adds salary and players to a roster's total_salary and total_players, and winning_value and winning_auctions to
+        its exposure, with one atomic UPDATE
+    """
+    if salary or players or winning_value or winning_auctions:
+        Roster.objects.filter(id=roster_id).update(total_salary=F('total_salary') + salary, total_players=F('total_players') + players,
+            winning_value=F('winning_value') + winning_value, winning_auctions=F('winning_auctions') + winning_auctions)
+
+def adjust_exposure(league_id, season_id, user_id, winning_value, winning_auctions):
+    """ Adds winning_value and winning_auctions to the exposure of a user's roster, with one atomic UPDATE """
+    if user_id != None and (winning_value or winning_auctions):
+        Roster.objects.filter(league=league_id, season=season_id, user=user_id).update(
+            winning_value=F('winning_value') + winning_value, winning_auctions=F('winning_auctions') + winning_auctions)
+
+def move_exposure(league_id, season_id, old_bidder_id, old_value, new_bidder_id, new_value):
+    """ Applies a change of an auction's high bid (high_bidder and high_bid_value) to the exposure of the rosters of the
+        old and new high bidders.  Rosters are updated in user id order, so concurrent bids cannot deadlock on them
+    """
+    if old_bidder_id == new_bidder_id:
+        adjust_exposure(league_id, season_id, new_bidder_id, (new_value or 0) - (old_value or 0), 0)
+        return
+    changes = [(old_bidder_id, -(old_value or 0), -1), (new_bidder_id, new_value or 0, 1)]
+    for user_id, winning_value, winning_auctions in sorted(change for change in changes if change[0] != None):
+        adjust_exposure(league_id, season_id, user_id, winning_value, winning_auctions)
+
+def _adjust_cached_roster(rosterplayer, salary, players):
+    #keep the roster object the caller holds (e.g. from Roster.add_player) in step with the database
+    if RosterPlayer.roster.is_cached(rosterplayer) and rosterplayer.roster.id == rosterplayer.roster_id:
+        rosterplayer.roster.total_salary += salary
+        rosterplayer.roster.total_players += players
+
 @receiver(post_save, sender=RosterPlayer)
 def update_roster(sender, **kwargs):
+    """ Applies the difference made by a RosterPlayer save to its roster's numbers """
+    rosterplayer = kwargs.get('instance')
+    if rosterplayer._saved_roster_id != rosterplayer.roster_id:
+        if rosterplayer._saved_roster_id != None:
+            adjust_roster_numbers(rosterplayer._saved_roster_id, -rosterplayer._saved_salary, -1)
+        adjust_roster_numbers(rosterplayer.roster_id, rosterplayer.salary, 1)
+        _adjust_cached_roster(rosterplayer, rosterplayer.salary, 1)
+        #the league of the roster it moved from is bumped too (rosterplayer_changed)
+        rosterplayer._moved_from_roster_id = rosterplayer._saved_roster_id
+    elif rosterplayer._saved_salary != rosterplayer.salary:
+        adjust_roster_numbers(rosterplayer.roster_id, rosterplayer.salary - rosterplayer._saved_salary, 0)
+        _adjust_cached_roster(rosterplayer, rosterplayer.salary - rosterplayer._saved_salary, 0)
+    rosterplayer._saved_roster_id = rosterplayer.roster_id
+    rosterplayer._saved_salary = rosterplayer.salary
+
+@receiver(post_delete, sender=RosterPlayer)
+def remove_from_roster(sender, **kwargs):
+    rosterplayer = kwargs.get('instance')
+    if rosterplayer._saved_roster_id != None:
+        adjust_roster_numbers(rosterplayer._saved_roster_id, -rosterplayer._saved_salary, -1)
+
+@receiver(post_save, sender=League)
+@receiver(post_delete, sender=League)
+def league_changed(sender, **kwargs):
+    """ Invalidates the cached pages of a league, and the list of leagues.  Like the receivers below, this runs at save
+        time, which may be before the transaction commits, so the versions are bumped again once it has (see
+        bump_version_on_commit)
+    """
+    bump_league_version_on_commit(kwargs.get('instance').id)
+    bump_version_on_commit(LEAGUES_VERSION_NAME)
+
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+@receiver(post_save, sender=Roster)
+@receiver(post_delete, sender=Roster)
+def league_object_changed(sender, **kwargs):
+    """ Invalidates the cached pages of the league of a Season or Roster """
+    bump_league_version_on_commit(kwargs.get('instance').league_id)
+
+@receiver(post_save, sender=RosterPlayer)
+@receiver(post_delete, sender=RosterPlayer)
+def rosterplayer_changed(sender, **kwargs):
+    """ Invalidates the cached pages of the league of a RosterPlayer, and of the league of the roster it moved from.
+        Uses the roster the caller holds, if any
+    """
     rosterplayer = kwargs.get('instance')
-    roster = rosterplayer.roster
-    roster.update_roster_numbers()
+    roster_ids = set([rosterplayer.roster_id])
+    if rosterplayer._moved_from_roster_id != None:
+        roster_ids.add(rosterplayer._moved_from_roster_id)
+        rosterplayer._moved_from_roster_id = None
+    league_ids = set()
+    if RosterPlayer.roster.is_cached(rosterplayer) and rosterplayer.roster.id == rosterplayer.roster_id:
+        league_ids.add(rosterplayer.roster.league_id)
+        roster_ids.discard(rosterplayer.roster_id)
+    if roster_ids:
+        #no roster when it is being deleted with its players - its own delete bumps the league
+        league_ids.update(Roster.objects.filter(id__in=roster_ids).values_list('league', flat=True))
+    for league_id in league_ids:
+        bump_league_version_on_commit(league_id)
@@ -5,7 +5,25 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import datetime
+import json
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from fantasyauction.instrumentation import request_stats
+
+from auction.constants import UPCOMING, LIVE
+from auction.models import Auction, Bid
+
+from league.cache import get_cache_stats, get_page_cache, get_version, get_league_version_name, bump_league_version, \
+    bump_pending_versions
+from league.models import League, Season, Roster, RosterPlayer
+from player.models import Player
 
 
 class SimpleTest(TestCase):
@@ -14,3 +32,189 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class LeagueTestCase(TestCase):
+    """ Creates a league with two owners and their rosters """
+    def setUp(self):
+        #ids are reused between tests, so pages cached by a previous test must not be served
+        get_page_cache().clear()
+        self.league = League.objects.create(name='test league', size=2, salary_cap=100, roster_limit=10)
+        self.season = Season.objects.create(name='2013', league=self.league)
+        self.user1 = User.objects.create_user('owner1')
+        self.user2 = User.objects.create_user('owner2')
+        self.roster1 = self.create_roster(self.user1)
+        self.roster2 = self.create_roster(self.user2)
+        #the setup is not made by a request, whose end would bump its leagues again
+        bump_pending_versions()
+
+    def create_roster(self, user):
+        self.league.users.add(user)
+        return Roster.objects.create(league=self.league, season=self.season, user=user, salary_cap=100, total_salary=0, total_players=0)
+
+    def create_player(self, name):
+        return Player.objects.create(name=name, team='TM', position='QB')
+
+    def reload(self, obj):
+        return obj.__class__.objects.get(id=obj.id)
+
+
+class RosterNumbersTest(LeagueTestCase):
+    def assertNumbers(self, roster, total_salary, total_players):
+        roster = self.reload(roster)
+        self.assertEqual((roster.total_salary, roster.total_players), (total_salary, total_players))
+
+    def test_incremental_numbers(self):
+        self.roster1.add_player(player=self.create_player('a'), salary=10)
+        self.roster1.add_player(player=self.create_player('b'), salary=5)
+        self.assertEqual((self.roster1.total_salary, self.roster1.total_players), (15, 2))
+        self.assertNumbers(self.roster1, 15, 2)
+        roster_player = RosterPlayer.objects.get(salary=5)
+        roster_player.salary = 8
+        #save of the roster player (SELECT and UPDATE), one UPDATE of the roster, and the roster's league for the page cache
+        self.assertNumQueries(4, roster_player.save)
+        self.assertNumbers(self.roster1, 18, 2)
+        roster_player.roster = self.roster2
+        roster_player.save()
+        self.assertNumbers(self.roster1, 10, 1)
+        self.assertNumbers(self.roster2, 8, 1)
+        roster_player.delete()
+        self.assertNumbers(self.roster2, 0, 0)
+
+    def test_checkrosters_repairs_drift(self):
+        self.roster1.add_player(player=self.create_player('a'), salary=10)
+        Roster.objects.filter(id=self.roster1.id).update(total_salary=3)
+        out = StringIO()
+        call_command('checkrosters', stdout=out)
+        self.assertIn('1 rosters drifted', out.getvalue())
+        self.assertNumbers(self.roster1, 3, 1)
+        call_command('checkrosters', repair=True, stdout=StringIO())
+        self.assertNumbers(self.roster1, 10, 1)
+
+
+class LeagueRostersTest(LeagueTestCase):
+    def test_constant_queries(self):
+        url = '/leagues/%d/rosters/' % self.league.id
+        self.roster1.add_player(player=self.create_player('a'), salary=1)
+        #league, rosters with users, roster players, players
+        self.assertNumQueries(4, self.client.get, url)
+        for i in range(3):
+            roster = self.create_roster(User.objects.create_user('owner%d' % (i + 3)))
+            for j in range(5):
+                roster.add_player(player=self.create_player('%d-%d' % (i, j)), salary=j + 1)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'QB 2-4 TM $5')
+        self.assertContains(response, 'Total players: 5/10', count=3)
+
+
+class LeagueAuctionsTest(LeagueTestCase):
+    def create_auction(self, state, season=None):
+        now = timezone.now()
+        return Auction.objects.create(league=self.league, season=season or self.season, player=self.create_player('p'),
+            state=state, start_time=now, expiration_time=now + datetime.timedelta(hours=1))
+
+    def test_board(self):
+        url = '/leagues/%d/auctions/' % self.league.id
+        for i in range(3):
+            auction = self.create_auction(LIVE)
+            Auction.objects.filter(id=auction.id).update(high_bid_value=i + 5, high_bidder=self.user2)
+        self.create_auction(UPCOMING, season=Season.objects.create(name='2014', league=self.league))
+        #league, seasons, auctions with players and high bidders
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, 'owner2', count=3)
+        self.assertContains(response, '$7')
+        self.assertContains(response, 'Upcoming', count=2)
+        response = self.client.get(url, {'state': UPCOMING})
+        self.assertEqual(len(response.context['auctions']), 1)
+        response = self.client.get(url, {'season': self.season.id, 'state': 'x'})
+        self.assertEqual(len(response.context['auctions']), 3)
+
+
+class LeaguePageCacheTest(LeagueTestCase):
+    def test_bump_invalidates(self):
+        url = '/leagues/%d/rosters/' % self.league.id
+        self.client.get(url)
+        stats = get_cache_stats()
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(get_cache_stats()['hits'], stats['hits'] + 1)
+        self.assertNotContains(response, 'QB a TM')
+        #completing an auction adds the player, and bumps the league's version
+        now = timezone.now()
+        auction = Auction.objects.create(league=self.league, season=self.season, player=self.create_player('a'),
+            state=LIVE, start_time=now, expiration_time=now)
+        Bid(auction=auction, bidder=self.user1, time=now, max_value=5).save()
+        Auction.objects.get(id=auction.id).expire()
+        self.assertContains(self.client.get(url), 'QB a TM $1')
+        #pages of other leagues are not invalidated
+        other = League.objects.create(name='other', size=2, salary_cap=100, roster_limit=10)
+        version = get_version(get_league_version_name(other.id))
+        bump_league_version(self.league.id)
+        self.assertEqual(get_version(get_league_version_name(other.id)), version)
+
+    def test_evicted_version_is_higher(self):
+        name = get_league_version_name(self.league.id)
+        version = get_version(name)
+        bump_league_version(self.league.id)
+        get_page_cache().delete('version:%s' % name)
+        self.assertTrue(get_version(name) > version + 1)
+
+    def test_bumped_again_after_commit(self):
+        name = get_league_version_name(self.league.id)
+        version = get_version(name)
+        #tests run in a managed transaction, as the admin's views do
+        self.season.save()
+        bumped = get_version(name)
+        self.assertTrue(bumped > version)
+        #a page rendered before the save commits is cached under the bumped version, which is outdated once it has
+        bump_pending_versions()
+        self.assertTrue(get_version(name) > bumped)
+        version = get_version(name)
+        bump_pending_versions()
+        self.assertEqual(get_version(name), version)
+
+    def test_moved_player_bumps_both_leagues(self):
+        other = League.objects.create(name='other', size=2, salary_cap=100, roster_limit=10)
+        other_roster = Roster.objects.create(league=other, season=Season.objects.create(name='2013', league=other),
+            user=self.user1, salary_cap=100, total_salary=0, total_players=0)
+        self.roster1.add_player(player=self.create_player('a'), salary=1)
+        versions = [get_version(get_league_version_name(league.id)) for league in (self.league, other)]
+        rosterplayer = RosterPlayer.objects.get(roster=self.roster1)
+        rosterplayer.roster = other_roster
+        rosterplayer.save()
+        for league, version in zip((self.league, other), versions):
+            self.assertTrue(get_version(get_league_version_name(league.id)) > version)
+
+
+class LeagueETagTest(LeagueTestCase):
+    def test_not_modified(self):
+        url = '/leagues/%d/rosters/' % self.league.id
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.roster1.add_player(player=self.create_player('a'), salary=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class RequestStatsTest(LeagueTestCase):
+    @override_settings(REQUEST_STATS_SAMPLE_RATE=1.0)
+    def test_stats_by_view(self):
+        request_stats.reset()
+        self.roster1.add_player(player=self.create_player('a'), salary=1)
+        for i in range(3):
+            get_page_cache().clear()
+            self.client.get('/leagues/%d/rosters/' % self.league.id)
+        #staff only - others get the admin login page
+        self.assertNotEqual(self.client.get('/stats/requests/')['Content-Type'], 'application/json')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        stats = json.loads(self.client.get('/stats/requests/').content)['league.views.league_rosters']
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['queries']['p50'], 4)
+        self.assertTrue(stats['template_ms']['max'] > 0)
+        self.assertEqual(len(stats['slowest_queries']), 5)
@@ -1,21 +1,75 @@
+import time
+
+from django.conf import settings
 from django.shortcuts import render
+from django.views.decorators.http import condition
 
 from auction.models import Auction
-from league.models import League, Roster
+from auction.views import events_response
+from league.cache import get_version, get_league_version_name, league_page
+from league.models import League, Season, Roster
+
+def league_etag(request, **kwargs):
+    """ ETag of a league page - the league's version, so a client whose page is current gets 304 Not Modified without
+        touching the database
+    """
+    return '%s-%s' % (kwargs['league_id'], get_version(get_league_version_name(kwargs['league_id'])))
+
+def league_auctions_etag(request, **kwargs):
+    #the board shows time remaining, so its ETag also changes every LEAGUE_AUCTIONS_CACHE_TIMEOUT seconds
+    period = int(time.time() // getattr(settings, 'LEAGUE_AUCTIONS_CACHE_TIMEOUT', 60))
+    return '%s-%s' % (league_etag(request, **kwargs), period)
 
+@condition(etag_func=league_etag)
+@league_page()
 def league_home(request, **kwargs):
     league = League.objects.get(id=kwargs.pop('league_id'))
     context = {'league': league}
     return render(request, 'league_home.html', context)
 
+def load_rosters(league):
+    """ Returns the league's rosters with their users, roster players and players loaded, in three queries
+        regardless of the number of rosters or players
+    """
+    return Roster.objects.filter(league=league).select_related('user').prefetch_related('rosterplayer_set__player')
+
+@condition(etag_func=league_etag)
+@league_page()
 def league_rosters(request, **kwargs):
     league = League.objects.get(id=kwargs.pop('league_id'))
-    rosters = Roster.objects.filter(league=league)
+    rosters = load_rosters(league)
     context = {'league': league, 'rosters': rosters}
     return render(request, 'league_rosters.html', context)
 
+def load_auctions(league, season_id=None, state=None):
+    """ Returns the league's auctions, optionally filtered by season and state, with their players and high bidders
+        loaded in the same query
+    """
+    auctions = Auction.objects.filter(league=league)
+    if season_id != None:
+        auctions = auctions.filter(season=season_id)
+    if state != None:
+        auctions = auctions.filter(state=state)
+    return auctions.select_related('player', 'high_bidder').order_by('expiration_time', 'id')
+
+def _get_int(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+#the board shows time remaining, so it is only cached for as long as that stays accurate
+@condition(etag_func=league_auctions_etag)
+@league_page(timeout=getattr(settings, 'LEAGUE_AUCTIONS_CACHE_TIMEOUT', 60))
 def league_auctions(request, **kwargs):
     league = League.objects.get(id=kwargs.pop('league_id'))
-    auctions = Auction.objects.filter(league=league)
-    context = {'league': league, 'auctions': auctions}
+    season_id = _get_int(request, 'season')
+    state = _get_int(request, 'state')
+    auctions = load_auctions(league, season_id=season_id, state=state)
+    seasons = Season.objects.filter(league=league)
+    context = {'league': league, 'auctions': auctions, 'seasons': seasons, 'states': Auction.STATE_CHOICES,
+        'season_id': season_id, 'state': state}
     return render(request, 'league_auctions.html', context)
+
+def league_events(request, **kwargs):
+    return events_response(request, 'league:%d' % int(kwargs.pop('league_id')))
@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Template
+
+from fantasyauction.metrics import percentile
+
+#state of the request being instrumented in this thread
+_local = threading.local()
+
+class RequestStats(object):
+    """ Rolling per-view timings of instrumented requests, kept in this process
+        Fields:
+            history - samples kept per view, the percentiles are over these
+            slow_queries - slowest statements kept per view
+            samples - view name -> deque of (total seconds, queries, db seconds, template seconds)
+            slowest - view name -> list of (seconds, sql), slowest first
+            counts - view name -> number of requests instrumented since the process started
+    """
+    def __init__(self, history=None, slow_queries=None):
+        self.history = history if history != None else getattr(settings, 'REQUEST_STATS_HISTORY', 1000)
+        self.slow_queries = slow_queries if slow_queries != None else getattr(settings, 'REQUEST_STATS_SLOW_QUERIES', 5)
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.slowest = {}
+        self.counts = {}
+
+    def record(self, view, total, queries, db_time, template_time):
+        """ Records a request to view.  queries is a list of (seconds, sql) """
+        with self.lock:
+            self.samples.setdefault(view, deque(maxlen=self.history)).append((total, len(queries), db_time, template_time))
+            self.counts[view] = self.counts.get(view, 0) + 1
+            slowest = self.slowest.get(view, []) + sorted(queries, reverse=True)[:self.slow_queries]
+            self.slowest[view] = sorted(slowest, reverse=True)[:self.slow_queries]
+
+    def get_stats(self):
+        """ Returns the stats of each view as a JSON serializable dict """
+        with self.lock:
+            samples = dict((view, list(view_samples)) for view, view_samples in self.samples.items())
+            slowest = dict(self.slowest)
+            counts = dict(self.counts)
+        stats = {}
+        for view, view_samples in samples.items():
+            view_stats = {'count': counts[view], 'samples': len(view_samples)}
+            for i, name in enumerate(('total_ms', 'queries', 'db_ms', 'template_ms')):
+                values = sorted(sample[i] * 1000 if name.endswith('_ms') else sample[i] for sample in view_samples)
+                view_stats[name] = {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+                    'max': values[-1]}
+            view_stats['slowest_queries'] = [{'ms': seconds * 1000, 'sql': sql} for seconds, sql in slowest.get(view, [])]
+            stats[view] = view_stats
+        return stats
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.slowest = {}
+            self.counts = {}
+
+request_stats = RequestStats()
+
+#the unpatched Template.render, even if this module is imported again
+_template_render = getattr(Template.render, 'untimed', Template.render)
+
+def _timed_template_render(self, context):
+    #only the outermost render is timed, since included templates render inside it
+    if getattr(_local, 'template_depth', None) == None:
+        return _template_render(self, context)
+    _local.template_depth += 1
+    start = time.time()
+    try:
+        return _template_render(self, context)
+    finally:
+        _local.template_depth -= 1
+        if _local.template_depth == 0:
+            _local.template_time += time.time() - start
+
+#Template.render is wrapped once, when this module is imported.  Renders are only timed during a sampled request, outside
+#   of which the wrapper just calls the original
+_timed_template_render.untimed = _template_render
+Template.render = _timed_template_render
+
+class RequestStatsMiddleware(object):
+    """ Records, for a sample of requests (REQUEST_STATS_SAMPLE_RATE), the total time, number of SQL queries, database
+        time, template render time and slowest statements, grouped by view, in request_stats.  Requests that are not
+        sampled only cost a random number, so this can be left on in production with a low sample rate.  Place it first
+        in MIDDLEWARE_CLASSES, so the other middleware is included in the total
+    """
+    def process_request(self, request):
+        if random.random() >= getattr(settings, 'REQUEST_STATS_SAMPLE_RATE', 0.05):
+            return None
+        #queries are only recorded by the debug cursor.  connection.queries is reset when each request starts
+        request._stats = {'start': time.time(), 'view': None, 'use_debug_cursor': connection.use_debug_cursor,
+            'first_query': len(connection.queries)}
+        connection.use_debug_cursor = True
+        _local.template_depth = 0
+        _local.template_time = 0.0
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_stats'):
+            request._stats['view'] = '%s.%s' % (view_func.__module__, view_func.__name__)
+        return None
+
+    def process_response(self, request, response):
+        sample = getattr(request, '_stats', None)
+        if sample == None:
+            return response
+        total = time.time() - sample['start']
+        connection.use_debug_cursor = sample['use_debug_cursor']
+        template_time = _local.template_time
+        _local.template_depth = None
+        queries = [(float(query['time']), query['sql'][:1000]) for query in connection.queries[sample['first_query']:]]
+        db_time = sum(seconds for seconds, sql in queries)
+        request_stats.record(sample['view'] or 'unresolved', total, queries, db_time, template_time)
+        return response
@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+
+#default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def percentile(values, p):
+    """ Returns the p-th percentile (0-100) of sorted values, by nearest rank """
+    if not values:
+        return None
+    rank = max(int(round(p / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+class Registry(object):
+    """ Metrics of this process, exported in the Prometheus text format.  Each server process has its own, so every
+        process is scraped separately
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """ Registers a function returning (name, type, help, value) samples, read at export time """
+        with self.lock:
+            self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        """ Returns every metric in the Prometheus text exposition format """
+        lines = []
+        for metric in list(self.metrics):
+            lines.extend(metric.render())
+        for collector in list(self.collectors):
+            for name, metric_type, help_text, value in collector():
+                lines.extend(['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, metric_type),
+                    '%s %s' % (name, _format_value(value))])
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {} #label values -> value
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s %s' % (self.name, self.type)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+class Counter(Metric):
+    """ Count of events, e.g. Counter('auction_bids_total', 'Bids made', ['case']).inc(case='first') """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, key), _format_value(value))]
+
+class Histogram(Metric):
+    """ Distribution of observed values (e.g. seconds) over buckets """
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """ Returns a context manager that observes the seconds spent in it """
+        return _Timer(self, labels)
+
+    def get_count(self, **labels):
+        counts, total = self.values.get(self._key(labels), ([0], 0.0))
+        return sum(counts)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (self.name, _format_labels(self.labelnames, key, [('le', _format_value(bound))]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, _format_labels(self.labelnames, key), _format_value(total)))
+        lines.append('%s_count%s %d' % (self.name, _format_labels(self.labelnames, key), cumulative))
+        return lines
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+        return False
+
+#bidding
+BIDS = Counter('auction_bids_total', 'Bids made through Auction.make_bid/Bid.save, by proxy case (rejected if the auction was not live)', ['case'])
+BID_SECONDS = Histogram('auction_bid_seconds', 'Seconds to make and commit a bid, including the auction lock wait')
+LOCK_WAIT_SECONDS = Histogram('auction_lock_wait_seconds', 'Seconds spent acquiring the auction row lock (SELECT ... FOR UPDATE)')
+
+#completion
+COMPLETIONS = Counter('auction_completions_total', 'Auctions completed, by kind (standard or ufa)', ['kind'])
+COMPLETION_SECONDS = Histogram('auction_completion_seconds', 'Seconds to complete auctions, by path (expire, or batch for the sweeper)', ['path'])
+EXPIRATION_LAG_SECONDS = Histogram('auction_expiration_lag_seconds', 'Seconds between an auction\'s expiration_time and its completion',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+ROSTER_NUMBERS_SECONDS = Histogram('roster_update_numbers_seconds', 'Seconds to recompute a roster\'s numbers (Roster.update_roster_numbers)')
+
+def _league_cache_samples():
+    from league.cache import get_cache_stats
+    stats = get_cache_stats()
+    return [('league_page_cache_hits_total', 'counter', 'League pages served from the cache', stats['hits']),
+        ('league_page_cache_misses_total', 'counter', 'League pages rendered and cached', stats['misses'])]
+
+registry.register_collector(_league_cache_samples)
@@ -96,6 +96,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'fantasyauction.instrumentation.RequestStatsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -107,6 +108,65 @@ MIDDLEWARE_CLASSES = (
 
 ROOT_URLCONF = 'fantasyauction.urls'
 
+#addresses allowed to scrape /metrics/ (fantasyauction.metrics), in the Prometheus text format
+METRICS_ALLOWED_IPS = ('127.0.0.1',)
+
+#request instrumentation (fantasyauction.instrumentation.RequestStatsMiddleware), dumped at /stats/requests/ for staff
+REQUEST_STATS_SAMPLE_RATE = 0.05 #fraction of requests instrumented
+REQUEST_STATS_HISTORY = 1000 #samples kept per view for percentiles
+REQUEST_STATS_SLOW_QUERIES = 5 #slowest statements kept per view
+
+#local memory is only correct for a single server process.  with more than one process or node, use a shared backend
+#   so that every process sees the same league versions, e.g.
+#   'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fantasyauction',
+    }
+}
+
+#league page cache (league.cache)
+LEAGUE_PAGE_CACHE = 'default' #CACHES alias that league versions and cached pages are kept in
+LEAGUE_PAGE_CACHE_TIMEOUT = 3600 #seconds a page is cached for, unless its league's version changes first
+LEAGUE_AUCTIONS_CACHE_TIMEOUT = 60 #seconds the league auctions board is cached for, since it shows time remaining
+
+#in-memory bid engine (auction.engine.BidEngine).  When on, the web process resolves bids on LIVE auctions in memory, and
+#   writes them behind.  Only for a deployment with a single web process, since each process's engine gives out seqs
+#   on its own
+AUCTION_BID_ENGINE = False
+AUCTION_BID_ENGINE_FLUSH_INTERVAL = 0.25 #seconds between write-behind flushes
+
+#seconds between the auction scheduler's checks for new and rescheduled auctions (auction.scheduler.AuctionScheduler)
+AUCTION_SCHEDULER_TOLERANCE = 1.0
+
+#file every bid made through Bid.save() is appended to, for replay by the replaytrace command (auction.trace), or None
+#   to not record bids
+AUCTION_BID_TRACE_FILE = None
+
+#bids per page of an auction's bid history (auction.views.auction_home)
+AUCTION_BID_HISTORY_PAGE_SIZE = 25
+
+#most bids returned by one request to the auction changes endpoint (auction.views.auction_changes)
+AUCTION_CHANGES_LIMIT = 200
+
+#auction push events (auction.events.EventHub).  The push endpoints (/auctions/<id>/events/, /leagues/<id>/events/) only
+#   hold connections open on gevent workers, e.g. gunicorn -k gevent fantasyauction.wsgi:application, where a waiting
+#   client is an idle greenlet.  On other workers they answer at once and clients poll
+AUCTION_EVENTS_HISTORY = 100 #events held per auction/league channel, for clients resuming after a reconnect
+AUCTION_EVENTS_HOLD_CONNECTIONS = None #True/False to force whether push requests wait for events, None to wait on gevent only
+AUCTION_EVENTS_TIMEOUT = 25 #seconds a long-poll request waits for an event, and between stream heartbeats
+AUCTION_EVENTS_STREAM_TIMEOUT = 300 #seconds before a Server-Sent Events stream is closed, and the client reconnects
+
+#Postgres NOTIFY channel auction events are published on, so that the push endpoints of every process get the events of
+#   every other process, including the scheduler, sweeper and bid engine (auction.events.NotifyListener).  None to only
+#   push events to clients of the process they happen in
+AUCTION_EVENTS_NOTIFY_CHANNEL = None
+
+#outbid/won/ending notifications (auction.notifications, sendnotifications command)
+AUCTION_NOTIFICATION_DIGEST_INTERVAL = 60 #seconds an owner's notifications are held, so that they are sent as one email
+AUCTION_NOTIFICATION_ENDING_WARNING = 600 #seconds before an auction expires that its bidders are told it is ending
+
 # Python dotted path to the WSGI application used by Django's runserver.
 WSGI_APPLICATION = 'fantasyauction.wsgi.application'
 
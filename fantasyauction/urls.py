@@ -10,6 +10,8 @@ urlpatterns = patterns('fantasyauction.views',
     url(r'^$', 'home', name='home'),
     url(r'^leagues/', include('league.urls')),
     url(r'^auctions/', include('auction.urls')),
+    url(r'^stats/requests/$', 'request_stats_view', name='request_stats'),
+    url(r'^metrics/$', 'metrics', name='metrics'),
 
     # admin
     url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
@@ -1,8 +1,32 @@
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 
+from fantasyauction.instrumentation import request_stats
+from fantasyauction.metrics import registry
+
+from league.cache import LEAGUES_VERSION_NAME, versioned_page
 from league.models import League
 
+@versioned_page(lambda kwargs: LEAGUES_VERSION_NAME)
 def home(request):
     leagues = League.objects.all()
     context = {'leagues': leagues}
     return render(request, 'home.html', context)
+
+@staff_member_required
+def request_stats_view(request):
+    """ Dumps the per-view request stats of this process as JSON, for staff only.  ?reset=1 clears them afterwards """
+    stats = request_stats.get_stats()
+    if request.GET.get('reset'):
+        request_stats.reset()
+    return HttpResponse(json.dumps(stats, indent=2, sort_keys=True), content_type='application/json')
+
+def metrics(request):
+    """ Exports this process's metrics in the Prometheus text format, to METRICS_ALLOWED_IPS only """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1',)):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
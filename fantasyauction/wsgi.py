@@ -23,6 +23,13 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fantasyauction.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Start the in-memory bid engine with the process, if AUCTION_BID_ENGINE is on, and the listener for auction events
+# published by other processes, if AUCTION_EVENTS_NOTIFY_CHANNEL is set
+from auction.engine import start_engine
+from auction.events import start_listener
+start_engine()
+start_listener()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)